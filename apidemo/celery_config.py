@@ -81,6 +81,31 @@ def test(self):
     print("test task......")
 
 
+@shared_task(name="apidemo.celery_config.archive_soft_deleted")
+def archive_soft_deleted(model_labels=None, days=None, max_rows=None):
+    """把软删除超过ARCHIVE_AFTER_DAYS天的数据归档到ARCHIVE_DIR，返回每个模型的归档行数和字节数"""
+    from django.apps import apps
+    from django.conf import settings
+
+    from core.archive import archive_soft_deleted as archive
+
+    older_than = timedelta(days=days) if days is not None else None
+    reports = []
+    for label in model_labels or getattr(settings, "ARCHIVE_MODELS", []):
+        report = archive(apps.get_model(label), older_than=older_than, max_rows=max_rows)
+        logger.info(f"archive soft deleted: {report}")
+        reports.append(report)
+    return reports
+
+
+@app.task(name="apidemo.celery_config.import_rows")
+def import_rows(job_id):
+    """执行ImportRouter创建的导入任务"""
+    from core.importer import run_import
+
+    run_import(job_id)
+
+
 app.conf.beat_schedule = {
     "ping123": {
         "task": "apidemo.celery_config.test.ping124",
@@ -90,4 +115,8 @@ app.conf.beat_schedule = {
         "task": "apidemo.celery_config.test",
         "schedule": timedelta(seconds=3),
     },
+    "archive_soft_deleted": {
+        "task": "apidemo.celery_config.archive_soft_deleted",
+        "schedule": crontab(hour=3, minute=0),
+    },
 }
@@ -38,14 +38,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'core',
     'employee',
     'ninja_jwt',
     'django_celery_beat',
 ]
 
 MIDDLEWARE = [
-    'core.middleware.ResponseDataRequestIDMiddleware',
     'log_request_id.middleware.RequestIDMiddleware',
+    'core.middleware.PerformanceMiddleware',
+    'core.db.router.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,9 +85,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # 本地用另一个SQLite文件代替只读副本(复制一份db.sqlite3)，测试时指向default的测试库
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['core.db.router.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -130,6 +140,15 @@ LOG_REQUEST_ID_HEADER = "HTTP_X_REQUEST_ID"
 GENERATE_REQUEST_ID_IF_NOT_IN_HEADER = True
 REQUEST_ID_RESPONSE_HEADER = "TRACE_ID"
 
+# 日志: LOG_QUEUE=True时请求线程只把日志放进队列，由后台线程格式化和写文件
+# LOG_QUEUE_POLICY是队列满时的处理方式: drop丢弃ERROR以下的日志，block等待队列有空位
+# LOG_FORMATTER: color带颜色，json每条日志一行JSON，生产环境给日志采集使用
+LOG_QUEUE = True
+LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_POLICY = "drop"
+LOG_FORMATTER = "color"
+LOG_HANDLERS = ["queue"] if LOG_QUEUE else ["default", "console", "error"]
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": True,
@@ -149,11 +168,12 @@ LOGGING = {
                 "ERROR": "red",
                 "CRITICAL": "bold_red",
             },
-        }
+        },
+        "json": {"()": "core.log.JsonFormatter"},
         # 日志格式
     },
     "filters": {
-        "request_id": {"()": "log_request_id.filters.RequestIDFilter"},
+        "request_id": {"()": "core.log.RequestIDFilter"},
         "require_debug_true": {
             "()": "django.utils.log.RequireDebugTrue",  # 过滤器，只有当setting的DEBUG = True时生效
         },
@@ -171,7 +191,7 @@ LOGGING = {
             "filename": os.path.join(BASE_DIR, "logs/info.log"),
             "maxBytes": 1024 * 1024 * 50,
             "backupCount": 5,
-            "formatter": "color",
+            "formatter": LOG_FORMATTER,
             "filters": ["request_id"],
         },
         "error": {
@@ -181,29 +201,44 @@ LOGGING = {
             "filename": os.path.join(BASE_DIR, "logs/error.log"),
             "maxBytes": 1024 * 1024 * 50,
             "backupCount": 5,
-            "formatter": "color",
+            "formatter": LOG_FORMATTER,
             "filters": ["request_id"],
         },
         "console": {
             "level": "DEBUG",
             "class": "logging.StreamHandler",
-            "formatter": "color",
+            "formatter": LOG_FORMATTER,
             "filters": ["request_id"],
         },
+        **({
+            # 名字要排在转发的handler之后
+            "queue": {
+                "()": "core.log.QueueListenerHandler",
+                "handlers": ["cfg://handlers.default", "cfg://handlers.console", "cfg://handlers.error"],
+                "maxsize": LOG_QUEUE_SIZE,
+                "policy": LOG_QUEUE_POLICY,
+                "filters": ["request_id"],
+            },
+        } if LOG_QUEUE else {}),
     },
     "loggers": {
         "django": {
-            "handlers": ["default", "console", "error"],
+            "handlers": LOG_HANDLERS,
             "level": "INFO",
             "propagate": True,
         },
         "employee": {
-            "handlers": ["default", "console", "error"],
+            "handlers": LOG_HANDLERS,
+            "level": "INFO",
+            "propagate": True,
+        },
+        "core": {
+            "handlers": LOG_HANDLERS,
             "level": "INFO",
             "propagate": True,
         },
         "utils": {
-            "handlers": ["default", "console", "error"],
+            "handlers": LOG_HANDLERS,
             "level": "INFO",
             "propagate": True,
         },
@@ -263,3 +298,80 @@ AUTHENTICATION_BACKENDS = [
 
 # celery broker
 broker_url = "redis://127.0.0.1:6379/0"
+
+# 共享缓存: 所有worker进程共用，登录限流、对象缓存、用户缓存和core.cache都依赖它，不能用进程内的LocMemCache
+# 和celery broker使用不同的db
+REDIS_URL = os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/1")
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": REDIS_URL,
+        "OPTIONS": {},
+    }
+}
+
+# 分页总数: count=cached时COUNT结果的缓存时间(秒)和使用的缓存
+PAGE_COUNT_CACHE_TTL = 60
+PAGE_COUNT_CACHE_ALIAS = "default"
+
+# CRUDRouter批量接口单次请求允许的最大条数
+BULK_MAX_ITEMS = 5000
+
+# core.cache.query_or_cache: 过期后继续返回旧值的时间、重新计算的锁超时、没抢到锁时等待结果的时间(秒)
+CACHE_STALE_TTL = 60
+CACHE_LOCK_TTL = 30
+CACHE_LOCK_WAIT = 3
+
+# core.cache的进程内L1缓存: 最多保存的key数量(0表示关闭L1)，每个key最多保存的时间(秒)
+CACHE_L1_MAX_SIZE = 1000
+CACHE_L1_TTL = 5
+
+# GenericCURDSoftDelete(object_cache_ttl=...)对象缓存使用的缓存，以及不存在的id的缓存时间(秒)
+OBJECT_CACHE_ALIAS = "default"
+OBJECT_CACHE_NEGATIVE_TTL = 30
+
+# 软删除数据归档(apidemo.celery_config.archive_soft_deleted): 删除超过多少天后归档、归档文件目录
+# 每批行数、批次之间的间隔(秒)、需要归档的模型
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_DIR = BASE_DIR / "archive"
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_BATCH_SLEEP = 0.1
+ARCHIVE_MODELS = ["employee.Employee", "employee.Department"]
+
+# CRUDRouter导出接口每次从数据库读取的行数
+EXPORT_CHUNK_SIZE = 2000
+
+# 批量导入: 上传文件和服务器端文件所在目录、每批校验和写入的行数、最多记录的失败行数
+IMPORT_DIR = BASE_DIR / "imports"
+IMPORT_BATCH_SIZE = 2000
+IMPORT_MAX_ERRORS = 1000
+
+# core.auth.CachedJWTAuth: 用户缓存使用的缓存和缓存时间(秒)，进程内缓存的最大数量和缓存时间(秒)
+AUTH_USER_CACHE_ALIAS = "default"
+AUTH_USER_CACHE_TTL = 300
+AUTH_USER_L1_MAX_SIZE = 1000
+AUTH_USER_L1_TTL = 5
+
+# 登录: gevent下校验密码的线程池大小，每个IP上的用户名/每个IP在窗口(秒)内最多尝试的次数，计数使用的缓存
+# AUTH_LOGIN_IP_HEADER: 部署在nginx等反向代理后面时，代理写入客户端地址的请求头，例如"HTTP_X_REAL_IP"、
+# "HTTP_X_FORWARDED_FOR"(取最后一个地址)，不配置时用REMOTE_ADDR，经过代理时所有客户端都是代理的地址
+AUTH_PASSWORD_THREADS = 4
+AUTH_LOGIN_WINDOW = 60
+AUTH_LOGIN_MAX_PER_USER = 10
+AUTH_LOGIN_MAX_PER_IP = 50
+AUTH_LOGIN_RATE_ALIAS = "default"
+AUTH_LOGIN_IP_HEADER = None
+
+# core.middleware.PerformanceMiddleware: 采样统计请求耗时的比例(0关闭，1全部)，结果写入Server-Timing响应头和core.perf日志
+PERF_SAMPLE_RATE = 0.01
+
+# 读写分离(core.db.router): 只读副本的alias，空列表表示都走主库
+# 写入后多少秒内这个客户端的读取走主库、记录按用户固定到主库使用的缓存，副本的检查间隔和允许的最大复制延迟(秒)
+DATABASE_REPLICAS = []
+DATABASE_STICKY_SECONDS = 5
+DATABASE_STICKY_CACHE_ALIAS = "default"
+DATABASE_REPLICA_CHECK_INTERVAL = 10
+DATABASE_REPLICA_MAX_LAG = 5
+
+# /api/batch单次请求最多的操作数
+BATCH_MAX_OPERATIONS = 50
@@ -19,11 +19,22 @@ DB_PASSWORD = environ.get("MYSQL_PASSWORD", "root")
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.mysql",
+        # 带连接池的MySQL backend，每个gunicorn worker一个池，CONN_MAX_AGE保持0
+        "ENGINE": "core.db.backends.mysql_pool",
         "HOST": DB_HOST,
         "PORT": DB_PORT,
         "NAME": DB_NAME,  # 新建数据库名
         "USER": DB_USER,  # 数据库登录名
         "PASSWORD": DB_PASSWORD,  # 数据库登录密码
+        "OPTIONS": {
+            # 每个worker最多的连接数、连接最长使用时间(秒)、池满时等待的时间(秒)、空闲超过多少秒取出时先ping
+            # worker数 * max_size 需要小于MySQL的max_connections
+            "pool": {
+                "max_size": int(environ.get("DB_POOL_SIZE", 10)),
+                "max_lifetime": int(environ.get("DB_POOL_MAX_LIFETIME", 1800)),
+                "timeout": float(environ.get("DB_POOL_TIMEOUT", 5)),
+                "ping_interval": float(environ.get("DB_POOL_PING_INTERVAL", 1)),
+            },
+        },
     }
 }
@@ -0,0 +1,16 @@
+# 测试用的配置: python manage.py test --settings=apidemo.settings_test
+
+import os
+import tempfile
+
+from fakeredis import FakeConnection
+
+from .settings import *
+
+# 测试和CI没有Redis，用fakeredis(开发依赖)代替，行为和真实的Redis一致
+CACHES["default"]["OPTIONS"]["CONNECTION_POOL_KWARGS"] = {"connection_class": FakeConnection}
+
+# 测试产生的日志写到临时目录，不写进工作区的logs/
+LOG_DIR = tempfile.mkdtemp(prefix="apidemo-test-logs-")
+LOGGING["handlers"]["default"]["filename"] = os.path.join(LOG_DIR, "info.log")
+LOGGING["handlers"]["error"]["filename"] = os.path.join(LOG_DIR, "error.log")
@@ -20,19 +20,27 @@ from ninja.errors import AuthenticationError
 from ninja_extra import exceptions as extra_exceptions
 from ninja_jwt.routers.obtain import obtain_pair_router
 
+from core.auth import CachedJWTAuth
+from core.batch import BatchRouter
+from core.renderer import ORJSONRenderer
+from employee.views import import_router as employee_import_router
 from employee.views import router as employee_router
 
-api_v1 = NinjaAPI(version="1.0.0")
+api_v1 = NinjaAPI(version="1.0.0", renderer=ORJSONRenderer())
 
+api_v1.add_router("/employee/", employee_import_router)
 api_v1.add_router("/employee/", employee_router)
 api_v1.add_router("/token", tags=["Auth"], router=obtain_pair_router)
+api_v1.add_router("/batch", BatchRouter(tags=["Batch"], auth=CachedJWTAuth()))
 
 
 def obtain_token_exception_handler(request, exc):
 
     if isinstance(exc, extra_exceptions.APIException):
+        # Throttled等异常的detail是字符串
+        detail = exc.detail
         data = {
-            "message": exc.detail.get("detail", str(exc)),
+            "message": detail.get("detail", str(exc)) if isinstance(detail, dict) else str(detail),
             "success": False,
             "data": None,
         }
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class CoreConfig(AppConfig):
+    name = 'core'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.db.models.signals import post_delete, post_save
+
+        from core.auth import invalidate_cached_user
+
+        user_model = get_user_model()
+        post_save.connect(invalidate_cached_user, sender=user_model, dispatch_uid="core.auth.user_saved")
+        post_delete.connect(invalidate_cached_user, sender=user_model, dispatch_uid="core.auth.user_deleted")
@@ -0,0 +1,82 @@
+"""软删除数据归档
+
+把删除时间超过一定天数的软删除数据分批写入gzip压缩的NDJSON文件，然后从原表删除
+
+- 每批在一个短事务里按主键删除，不会长时间锁表，批次之间sleep限流
+- 先写文件并fsync再删除，进程中途退出不会丢数据，重新执行会从剩下的数据继续
+  中途退出时最后一批可能被重复写入归档文件，恢复数据时按id去重
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional, Type
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from core.model import CoreModelSoftDelete
+
+logger = logging.getLogger(__name__)
+
+
+def archive_path(model: Type[CoreModelSoftDelete], day: Optional[datetime.date] = None) -> Path:
+    """每个模型每天一个归档文件，同一天多次执行追加写入"""
+    day = day or timezone.localdate()
+    archive_dir = Path(getattr(settings, "ARCHIVE_DIR", "archive"))
+    return archive_dir / f"{model._meta.label_lower}-{day:%Y%m%d}.ndjson.gz"
+
+
+def archive_soft_deleted(
+    model: Type[CoreModelSoftDelete],
+    older_than: Optional[datetime.timedelta] = None,
+    batch_size: Optional[int] = None,
+    sleep: Optional[float] = None,
+    max_rows: Optional[int] = None,
+) -> dict:
+    """归档update_at早于older_than的软删除数据，返回归档的行数和字节数
+
+    bytes是写入的NDJSON原始大小，近似等于表里释放的数据量，compressed_bytes是归档文件增加的大小
+    """
+    if older_than is None:
+        older_than = datetime.timedelta(days=getattr(settings, "ARCHIVE_AFTER_DAYS", 30))
+    batch_size = batch_size or getattr(settings, "ARCHIVE_BATCH_SIZE", 500)
+    sleep = getattr(settings, "ARCHIVE_BATCH_SLEEP", 0.1) if sleep is None else sleep
+    cutoff = timezone.now() - older_than
+
+    path = archive_path(model)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = {"model": model._meta.label, "file": str(path), "rows": 0, "bytes": 0, "compressed_bytes": 0}
+    queryset = model.objects.dead().filter(update_at__lt=cutoff).order_by("pk")
+
+    while max_rows is None or report["rows"] < max_rows:
+        limit = batch_size if max_rows is None else min(batch_size, max_rows - report["rows"])
+        with transaction.atomic():
+            rows = list(queryset.select_for_update().values()[:limit])
+            if not rows:
+                break
+            raw = "".join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n" for row in rows)
+            report["compressed_bytes"] += _append(path, raw.encode())
+            model.objects.filter(pk__in=[row["id"] for row in rows]).delete()
+        report["rows"] += len(rows)
+        report["bytes"] += len(raw.encode())
+        logger.info(f"archive {model._meta.label} {len(rows)} rows to {path}")
+        if len(rows) < limit:
+            break
+        time.sleep(sleep)
+    return report
+
+
+def _append(path: Path, data: bytes) -> int:
+    """追加一个gzip member并落盘，返回文件增加的字节数，多个member拼接仍是合法的gzip文件"""
+    size = path.stat().st_size if path.exists() else 0
+    with open(path, "ab") as f:
+        f.write(gzip.compress(data))
+        f.flush()
+        os.fsync(f.fileno())
+    return path.stat().st_size - size
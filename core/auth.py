@@ -1,10 +1,21 @@
 # !/usr/bin/python3
 # -*- coding: utf-8 -*-
+import inspect
 from typing import Dict, Optional, Type, Union
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import AbstractBaseUser, AnonymousUser
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
 from ninja import Schema
+from ninja_extra.exceptions import Throttled
+from ninja_jwt.authentication import JWTAuth
+from ninja_jwt.exceptions import AuthenticationFailed, InvalidToken
+from ninja_jwt.settings import api_settings
 from ninja_jwt.schema import (
     TokenObtainInputSchemaBase,
     TokenRefreshInputSchema,
@@ -12,6 +23,8 @@ from ninja_jwt.schema import (
 )
 from ninja_jwt.tokens import RefreshToken
 
+from core import compat, perf
+from core.cache import LocalCache
 from core.schemas import StandResponse
 
 
@@ -71,13 +84,215 @@ class MyTokenRefreshInputSchema(TokenRefreshInputSchema):
 class CustomAuthBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
         User = get_user_model()
+        login_rate_limiter.hit(request, username)
 
         try:
             user = User.objects.get(username=username)
         except User.DoesNotExist:
             return None
 
-        if user.check_password(password):
+        if check_password(user, password):
+            login_rate_limiter.reset(request, username)
             return user
         else:
             return None
+
+
+_password_pool = None
+
+
+def check_password(user, password) -> bool:
+    """校验密码
+
+    PBKDF2要几百毫秒CPU，gevent worker里直接执行会阻塞同一进程的所有greenlet
+    打了gevent补丁时放到有上限的原生线程池里执行，hashlib计算时会释放GIL，当前greenlet让出等待结果
+    """
+    with perf.timer("auth"):
+        if not compat.gevent_patched():
+            return user.check_password(password)
+        return _get_password_pool().spawn(user.check_password, password).get()
+
+
+def _get_password_pool():
+    global _password_pool
+    if _password_pool is None:
+        from gevent.threadpool import ThreadPool
+
+        _password_pool = ThreadPool(maxsize=getattr(settings, "AUTH_PASSWORD_THREADS", 4))
+    return _password_pool
+
+
+class LoginRateLimiter:
+    """按(用户名, IP)和IP限制登录次数，固定窗口计数，计数在校验密码之前，暴力破解不会消耗CPU
+
+    用户名的计数按IP区分，别人用错误密码不能把这个用户锁在外面
+    多进程部署时AUTH_LOGIN_RATE_ALIAS需要是Redis等共享缓存
+    """
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "AUTH_LOGIN_RATE_ALIAS", "default")]
+
+    @staticmethod
+    def client_ip(request) -> Optional[str]:
+        """客户端IP: 配置了AUTH_LOGIN_IP_HEADER时从代理设置的请求头读取，否则是REMOTE_ADDR
+
+        X-Forwarded-For这类有多个地址的请求头取最后一个，是最近的一层代理记录的地址，客户端不能伪造
+        """
+        if request is None:
+            return None
+        header = getattr(settings, "AUTH_LOGIN_IP_HEADER", None)
+        if header:
+            value = request.META.get(header, "")
+            ip = value.split(",")[-1].strip()
+            if ip:
+                return ip
+        return request.META.get("REMOTE_ADDR") or None
+
+    @staticmethod
+    def _user_key(username, ip: Optional[str]) -> str:
+        return f"core:login:user:{username}:{ip or ''}"
+
+    def _keys(self, request, username) -> Dict[str, int]:
+        ip = self.client_ip(request)
+        keys = {self._user_key(username, ip): getattr(settings, "AUTH_LOGIN_MAX_PER_USER", 10)}
+        if ip:
+            keys[f"core:login:ip:{ip}"] = getattr(settings, "AUTH_LOGIN_MAX_PER_IP", 50)
+        return keys
+
+    def hit(self, request, username):
+        """记一次登录尝试，超过次数时抛出Throttled(429)"""
+        window = getattr(settings, "AUTH_LOGIN_WINDOW", 60)
+        for key, limit in self._keys(request, username).items():
+            self.cache.add(key, 0, window)
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                # add和incr之间key刚好过期
+                self.cache.set(key, 1, window)
+                count = 1
+            if count > limit:
+                raise Throttled(wait=window)
+
+    def reset(self, request, username):
+        """登录成功后清除这个IP上用户名的计数，IP的计数保留"""
+        self.cache.delete(self._user_key(username, self.client_ip(request)))
+
+
+login_rate_limiter = LoginRateLimiter()
+
+_user_local_cache: Optional[LocalCache] = None
+
+
+def _local_users() -> LocalCache:
+    global _user_local_cache
+    if _user_local_cache is None:
+        _user_local_cache = LocalCache(max_size=int(getattr(settings, "AUTH_USER_L1_MAX_SIZE", 1000)))
+    return _user_local_cache
+
+
+def user_cache_key(user_id) -> str:
+    return f"core:auth_user:{user_id}"
+
+
+# core.batch给子请求设置的属性，值是批量请求认证得到的用户，只能在服务端设置
+BATCH_AUTH_ATTR = "_batch_auth"
+
+
+class CachedJWTAuth(JWTAuth):
+    """JWTAuth每个请求都会按user_id查一次用户表，这里先读进程内缓存再读AUTH_USER_CACHE_ALIAS
+
+    缓存的是除password以外的字段，返回的user只加载了这些字段，request.user.username等可以正常使用
+    用户保存或删除时会删除缓存，其他进程的进程内缓存最多AUTH_USER_L1_TTL秒后过期
+    """
+
+    def __call__(self, request):
+        # /api/batch的子请求沿用整个批量请求的认证结果，不再校验token
+        user = getattr(request, BATCH_AUTH_ATTR, None)
+        if user is not None:
+            request.user = user
+            return user
+        return super().__call__(request)
+
+    def authenticate(self, request, token):
+        with perf.timer("auth"):
+            return super().authenticate(request, token)
+
+    def get_user(self, validated_token) -> AbstractBaseUser:
+        user_id = self._user_id(validated_token)
+        key = user_cache_key(user_id)
+        values = _local_users().get(key, None)
+        if values is None:
+            values = self._load_values(key, user_id)
+            _local_users().set(key, values, getattr(settings, "AUTH_USER_L1_TTL", 5))
+        return self._user(values)
+
+    @staticmethod
+    def _user_id(validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def _user(self, values: dict) -> AbstractBaseUser:
+        if not values:
+            raise AuthenticationFailed(_("User not found"))
+
+        # 没有缓存的字段是deferred，访问时才会查库，save()也只会更新已加载的字段
+        user = self.user_model.from_db(None, list(values), list(values.values()))
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"))
+        return user
+
+    def _load_values(self, key: str, user_id) -> dict:
+        cache = caches[getattr(settings, "AUTH_USER_CACHE_ALIAS", "default")]
+        values = cache.get(key)
+        if values is not None:
+            return values
+        names = _cached_field_names(self.user_model)
+        values = (
+            self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values(*names).first()
+        ) or {}
+        cache.set(key, values, getattr(settings, "AUTH_USER_CACHE_TTL", 300))
+        return values
+
+
+class AsyncCachedJWTAuth(CachedJWTAuth):
+    """CachedJWTAuth的async版本，AsyncCRUDRouter使用
+
+    校验token和读进程内缓存不涉及IO，直接在事件循环里执行，进程内缓存没有时才用sync_to_async读共享缓存和数据库
+    """
+
+    async def __call__(self, request):
+        result = super().__call__(request)
+        return await result if inspect.isawaitable(result) else result
+
+    async def authenticate(self, request, token):
+        with perf.timer("auth"):
+            request.user = AnonymousUser()
+            user = await self.aget_user(self.get_validated_token(token))
+        request.user = user
+        return user
+
+    async def aget_user(self, validated_token) -> AbstractBaseUser:
+        user_id = self._user_id(validated_token)
+        key = user_cache_key(user_id)
+        values = _local_users().get(key, None)
+        if values is None:
+            values = await sync_to_async(self._load_values)(key, user_id)
+            _local_users().set(key, values, getattr(settings, "AUTH_USER_L1_TTL", 5))
+        return self._user(values)
+
+
+def _cached_field_names(user_model) -> list:
+    return [field.attname for field in user_model._meta.concrete_fields if field.attname != "password"]
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    """用户保存或删除后删除缓存，由CoreConfig.ready()连接到post_save/post_delete"""
+    key = user_cache_key(getattr(instance, api_settings.USER_ID_FIELD))
+    cache = caches[getattr(settings, "AUTH_USER_CACHE_ALIAS", "default")]
+    _local_users().delete(key)
+    cache.delete(key)
+    # 事务提交前其他请求可能又缓存了旧数据
+    transaction.on_commit(lambda: cache.delete(key))
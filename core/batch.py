@@ -0,0 +1,131 @@
+"""批量请求
+
+POST /api/batch 一次HTTP请求执行多个接口调用，子请求在进程内按URL解析直接调用ninja的视图，不经过中间件
+认证只在批量请求上做一次，子请求沿用认证得到的用户；只支持JSON请求体，不支持上传文件和流式响应
+"""
+import logging
+from typing import Any, List, Optional, Tuple, Union
+
+import orjson
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.urls import Resolver404, resolve
+from ninja import Router
+from ninja.constants import NOT_SET
+
+from core.auth import BATCH_AUTH_ATTR
+from core.schemas import BatchOperation, BatchOperationResult, BatchPayload, StandResponse
+
+logger = logging.getLogger(__name__)
+
+# atomic模式下前面的操作失败后，没有执行的操作的状态码
+SKIPPED_STATUS = 424
+
+
+class BatchRouter(Router):
+    def __init__(self, tags: Optional[List[str]] = None, auth: Any = NOT_SET):
+        super().__init__(tags=tags, auth=auth)
+        self.register_batch_routes()
+
+    def register_batch_routes(self):
+        @self.post("", response=StandResponse[Union[List[BatchOperationResult], None]])
+        def batch(request, payload: BatchPayload):
+            max_operations = getattr(settings, "BATCH_MAX_OPERATIONS", 50)
+            if len(payload.operations) > max_operations:
+                return StandResponse[None](
+                    success=False, message=f"too many operations, max {max_operations}", data=None
+                )
+            if not payload.atomic:
+                return StandResponse[List[BatchOperationResult]](
+                    data=[self.dispatch(request, op) for op in payload.operations]
+                )
+            with transaction.atomic():
+                results, failed_index = self._run_until_failure(request, payload.operations)
+                if failed_index is None:
+                    return StandResponse[List[BatchOperationResult]](data=results)
+                transaction.set_rollback(True)
+            return StandResponse[List[BatchOperationResult]](
+                success=False, message=f"operation {failed_index} failed, rolled back", data=results
+            )
+
+    def _run_until_failure(
+        self, request, operations: List[BatchOperation]
+    ) -> Tuple[List[BatchOperationResult], Optional[int]]:
+        results = []
+        for index, op in enumerate(operations):
+            result = self.dispatch(request, op)
+            results.append(result)
+            if _failed(result):
+                skipped = [BatchOperationResult(status=SKIPPED_STATUS) for _ in operations[index + 1:]]
+                return results + skipped, index
+        return results, None
+
+    def dispatch(self, request: HttpRequest, op: BatchOperation) -> BatchOperationResult:
+        path, _, query = op.path.partition("?")
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return _error(404, f"path not found: {path}")
+        # 只能调用同一个NinjaAPI的接口，不能嵌套调用批量接口
+        batch_match = resolve(request.path_info)
+        if match.namespace != batch_match.namespace or match.route == batch_match.route:
+            return _error(400, f"path not allowed in batch: {path}")
+        sub_request = _sub_request(request, op, path, query)
+        view = match.func
+        if iscoroutinefunction(view):
+            # AsyncCRUDRouter的视图是协程函数，在当前线程里等待执行完成，ORM调用会回到当前线程，atomic仍然有效
+            view = async_to_sync(view)
+        try:
+            response = view(sub_request, *match.args, **match.kwargs)
+        except Exception as e:
+            logger.exception(f"batch operation {op.method.value} {op.path} failed")
+            return _error(500, str(e))
+        return BatchOperationResult(status=response.status_code, body=_response_body(response))
+
+
+def _sub_request(request: HttpRequest, op: BatchOperation, path: str, query: str) -> HttpRequest:
+    sub_request = HttpRequest()
+    sub_request.method = op.method.value
+    sub_request.path = sub_request.path_info = path
+    sub_request.META = {
+        key: value for key, value in request.META.items()
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH", "QUERY_STRING", "PATH_INFO", "REQUEST_METHOD")
+    }
+    body = b"" if op.body is None else orjson.dumps(op.body)
+    sub_request.META.update({
+        "REQUEST_METHOD": sub_request.method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(body)),
+    })
+    sub_request.GET = QueryDict(query)
+    sub_request.COOKIES = request.COOKIES
+    sub_request._body = body
+    # trace_id和批量请求相同，日志可以关联起来
+    if hasattr(request, "id"):
+        sub_request.id = request.id
+    if getattr(request, "auth", None) is not None:
+        setattr(sub_request, BATCH_AUTH_ATTR, request.auth)
+    return sub_request
+
+
+def _response_body(response: HttpResponse) -> Any:
+    if getattr(response, "streaming", False):
+        return None
+    if response.get("Content-Type", "").startswith("application/json"):
+        return orjson.loads(response.content) if response.content else None
+    return response.content.decode(response.charset, errors="replace")
+
+
+def _failed(result: BatchOperationResult) -> bool:
+    """CRUD接口失败时也可能返回200，按StandResponse的success判断"""
+    if result.status >= 400:
+        return True
+    return isinstance(result.body, dict) and result.body.get("success") is False
+
+
+def _error(status: int, message: str) -> BatchOperationResult:
+    return BatchOperationResult(status=status, body={"success": False, "message": message, "data": None})
@@ -1,22 +1,284 @@
 import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
 from functools import partial
+from typing import Any, Dict, Hashable, Optional, Tuple
 
+from django.conf import settings
 from django_redis import get_redis_connection
 
+from core import perf
+
+logger = logging.getLogger(__name__)
+
+# 进程内的缓存统计: l1_hit, l2_hit, stale_hit, miss, recompute, recompute_error, lock_wait_timeout
+metrics = Counter()
+
+_ENVELOPE_KEY = "__exp__"
+_MISSING = object()
+
+INVALIDATE_CHANNEL = "core.cache.invalidate"
+# (进程id, 发送者id)，区分pub/sub消息是不是本进程发出的
+_sender: Tuple[int, str] = (0, "")
+
+
+class LocalCache:
+    """进程内的LRU缓存，每个key有独立的过期时间"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expire_at, value = item
+            if expire_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local_cache: Optional[LocalCache] = None
+# alias -> 启动订阅线程的进程id，fork之后需要重新订阅
+_subscribers: Dict[str, int] = {}
+_subscribe_lock = threading.Lock()
+
+# 只有持有锁的进程才能删除锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _setting(name: str, default: float) -> float:
+    return getattr(settings, name, default)
+
+
+def get_local_cache() -> LocalCache:
+    global _local_cache
+    if _local_cache is None:
+        _local_cache = LocalCache(max_size=int(_setting("CACHE_L1_MAX_SIZE", 1000)))
+    return _local_cache
+
+
+def _sender_id() -> str:
+    """fork出的子进程继承了父进程的值，按进程id重新生成"""
+    global _sender
+    pid = os.getpid()
+    if _sender[0] != pid:
+        _sender = (pid, uuid.uuid4().hex)
+    return _sender[1]
+
+
+def _on_invalidate(message: dict):
+    try:
+        data = json.loads(message["data"])
+    except (TypeError, ValueError):
+        return
+    if data.get("sender") != _sender_id():
+        get_local_cache().delete((data.get("alias"), data.get("key")))
+
+
+def _ensure_subscribed(alias: str, redis_conn):
+    """每个进程订阅一次失效通知，收到后删除本进程的L1缓存"""
+    pid = os.getpid()
+    if _subscribers.get(alias) == pid or get_local_cache().max_size <= 0:
+        return
+    with _subscribe_lock:
+        if _subscribers.get(alias) == pid:
+            return
+        pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATE_CHANNEL: _on_invalidate})
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+        _subscribers[alias] = pid
+        # 订阅之前的L1缓存可能已经错过了失效通知
+        get_local_cache().clear()
+
+
+def _publish_invalidate(pipe, alias: str, key: str):
+    pipe.publish(
+        INVALIDATE_CHANNEL,
+        json.dumps({"alias": alias, "key": key, "sender": _sender_id()}),
+    )
+
+
+def _decode(raw: bytes) -> Tuple[Any, Optional[float]]:
+    """返回(值, 过期时间戳)，兼容旧版本直接存json的格式，旧格式没有过期时间"""
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        return raw, None
+    if isinstance(data, dict) and _ENVELOPE_KEY in data:
+        return data["value"], data[_ENVELOPE_KEY]
+    return data, None
+
+
+def _is_fresh(expire_at: Optional[float]) -> bool:
+    return expire_at is None or time.time() < expire_at
+
+
+def _set_local(alias: str, key: str, value: Any, expire_at: Optional[float]):
+    """L1只保存未过期的值，最多保存CACHE_L1_TTL秒，防止丢失失效通知后一直读到旧值"""
+    ttl = _setting("CACHE_L1_TTL", 5)
+    if expire_at is not None:
+        ttl = min(ttl, expire_at - time.time())
+    get_local_cache().set((alias, key), value, ttl)
+
+
+def _lock_key(key: str) -> str:
+    return f"{key}:lock"
+
+
+def _acquire_lock(redis_conn, key: str) -> Optional[str]:
+    token = uuid.uuid4().hex
+    with perf.timer("redis"):
+        acquired = redis_conn.set(_lock_key(key), token, nx=True, ex=int(_setting("CACHE_LOCK_TTL", 30)))
+    if acquired:
+        return token
+    return None
+
+
+def _recompute(redis_conn, alias: str, ttl: int, key: str, token: str, func, *args, **kwargs):
+    """持有锁的进程重新计算，写缓存、通知其他进程和释放锁在同一次pipeline里完成"""
+    metrics["recompute"] += 1
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        metrics["recompute_error"] += 1
+        with perf.timer("redis"):
+            redis_conn.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(key), token)
+        raise
+    logger.debug(f"recompute cache {key} cost {time.perf_counter() - start:.4f}s")
+
+    pipe = redis_conn.pipeline(transaction=False)
+    if result:
+        stale_ttl = int(_setting("CACHE_STALE_TTL", 60))
+        expire_at = time.time() + ttl
+        envelope = {_ENVELOPE_KEY: expire_at, "value": result}
+        pipe.set(key, json.dumps(envelope, ensure_ascii=False), ex=ttl + stale_ttl)
+        _publish_invalidate(pipe, alias, key)
+        _set_local(alias, key, result, expire_at)
+    pipe.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(key), token)
+    with perf.timer("redis"):
+        pipe.execute()
+    return result
+
+
+def _wait_for_value(redis_conn, key: str) -> Any:
+    """其他进程正在计算，轮询等待它写入结果"""
+    deadline = time.monotonic() + _setting("CACHE_LOCK_WAIT", 3)
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        with perf.timer("redis"):
+            raw = redis_conn.get(key)
+        if raw is not None:
+            return _decode(raw)[0]
+    metrics["lock_wait_timeout"] += 1
+    return _MISSING
+
 
 def query_or_cache(ttl: int, alias: str, key: str, func, *args, **kwargs):
+    """读缓存，未命中时调用func计算并写入
+
+    - 先读进程内的L1缓存，L1命中时不访问Redis
+    - Redis命中时只有一次GET
+    - 过期后的CACHE_STALE_TTL秒内仍返回旧值，同时只有抢到锁的一个进程重新计算
+    - 未命中时只有抢到锁的进程计算，其他进程等待结果，避免缓存击穿
+
+    L1命中时返回的是同一个对象，调用方不要修改返回值
+    """
+    value = get_local_cache().get((alias, key))
+    if value is not _MISSING:
+        metrics["l1_hit"] += 1
+        return value
+
     redis_conn = get_redis_connection(alias=alias)
-    if redis_conn.exists(key):
-        s: str = redis_conn.get(key)
+    _ensure_subscribed(alias, redis_conn)
+    with perf.timer("redis"):
+        raw = redis_conn.get(key)
+    if raw is not None:
+        value, expire_at = _decode(raw)
+        if _is_fresh(expire_at):
+            metrics["l2_hit"] += 1
+            _set_local(alias, key, value, expire_at)
+            return value
+        metrics["stale_hit"] += 1
+        token = _acquire_lock(redis_conn, key)
+        if token is None:
+            return value
         try:
-            return json.loads(s)
-        except json.JSONDecodeError:
-            return s
-    result = func(*args, **kwargs)
-    if result:
-        redis_conn.set(key, json.dumps(result, ensure_ascii=False))
-        redis_conn.expire(key, ttl)
-    return result
+            return _recompute(redis_conn, alias, ttl, key, token, func, *args, **kwargs)
+        except Exception:
+            logger.exception(f"recompute cache {key} failed, return stale value")
+            return value
+
+    metrics["miss"] += 1
+    token = _acquire_lock(redis_conn, key)
+    if token is None:
+        value = _wait_for_value(redis_conn, key)
+        if value is not _MISSING:
+            return value
+        return func(*args, **kwargs)
+    return _recompute(redis_conn, alias, ttl, key, token, func, *args, **kwargs)
+
+
+def invalidate(key: str, alias: str = "default"):
+    """删除缓存，并通知所有进程删除各自的L1缓存"""
+    get_local_cache().delete((alias, key))
+    redis_conn = get_redis_connection(alias=alias)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.delete(key)
+    _publish_invalidate(pipe, alias, key)
+    with perf.timer("redis"):
+        pipe.execute()
+
+
+def get_metrics() -> dict:
+    return dict(metrics)
+
+
+def hit_ratios() -> dict:
+    """进程启动以来query_or_cache的L1/L2命中率和查询次数，stale_hit算作L2命中，还没有查询时返回{}"""
+    total = sum(metrics[name] for name in ("l1_hit", "l2_hit", "stale_hit", "miss"))
+    if not total:
+        return {}
+    return {
+        "l1": round(metrics["l1_hit"] / total, 4),
+        "l2": round((metrics["l2_hit"] + metrics["stale_hit"]) / total, 4),
+        "lookups": total,
+    }
 
 
 def query_or_cache_default_10min(func, key: str, *args, **kwargs):
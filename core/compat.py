@@ -0,0 +1,20 @@
+"""gevent兼容
+
+gunicorn的gevent worker会给threading、queue等模块打补丁，需要原生线程和锁的地方用这里判断和取得原始实现
+"""
+
+
+def gevent_patched() -> bool:
+    """是否打了gevent补丁，没有安装gevent时返回False"""
+    try:
+        from gevent import monkey
+    except ImportError:  # pragma: no cover
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def original(module: str, name: str):
+    """打补丁之前的对象，例如original("_thread", "start_new_thread")"""
+    from gevent import monkey
+
+    return monkey.get_original(module, name)
@@ -0,0 +1,63 @@
+"""带连接池的MySQL backend
+
+ENGINE设置为core.db.backends.mysql_pool，OPTIONS里的pool是连接池参数，见core.db.pool.ConnectionPool:
+    "OPTIONS": {"pool": {"max_size": 10, "max_lifetime": 1800, "timeout": 5, "ping_interval": 1}}
+
+CONN_MAX_AGE需要保持0，请求结束时Django关闭连接，这里改成还给池
+"""
+from django.db.backends.mysql.base import Database
+from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
+
+from core.db.pool import ConnectionPool, PoolTimeout, get_pool
+
+# 连接上已经设置过SQL_AUTO_IS_NULL、隔离级别等会话变量
+_INITIALIZED = "_pool_initialized"
+
+
+class DatabaseWrapper(MySQLDatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.alias, self._create_pool)
+
+    def _create_pool(self) -> ConnectionPool:
+        options = self.settings_dict["OPTIONS"].get("pool") or {}
+        conn_params = self.get_connection_params()
+        return ConnectionPool(
+            connect=lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+            check=lambda conn: conn.ping(reconnect=False),
+            close=lambda conn: conn.close(),
+            **options,
+        )
+
+    def get_new_connection(self, conn_params):
+        try:
+            return self.pool.acquire()
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e)) from e
+
+    def init_connection_state(self):
+        # 从池里取出的连接不需要再设置一遍会话变量，省掉几次查询
+        if getattr(self.connection, _INITIALIZED, False):
+            return
+        super().init_connection_state()
+        setattr(self.connection, _INITIALIZED, True)
+
+    def _close(self):
+        conn = self.connection
+        # 事务中被关闭时这个wrapper还引用着连接，不能给其他请求使用
+        if self.in_atomic_block or (self.errors_occurred and not self.is_usable()):
+            self.pool.discard(conn)
+            return
+        try:
+            if not self.get_autocommit():
+                conn.rollback()
+                conn.autocommit(True)
+        except Database.Error:
+            self.pool.discard(conn)
+            return
+        self.pool.release(conn)
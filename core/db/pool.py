@@ -0,0 +1,204 @@
+"""数据库连接池
+
+每个worker进程一个有上限的池，Django的连接在请求结束时close()，池化后backend把连接还给池而不是断开
+
+- 只使用threading的锁和条件变量，gevent打补丁后等待连接的greenlet会让出，不会阻塞其他请求
+- 取出连接时，空闲超过ping_interval秒的连接先做健康检查，失败就关闭换一个
+- 连接使用超过max_lifetime秒后不再放回池里，避免被MySQL的wait_timeout或中间代理断开
+- 池满时最多等待timeout秒，超时抛出PoolTimeout
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.created_at = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        check: Callable[[Any], None],
+        close: Callable[[Any], None],
+        max_size: int = 10,
+        max_lifetime: float = 1800,
+        timeout: float = 5,
+        ping_interval: float = 1,
+    ):
+        """connect创建新连接，check失败时抛异常，close关闭连接"""
+        self._connect = connect
+        self._check = check
+        self._close = close
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # 后放回的先取出，空闲多的连接自然过期
+        self._idle: Deque[_Entry] = deque()
+        self._in_use: Dict[int, _Entry] = {}
+        # 空闲 + 使用中 + 正在创建的连接数
+        self._size = 0
+        self._waiters = 0
+        self.counters = {"created": 0, "closed": 0, "timeouts": 0, "check_failed": 0}
+
+    def _check_pid(self):
+        """fork出的子进程不能使用父进程的socket，丢弃父进程的连接(不关闭，父进程还在用)"""
+        if self._pid != os.getpid():
+            with self._cond:
+                if self._pid != os.getpid():
+                    self._cond = threading.Condition()
+                    self._reset()
+
+    def acquire(self, timeout: Optional[float] = None) -> Any:
+        self._check_pid()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            entry, expired = self._checkout(deadline)
+            for old in expired:
+                self._close_conn(old.conn)
+            if entry is None:
+                return self._create()
+            if time.monotonic() - entry.last_used < self.ping_interval:
+                return entry.conn
+            try:
+                self._check(entry.conn)
+            except Exception:
+                logger.warning("pooled connection failed health check, discard it", exc_info=True)
+                self.counters["check_failed"] += 1
+                self.discard(entry.conn)
+                continue
+            return entry.conn
+
+    def _checkout(self, deadline: float):
+        """返回(空闲连接, 需要关闭的过期连接)，空闲连接为None时表示调用方需要新建连接"""
+        expired: List[_Entry] = []
+        with self._cond:
+            while True:
+                while self._idle:
+                    entry = self._idle.pop()
+                    if self._expired(entry):
+                        self._size -= 1
+                        expired.append(entry)
+                        continue
+                    self._in_use[id(entry.conn)] = entry
+                    return entry, expired
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, expired
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"no connection available in {self.timeout}s, pool size {self.max_size}"
+                    )
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+
+    def _create(self) -> Any:
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._in_use[id(conn)] = _Entry(conn)
+            self.counters["created"] += 1
+        return conn
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.monotonic() - entry.created_at >= self.max_lifetime
+
+    def release(self, conn: Any):
+        """归还连接，调用方需要保证连接上没有未结束的事务"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+            if entry is None:
+                return
+            if self._pid == os.getpid() and not self._expired(entry):
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+            self._size -= 1
+            self._cond.notify()
+        self._close_conn(conn)
+
+    def discard(self, conn: Any):
+        """关闭连接，不再放回池里"""
+        with self._cond:
+            if self._in_use.pop(id(conn), None) is not None:
+                self._size -= 1
+                self._cond.notify()
+        self._close_conn(conn)
+
+    def _close_conn(self, conn: Any):
+        self.counters["closed"] += 1
+        try:
+            self._close(conn)
+        except Exception:
+            logger.debug("close pooled connection failed", exc_info=True)
+
+    def close_idle(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_conn(entry.conn)
+
+    def stats(self) -> dict:
+        """连接池的状态，用于调整max_size: waiters和timeouts持续大于0说明池太小"""
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                **self.counters,
+            }
+
+
+# alias -> 连接池，每个进程独立
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias: str, factory: Callable[[], ConnectionPool]) -> ConnectionPool:
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = factory()
+    return pool
+
+
+def pool_stats() -> Dict[str, dict]:
+    """所有连接池的状态: {alias: {"in_use": .., "idle": .., "waiters": .., ...}}"""
+    return {alias: pool.stats() for alias, pool in _pools.items()}
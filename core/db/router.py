@@ -0,0 +1,179 @@
+"""读写分离
+
+DATABASE_ROUTERS = ["core.db.router.ReplicaRouter"]，DATABASE_REPLICAS是只读副本的alias列表
+
+- 写入和事务里的读取走主库，请求里的其他读取随机选一个健康的副本
+- 请求写过数据后，ReplicaStickinessMiddleware把这个客户端在DATABASE_STICKY_SECONDS秒内的读取固定到主库，
+  保证能读到自己刚写的数据: 浏览器通过cookie，API客户端按登录用户在缓存里记录
+- 副本每DATABASE_REPLICA_CHECK_INTERVAL秒检查一次，连不上或复制延迟超过DATABASE_REPLICA_MAX_LAG秒时跳过
+- 请求之外(celery任务、管理命令)的读取都走主库，任务往往要读请求刚写入的数据
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = "db_sticky"
+
+
+class _RequestState:
+    __slots__ = ("request", "pinned", "wrote")
+
+    def __init__(self, request, pinned: bool):
+        self.request = request
+        # None表示还没有按登录用户检查过缓存
+        self.pinned: Optional[bool] = True if pinned else None
+        self.wrote = False
+
+
+_state: ContextVar[Optional[_RequestState]] = ContextVar("core_db_router_state", default=None)
+
+# alias -> (是否健康, 检查时间)
+_health: Dict[str, Tuple[bool, float]] = {}
+_health_lock = threading.Lock()
+
+
+def replicas() -> List[str]:
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def sticky_seconds() -> int:
+    return getattr(settings, "DATABASE_STICKY_SECONDS", 5)
+
+
+def _cache():
+    return caches[getattr(settings, "DATABASE_STICKY_CACHE_ALIAS", "default")]
+
+
+def sticky_key(user_id) -> str:
+    return f"core:db:sticky:{user_id}"
+
+
+def _user_id(request):
+    """ninja的认证在中间件之后执行，第一次读取时才能拿到用户
+
+    不读request.user，session中间件的user是懒加载的，加载时的查询又会进到路由里
+    """
+    user = getattr(request, "auth", None)
+    if user is not None and getattr(user, "is_authenticated", False):
+        return user.pk
+    return None
+
+
+def _pinned(state: _RequestState) -> bool:
+    if state.wrote:
+        return True
+    if state.pinned is None:
+        user_id = _user_id(state.request)
+        if user_id is None:
+            return False
+        state.pinned = bool(_cache().get(sticky_key(user_id)))
+    return state.pinned
+
+
+def check_replica(alias: str) -> bool:
+    """能连上，并且复制延迟不超过DATABASE_REPLICA_MAX_LAG秒"""
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor != "mysql":
+                cursor.execute("SELECT 1")
+                return True
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except DatabaseError:
+                # MySQL 8.0.22之前的语法
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if row is None:
+                # 不是副本，或者复制没有配置
+                return False
+            status = dict(zip([column[0] for column in cursor.description], row))
+    except DatabaseError:
+        logger.warning(f"replica {alias} unavailable", exc_info=True)
+        return False
+    lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+    if lag is None or lag > getattr(settings, "DATABASE_REPLICA_MAX_LAG", 5):
+        logger.warning(f"replica {alias} lagging: {lag}s behind")
+        return False
+    return True
+
+
+def healthy_replicas() -> List[str]:
+    interval = getattr(settings, "DATABASE_REPLICA_CHECK_INTERVAL", 10)
+    now = time.monotonic()
+    result = []
+    for alias in replicas():
+        ok, checked_at = _health.get(alias, (False, None))
+        if checked_at is None or now - checked_at >= interval:
+            # 同一个副本同时只有一个线程检查，其他线程用上一次的结果
+            if _health_lock.acquire(blocking=False):
+                try:
+                    ok = check_replica(alias)
+                    _health[alias] = (ok, time.monotonic())
+                finally:
+                    _health_lock.release()
+        if ok:
+            result.append(alias)
+    return result
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not replicas():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block or _pinned(state):
+            return DEFAULT_DB_ALIAS
+        candidates = healthy_replicas()
+        return random.choice(candidates) if candidates else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本和主库是同一份数据
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本的表结构通过复制同步
+        return db not in replicas()
+
+
+class ReplicaStickinessMiddleware:
+    """为每个请求记录是否写过数据，写过时在响应里设置cookie并按用户写缓存"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+        sticky_until = request.COOKIES.get(STICKY_COOKIE)
+        pinned = bool(sticky_until and sticky_until.isdigit() and int(sticky_until) > time.time())
+        state = _RequestState(request, pinned)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state.wrote:
+            seconds = sticky_seconds()
+            response.set_cookie(
+                STICKY_COOKIE, str(int(time.time()) + seconds), max_age=seconds, httponly=True, samesite="Lax"
+            )
+            user_id = _user_id(request)
+            if user_id is not None:
+                _cache().set(sticky_key(user_id), 1, seconds)
+        return response
@@ -0,0 +1,70 @@
+"""流式导出，逐行编码成NDJSON/CSV，攒够一定大小再输出，内存占用和总行数无关"""
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Sequence
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.schemas import FileFormat
+
+CONTENT_TYPES = {
+    FileFormat.ndjson: "application/x-ndjson",
+    FileFormat.csv: "text/csv",
+}
+# 每次输出的块大小
+CHUNK_BYTES = 64 * 1024
+
+
+class StreamEncoder:
+    def __init__(self, export_format: FileFormat, fields: Sequence[str], gzip: bool = False):
+        self.export_format = export_format
+        self.fields = list(fields)
+        # wbits=31输出带gzip头的数据
+        self._compressor = zlib.compressobj(wbits=31) if gzip else None
+        self._buffer = io.StringIO()
+        if export_format == FileFormat.csv:
+            self._csv = csv.writer(self._buffer)
+            self._csv.writerow(self.fields)
+
+    def encode(self, row: dict) -> bytes:
+        """写入一行，缓冲区满时返回编码后的数据，否则返回空bytes"""
+        if self.export_format == FileFormat.csv:
+            self._csv.writerow([row[name] for name in self.fields])
+        else:
+            self._buffer.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+            self._buffer.write("\n")
+        if self._buffer.tell() < CHUNK_BYTES:
+            return b""
+        return self._flush()
+
+    def close(self) -> bytes:
+        data = self._flush()
+        if self._compressor is not None:
+            data += self._compressor.flush()
+        return data
+
+    def _flush(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        return data
+
+
+def stream(rows: Iterable[dict], encoder: StreamEncoder) -> Iterator[bytes]:
+    for row in rows:
+        chunk = encoder.encode(row)
+        if chunk:
+            yield chunk
+    yield encoder.close()
+
+
+async def astream(rows: AsyncIterable[dict], encoder: StreamEncoder) -> AsyncIterator[bytes]:
+    async for row in rows:
+        chunk = encoder.encode(row)
+        if chunk:
+            yield chunk
+    yield encoder.close()
@@ -0,0 +1,133 @@
+"""批量导入
+
+流式读取NDJSON/CSV文件，每IMPORT_BATCH_SIZE行校验一次并用bulk_create写入，每批结束后更新任务进度
+"""
+import csv
+import json
+import logging
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Tuple, Type, Union
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from ninja import Schema
+from ninja.errors import HttpError
+from pydantic import ValidationError
+
+from core.models import ImportJob
+from core.schemas import FileFormat
+from core.service import GenericCURDSoftDelete, validation_message
+
+logger = logging.getLogger(__name__)
+
+# (行号, 解析后的dict或解析失败的原因)
+ParsedRow = Tuple[int, Union[dict, str]]
+
+
+def import_dir() -> Path:
+    return Path(getattr(settings, "IMPORT_DIR", "imports")).resolve()
+
+
+def resolve_file_path(file_path: str) -> Path:
+    """服务器端文件只允许IMPORT_DIR下的文件"""
+    path = (import_dir() / file_path).resolve()
+    if import_dir() not in path.parents or not path.is_file():
+        raise HttpError(400, f"file not found: {file_path}")
+    return path
+
+
+def schema_path(schema: Type[Schema]) -> str:
+    return f"{schema.__module__}.{schema.__qualname__}"
+
+
+def read_rows(path: Path, file_format: str) -> Iterator[ParsedRow]:
+    """逐行读取，行号从1开始，CSV不算表头"""
+    with open(path, encoding="utf-8", newline="") as f:
+        if file_format == FileFormat.csv:
+            for line, row in enumerate(csv.DictReader(f), start=1):
+                # CSV没有null，空字符串当成没有传
+                yield line, {key: value for key, value in row.items() if value != ""}
+            return
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as e:
+                yield line, f"invalid json: {e}"
+                continue
+            yield line, row if isinstance(row, dict) else "row must be a json object"
+
+
+def run_import(job_id: int):
+    job = ImportJob.objects.get(id=job_id)
+    ImportJob.objects.filter(id=job_id).update(status=ImportJob.Status.RUNNING, started_at=timezone.now())
+    service = GenericCURDSoftDelete(apps.get_model(job.model_label))
+    in_schema = import_string(job.in_schema)
+    batch_size = getattr(settings, "IMPORT_BATCH_SIZE", 2000)
+    max_errors = getattr(settings, "IMPORT_MAX_ERRORS", 1000)
+    errors: List[dict] = []
+    try:
+        rows = read_rows(Path(job.file_path), job.file_format)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            created, failed = _import_batch(service, in_schema, job.creator, batch)
+            if len(errors) < max_errors:
+                errors.extend(failed[:max_errors - len(errors)])
+            ImportJob.objects.filter(id=job_id).update(
+                processed_rows=F("processed_rows") + len(batch),
+                created_rows=F("created_rows") + created,
+                failed_rows=F("failed_rows") + len(failed),
+                errors=errors,
+            )
+    except Exception as e:
+        logger.exception(f"import job {job_id} failed")
+        ImportJob.objects.filter(id=job_id).update(
+            status=ImportJob.Status.FAILED, message=str(e), finished_at=timezone.now()
+        )
+        return
+    finally:
+        # 上传的文件只用一次，通过file_path指定的服务器端文件保留
+        if job.uploaded:
+            Path(job.file_path).unlink(missing_ok=True)
+    ImportJob.objects.filter(id=job_id).update(status=ImportJob.Status.SUCCESS, finished_at=timezone.now())
+
+
+def _import_batch(
+    service: GenericCURDSoftDelete, in_schema: Type[Schema], creator: str, batch: List[ParsedRow]
+) -> Tuple[int, List[dict]]:
+    """返回(写入行数, 失败行)
+
+    整批用executemany写入，失败时回滚，交给bulk_create_obj逐行重试找出失败的行
+    """
+    valid, failed = [], []
+    for line, row in batch:
+        if isinstance(row, str):
+            failed.append({"line": line, "message": row})
+            continue
+        try:
+            valid.append((line, in_schema.model_validate(row).model_dump()))
+        except ValidationError as e:
+            failed.append({"line": line, "message": validation_message(e)})
+    if not valid:
+        return 0, failed
+    try:
+        with transaction.atomic():
+            return service.insert_rows([row for _, row in valid], creator), failed
+    except Exception:
+        logger.warning(f"import {service.model.__name__} batch failed, retry one by one")
+    result = service.bulk_create_obj([row for _, row in valid], in_schema, creator).data
+    failed += [
+        {"line": valid[item.index][0], "message": item.message}
+        for item in result.results if not item.success
+    ]
+    failed.sort(key=lambda item: item["line"])
+    return len(valid) - len(result.failed_indexes), failed
+
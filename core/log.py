@@ -0,0 +1,264 @@
+"""日志
+
+QueueListenerHandler: 请求线程只把日志记录放进队列，格式化和写文件由后台线程完成，磁盘慢时不会拖慢接口
+  gevent打补丁后后台线程和队列都用原生的线程和锁，threading.Thread此时是greenlet，写文件仍会阻塞hub
+JsonFormatter: 每条日志一行JSON，生产环境给日志采集使用，不带颜色控制字符
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Union
+
+from log_request_id.filters import RequestIDFilter as _RequestIDFilter
+
+from core import compat
+
+# 队列满时的处理方式: drop丢弃低于block_level的日志，block等待队列有空位
+POLICIES = ("drop", "block")
+
+
+class RequestIDFilter(_RequestIDFilter):
+    """request_id保存在请求线程的thread local里，已经设置过时不再覆盖，后台线程里的handler也能拿到"""
+
+    def filter(self, record):
+        if getattr(record, "request_id", None) is None:
+            return super().filter(record)
+        return True
+
+
+def _level(level: Union[int, str]) -> int:
+    """日志级别可以是数字或者"ERROR"这样的名字"""
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(level)
+    if not isinstance(value, int):
+        raise ValueError(f"unknown level: {level!r}")
+    return value
+
+
+class _NativeQueue:
+    """gevent打补丁后使用的有界队列
+
+    补丁后的queue.Queue和锁只能在greenlet之间同步，这里用没打补丁的SimpleQueue(C实现，原生锁)，
+    大小由计数器限制，队列满时block策略在greenlet里轮询等待
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.unfinished_tasks = 0
+        self._size = 0
+        self._queue = compat.original("queue", "SimpleQueue")()
+        self._lock = compat.original("_thread", "allocate_lock")()
+
+    def put(self, item, block: bool = True):
+        while not self._try_put(item):
+            if not block:
+                raise queue.Full
+            # 打补丁后time.sleep让出当前greenlet
+            time.sleep(0.01)
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def _try_put(self, item) -> bool:
+        with self._lock:
+            if 0 < self.maxsize <= self._size:
+                return False
+            self._size += 1
+            self.unfinished_tasks += 1
+        self._queue.put(item)
+        return True
+
+    def get(self, block: bool = True, timeout: float = None):
+        item = self._queue.get(block, timeout)
+        with self._lock:
+            self._size -= 1
+        return item
+
+    def task_done(self):
+        with self._lock:
+            self.unfinished_tasks -= 1
+
+    def join(self):
+        while self.unfinished_tasks:
+            time.sleep(0.01)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return not self._size
+
+
+class _NativeThread:
+    """用没打补丁的start_new_thread启动的原生线程，只提供QueueListener.stop用到的join"""
+
+    def __init__(self, target):
+        self._done = compat.original("_thread", "allocate_lock")()
+        self._done.acquire()
+        compat.original("_thread", "start_new_thread")(self._run, (target,))
+
+    def _run(self, target):
+        try:
+            target()
+        finally:
+            self._done.release()
+
+    def join(self):
+        # 等待原生锁会阻塞整个hub，只在关闭日志时调用
+        self._done.acquire()
+        self._done.release()
+
+
+def _new_queue(maxsize: int):
+    return _NativeQueue(maxsize) if compat.gevent_patched() else queue.Queue(maxsize)
+
+
+class _Listener(QueueListener):
+    def start(self):
+        if not compat.gevent_patched():
+            super().start()
+            return
+        self._thread = _NativeThread(self._monitor)
+
+    def enqueue_sentinel(self):
+        # 队列有上限，put_nowait在队列满时会失败，等后台线程腾出位置
+        self.queue.put(self._sentinel)
+
+
+class QueueListenerHandler(QueueHandler):
+    """把日志转发给handlers的队列handler
+
+    LOGGING里的用法，handlers要写在这个handler之前(dictConfig按名字排序创建handler):
+        "queue": {
+            "()": "core.log.QueueListenerHandler",
+            "handlers": ["cfg://handlers.default", "cfg://handlers.error"],
+            "filters": ["request_id"],
+        }
+    """
+
+    def __init__(
+        self,
+        handlers: List[logging.Handler],
+        maxsize: int = 10000,
+        policy: str = "drop",
+        block_level: int = logging.ERROR,
+        respect_handler_level: bool = True,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}, got {policy!r}")
+        super().__init__(_new_queue(maxsize))
+        # dictConfig传进来的是ConvertingList，取值时才把cfg://转换成已经创建好的handler
+        self.handlers = [handlers[i] for i in range(len(handlers))]
+        for handler in self.handlers:
+            if not isinstance(handler, logging.Handler):
+                raise ValueError(f"{handler!r} is not a configured handler")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_level = _level(block_level)
+        self.respect_handler_level = respect_handler_level
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        """第一次写日志时启动后台线程，gunicorn/celery fork出的子进程里没有父进程的线程，需要重新启动"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # 父进程队列里的记录由父进程处理，子进程换一个新队列
+                self.queue = _new_queue(self.maxsize)
+            self._listener = _Listener(
+                self.queue, *self.handlers, respect_handler_level=self.respect_handler_level
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def emit(self, record):
+        try:
+            self._ensure_listener()
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """在请求线程里合并msg和args、格式化异常堆栈，args里的对象之后可能被修改，exc_info不能跨线程保存
+
+        和QueueHandler.prepare不同，不把堆栈拼进msg，JsonFormatter可以单独输出
+        """
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        if self.dropped:
+            self._report_dropped()
+        if self.policy == "block" or record.levelno >= self.block_level:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _report_dropped(self):
+        """队列有空位后补一条丢弃数量的警告"""
+        record = logging.makeLogRecord({
+            "name": __name__,
+            "levelno": logging.WARNING,
+            "levelname": logging.getLevelName(logging.WARNING),
+            "msg": f"log queue full, dropped {self.dropped} records",
+            "request_id": "none",
+        })
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return
+        self.dropped = 0
+
+    def close(self):
+        """logging.shutdown时调用，等队列里的日志都写完再关闭"""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener, self._pid = None, None
+        super().close()
+
+
+class JsonFormatter(logging.Formatter):
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        created = datetime.datetime.fromtimestamp(record.created).astimezone()
+        return created.isoformat(timespec="milliseconds")
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "process": record.process,
+            "thread": record.threadName,
+            "location": f"{record.filename}:{record.funcName}:{record.lineno}",
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
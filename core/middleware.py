@@ -8,19 +8,36 @@
 
 
 import json
+import logging
+import random
 from typing import Callable
 
+from django.conf import settings
 from django.http import HttpResponse, JsonResponse
 
+from core import perf
+from core.cache import hit_ratios
+from core.db.pool import pool_stats
+
+perf_logger = logging.getLogger("core.perf")
+
 
 class ResponseDataRequestIDMiddleware:
+    """把响应头里的trace_id写回JSON响应体
+
+    需要重新解析并序列化整个响应体，NinjaAPI的接口请使用core.renderer.TraceIdJSONRenderer，
+    这个中间件只留给非ninja的JSON视图使用
+    """
+
     def __init__(self, get_response: Callable):
         self.get_response = get_response
 
     def __call__(self, request):
         response = self.get_response(request)
-        if response.headers._store.get("trace_id") and isinstance(
-            response, (HttpResponse, JsonResponse)
+        if (
+            response.headers._store.get("trace_id")
+            and isinstance(response, (HttpResponse, JsonResponse))
+            and response.get("Content-Type", "").startswith("application/json")
         ):
             try:
                 data: dict = json.loads(response.content)
@@ -33,3 +50,44 @@ class ResponseDataRequestIDMiddleware:
                 ...
 
         return response
+
+
+class PerformanceMiddleware:
+    """按PERF_SAMPLE_RATE采样统计请求耗时: 总耗时、SQL、Redis、认证、序列化
+
+    结果写入Server-Timing响应头，并输出一行以trace_id为key的JSON日志，日志里带上进程的缓存命中率和连接池状态
+    需要放在log_request_id.middleware.RequestIDMiddleware之后
+    """
+
+    def __init__(self, get_response: Callable):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, "PERF_SAMPLE_RATE", 0)
+        if not rate or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        timings, token = perf.start()
+        try:
+            with perf.track_db():
+                response = self.get_response(request)
+        finally:
+            perf.stop(token)
+        response["Server-Timing"] = timings.server_timing()
+        data = {
+            "trace_id": getattr(request, "id", None),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            **timings.summary(),
+        }
+        # 使用连接池的数据库的连接数，用来调整池的大小
+        stats = pool_stats()
+        if stats:
+            data["db_pool"] = stats
+        # core.cache的命中率，用来调整CACHE_L1_MAX_SIZE、CACHE_L1_TTL等
+        ratios = hit_ratios()
+        if ratios:
+            data["cache_hit_ratio"] = ratios
+        perf_logger.info(json.dumps(data))
+        return response
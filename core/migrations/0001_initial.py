@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creator', models.CharField(blank=True, help_text='创建人', max_length=255, null=True)),
+                ('updater', models.CharField(blank=True, help_text='修改人', max_length=255, null=True)),
+                ('update_at', models.DateTimeField(auto_now=True, help_text='修改时间', verbose_name='修改时间')),
+                ('create_at', models.DateTimeField(auto_now_add=True, help_text='创建时间', verbose_name='创建时间')),
+                ('model_label', models.CharField(help_text='导入的模型，如employee.Employee', max_length=100)),
+                ('in_schema', models.CharField(help_text='校验每一行的schema，module.QualName', max_length=255)),
+                ('file_path', models.CharField(help_text='服务器上的文件路径', max_length=500)),
+                ('file_format', models.CharField(help_text='ndjson或csv', max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('processed_rows', models.IntegerField(default=0, help_text='已处理行数')),
+                ('created_rows', models.IntegerField(default=0, help_text='成功写入行数')),
+                ('failed_rows', models.IntegerField(default=0, help_text='失败行数')),
+                ('errors', models.JSONField(default=list, help_text='失败行的行号和原因，最多保存IMPORT_MAX_ERRORS条')),
+                ('message', models.TextField(blank=True, help_text='任务失败原因', null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
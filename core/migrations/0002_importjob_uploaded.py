@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='uploaded',
+            field=models.BooleanField(default=False, help_text='上传的文件，任务结束后删除'),
+        ),
+    ]
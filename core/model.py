@@ -12,8 +12,27 @@ class CoreModel(models.Model):
         abstract = True
 
 
+class SoftDeleteQuerySet(models.QuerySet):
+    def alive(self):
+        """未删除的数据"""
+        return self.filter(is_deleted=0)
+
+    def dead(self):
+        """已软删除的数据，is_deleted是删除时生成的uuid1"""
+        return self.exclude(is_deleted=0)
+
+
 class CoreModelSoftDelete(CoreModel):
     is_deleted = models.CharField(default=0, help_text="是否删除", max_length=36)
 
+    objects = SoftDeleteQuerySet.as_manager()
+
     class Meta:
         abstract = True
+        # 每个子类都会生成这两个索引，索引名不能超过30个字符，app和类名太长时子类需要重写indexes
+        # 不用WHERE is_deleted='0'的部分索引: Django的查询参数都是绑定变量，SQLite用不上部分索引，MySQL不支持
+        indexes = [
+            models.Index(fields=["is_deleted", "id"], name="%(app_label)s_%(class)s_del_id"),
+            # 列表和游标分页按(-update_at, -id)排序
+            models.Index(fields=["is_deleted", "-update_at", "-id"], name="%(app_label)s_%(class)s_del_upd"),
+        ]
@@ -0,0 +1,27 @@
+from django.db import models
+
+from core.model import CoreModel
+
+
+class ImportJob(CoreModel):
+    """批量导入任务，由apidemo.celery_config.import_rows异步执行"""
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCESS = "success"
+        FAILED = "failed"
+
+    model_label = models.CharField(max_length=100, help_text="导入的模型，如employee.Employee")
+    in_schema = models.CharField(max_length=255, help_text="校验每一行的schema，module.QualName")
+    file_path = models.CharField(max_length=500, help_text="服务器上的文件路径")
+    uploaded = models.BooleanField(default=False, help_text="上传的文件，任务结束后删除")
+    file_format = models.CharField(max_length=10, help_text="ndjson或csv")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    processed_rows = models.IntegerField(default=0, help_text="已处理行数")
+    created_rows = models.IntegerField(default=0, help_text="成功写入行数")
+    failed_rows = models.IntegerField(default=0, help_text="失败行数")
+    errors = models.JSONField(default=list, help_text="失败行的行号和原因，最多保存IMPORT_MAX_ERRORS条")
+    message = models.TextField(null=True, blank=True, help_text="任务失败原因")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,105 @@
+"""请求耗时统计
+
+PerformanceMiddleware为采样到的请求创建RequestTimings，保存在contextvar里，
+数据库、Redis、认证、序列化等代码用timer(name)统计各自的次数和耗时
+
+没有采样的请求contextvar是None，timer()直接返回一个空的context manager，开销只有一次contextvar读取
+"""
+import time
+from contextlib import ExitStack, nullcontext
+from contextvars import ContextVar, Token
+from typing import Dict, Optional, Tuple
+
+from django.db import connections
+
+_timings: ContextVar[Optional["RequestTimings"]] = ContextVar("core_perf_timings", default=None)
+_NOOP = nullcontext()
+
+
+class RequestTimings:
+    __slots__ = ("start", "metrics")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # name -> (次数, 秒)
+        self.metrics: Dict[str, Tuple[int, float]] = {}
+
+    def add(self, name: str, duration: float):
+        count, total = self.metrics.get(name, (0, 0.0))
+        self.metrics[name] = (count + 1, total + duration)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def summary(self) -> dict:
+        """{"total_ms": .., "db_count": .., "db_ms": .., ...}"""
+        data = {"total_ms": round(self.total() * 1000, 3)}
+        for name, (count, duration) in self.metrics.items():
+            data[f"{name}_count"] = count
+            data[f"{name}_ms"] = round(duration * 1000, 3)
+        return data
+
+    def server_timing(self) -> str:
+        """Server-Timing响应头: db;dur=1.234;desc="3 calls", total;dur=5.678"""
+        items = [
+            f'{name};dur={duration * 1000:.3f};desc="{count} calls"'
+            for name, (count, duration) in self.metrics.items()
+        ]
+        items.append(f"total;dur={self.total() * 1000:.3f}")
+        return ", ".join(items)
+
+
+class _Timer:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: RequestTimings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def current() -> Optional[RequestTimings]:
+    return _timings.get()
+
+
+def start() -> Tuple[RequestTimings, Token]:
+    timings = RequestTimings()
+    return timings, _timings.set(timings)
+
+
+def stop(token: Token):
+    _timings.reset(token)
+
+
+def timer(name: str):
+    """with timer("redis"): ... 当前请求没有采样时什么也不做"""
+    timings = _timings.get()
+    if timings is None:
+        return _NOOP
+    return _Timer(timings, name)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add("db", time.perf_counter() - start_at)
+
+
+def track_db() -> ExitStack:
+    """给所有数据库连接加上execute_wrapper，统计SQL次数和耗时"""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(_db_wrapper))
+    return stack
@@ -0,0 +1,58 @@
+# !/usr/bin/python3
+# -*- coding: utf-8 -*-
+import datetime
+import decimal
+from typing import Any
+
+import orjson
+from django.conf import settings
+from django.http import HttpRequest
+from django.utils.duration import duration_iso_string
+from django.utils.functional import Promise
+from ninja.renderers import JSONRenderer
+from pydantic import BaseModel
+
+from core import perf
+
+
+class TraceIdJSONRenderer(JSONRenderer):
+    """序列化响应时直接写入trace_id，只序列化一次
+
+    非dict响应体、流式响应和非JSON响应不经过renderer，trace_id仍然通过响应头返回
+    """
+
+    def render(self, request: HttpRequest, data: Any, *, response_status: int) -> Any:
+        if isinstance(data, dict) and getattr(settings, "REQUEST_ID_RESPONSE_HEADER", None):
+            trace_id = getattr(request, "id", None)
+            if isinstance(trace_id, str):
+                data = {**data, "trace_id": trace_id}
+        with perf.timer("serialize"):
+            return self.dumps(request, data, response_status)
+
+    def dumps(self, request: HttpRequest, data: Any, response_status: int) -> Any:
+        return super().render(request, data, response_status=response_status)
+
+
+def _orjson_default(obj: Any) -> Any:
+    """orjson不支持的类型，和DjangoJSONEncoder的输出保持一致"""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return duration_iso_string(obj)
+    if isinstance(obj, Promise):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONRenderer(TraceIdJSONRenderer):
+    """用orjson序列化，datetime/date/time/UUID/Enum由orjson直接处理，不经过Python层的JSONEncoder
+
+    和DjangoJSONEncoder的区别: datetime保留微秒，DjangoJSONEncoder截断到毫秒
+    """
+
+    option = orjson.OPT_UTC_Z
+
+    def dumps(self, request: HttpRequest, data: Any, response_status: int) -> Any:
+        return orjson.dumps(data, default=_orjson_default, option=self.option)
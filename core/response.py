@@ -1,20 +1,225 @@
 """分页核心函数"""
+import datetime
+import hashlib
+import json
+import math
+from typing import Any, Optional, Sequence, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
 from django.core.paginator import Paginator
-from django.db.models import QuerySet
+from django.db import connections
+from django.db.models import Q, QuerySet
+from ninja.errors import HttpError
 
-from core.schemas import PageSchema, GenericResultsType
+from core import perf
+from core.schemas import CountStrategy, CursorPageSchema, PageSchema, GenericResultsType
 from core.schemas import PageFilter
 
+CURSOR_SALT = "core.response.cursor"
+
 
 def get_page(
         queryset: QuerySet,
         pager_filter: PageFilter,
         generic_result_type: GenericResultsType) -> PageSchema:
     """标准分页"""
-    p = Paginator(queryset, per_page=pager_filter.page_size).get_page(pager_filter.page_index)
-    return PageSchema[generic_result_type](
-        total=p.paginator.count,
-        page_size=p.paginator.per_page,
-        page_index=p.number,
-        details=list(p.object_list),
-    )
+    strategy = pager_filter.count_strategy
+    if strategy == CountStrategy.exact:
+        p = Paginator(queryset, per_page=pager_filter.page_size).get_page(pager_filter.page_index)
+        rows = list(p.object_list)
+        with perf.timer("serialize"):
+            return PageSchema[generic_result_type](
+                total=p.paginator.count,
+                page_size=p.paginator.per_page,
+                page_index=p.number,
+                details=rows,
+                has_next=p.has_next(),
+            )
+
+    # 不做精确COUNT，多取一条判断是否有下一页
+    rows = list(_page_slice(queryset, pager_filter, pager_filter.page_index))
+    total, is_estimate = None, False
+    if strategy == CountStrategy.cached:
+        total = cached_count(queryset)
+    elif strategy == CountStrategy.estimate:
+        total, is_estimate = estimate_count(queryset)
+    return _page_result(rows, pager_filter, generic_result_type, total, is_estimate)
+
+
+async def aget_page(
+        queryset: QuerySet,
+        pager_filter: PageFilter,
+        generic_result_type: GenericResultsType) -> PageSchema:
+    """标准分页，async ORM版本"""
+    strategy = pager_filter.count_strategy
+    if strategy == CountStrategy.exact:
+        total = await queryset.acount()
+        # 和Paginator.get_page一样，页码超出范围时返回最后一页
+        num_pages = max(1, math.ceil(total / pager_filter.page_size))
+        page_index = min(pager_filter.page_index, num_pages)
+        offset = (page_index - 1) * pager_filter.page_size
+        rows = [obj async for obj in queryset[offset:offset + pager_filter.page_size]]
+        with perf.timer("serialize"):
+            return PageSchema[generic_result_type](
+                total=total,
+                page_size=pager_filter.page_size,
+                page_index=page_index,
+                details=rows,
+                has_next=page_index < num_pages,
+            )
+
+    rows = [obj async for obj in _page_slice(queryset, pager_filter, pager_filter.page_index)]
+    total, is_estimate = None, False
+    if strategy == CountStrategy.cached:
+        total = await sync_to_async(cached_count)(queryset)
+    elif strategy == CountStrategy.estimate:
+        total, is_estimate = await sync_to_async(estimate_count)(queryset)
+    return _page_result(rows, pager_filter, generic_result_type, total, is_estimate)
+
+
+def _page_slice(queryset: QuerySet, pager_filter: PageFilter, page_index: int) -> QuerySet:
+    offset = (page_index - 1) * pager_filter.page_size
+    return queryset[offset:offset + pager_filter.page_size + 1]
+
+
+def _page_result(
+        rows: list,
+        pager_filter: PageFilter,
+        generic_result_type: GenericResultsType,
+        total: Optional[int],
+        is_estimate: bool) -> PageSchema:
+    with perf.timer("serialize"):
+        return PageSchema[generic_result_type](
+            total=total,
+            page_size=pager_filter.page_size,
+            page_index=pager_filter.page_index,
+            details=rows[:pager_filter.page_size],
+            has_next=len(rows) > pager_filter.page_size,
+            is_estimate=is_estimate,
+        )
+
+
+def count_cache_key(queryset: QuerySet) -> str:
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f"{queryset.db}:{sql}:{params!r}".encode()).hexdigest()
+    return f"core:page_count:{queryset.model._meta.label_lower}:{digest}"
+
+
+def cached_count(queryset: QuerySet) -> int:
+    """按查询条件的hash缓存COUNT结果，TTL内返回的总数可能略旧"""
+    cache = caches[getattr(settings, "PAGE_COUNT_CACHE_ALIAS", "default")]
+    ttl = getattr(settings, "PAGE_COUNT_CACHE_TTL", 60)
+    return cache.get_or_set(count_cache_key(queryset), queryset.count, ttl)
+
+
+def estimate_count(queryset: QuerySet) -> Tuple[int, bool]:
+    """用数据库执行计划估算行数，返回(总数, 是否为估算值)
+
+    只支持PostgreSQL和MySQL，其他数据库退回精确COUNT
+    """
+    connection = connections[queryset.db]
+    estimate: Optional[int] = None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+        elif connection.vendor == "mysql":
+            cursor.execute(f"EXPLAIN {sql}", params)
+            columns = [col[0].lower() for col in cursor.description]
+            row = dict(zip(columns, cursor.fetchone()))
+            estimate = int(int(row.get("rows") or 0) * float(row.get("filtered") or 100) / 100)
+    if estimate is None:
+        return queryset.count(), False
+    return estimate, True
+
+
+def _cursor_value(obj: Any, field: str) -> Any:
+    value = obj[field] if isinstance(obj, dict) else getattr(obj, field)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(obj: Any, ordering: Sequence[str]) -> str:
+    """把排序键的值编码成不透明的游标"""
+    values = [_cursor_value(obj, field.lstrip("-")) for field in ordering]
+    return signing.dumps(values, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor: str, ordering: Sequence[str]) -> list:
+    try:
+        values = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise HttpError(400, "invalid cursor") from None
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise HttpError(400, "invalid cursor")
+    return values
+
+
+def keyset_filter(ordering: Sequence[str], values: Sequence[Any]) -> Q:
+    """(a, b) > (x, y) 展开成 a > x OR (a = x AND b > y)，方向由排序字段的-决定"""
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        branch = Q(**{f"{name}__{lookup}": values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            branch &= Q(**{prev_field.lstrip("-"): prev_value})
+        condition |= branch
+    return condition
+
+
+def get_cursor_page(
+        queryset: QuerySet,
+        pager_filter: PageFilter,
+        generic_result_type: GenericResultsType,
+        ordering: Sequence[str] = ("-update_at", "-id")) -> CursorPageSchema:
+    """游标分页，不使用OFFSET，翻页深度不影响查询耗时
+
+    ordering的最后一个字段必须唯一（一般是id），否则同值的行可能被跳过
+    """
+    rows = list(_cursor_slice(queryset, pager_filter, ordering))
+    return _cursor_result(rows, pager_filter, generic_result_type, ordering)
+
+
+async def aget_cursor_page(
+        queryset: QuerySet,
+        pager_filter: PageFilter,
+        generic_result_type: GenericResultsType,
+        ordering: Sequence[str] = ("-update_at", "-id")) -> CursorPageSchema:
+    """游标分页，async ORM版本"""
+    rows = [obj async for obj in _cursor_slice(queryset, pager_filter, ordering)]
+    return _cursor_result(rows, pager_filter, generic_result_type, ordering)
+
+
+def _cursor_slice(queryset: QuerySet, pager_filter: PageFilter, ordering: Sequence[str]) -> QuerySet:
+    queryset = queryset.order_by(*ordering)
+    if pager_filter.cursor:
+        values = decode_cursor(pager_filter.cursor, ordering)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    # 多取一条判断是否还有下一页
+    return queryset[:pager_filter.page_size + 1]
+
+
+def _cursor_result(
+        rows: list,
+        pager_filter: PageFilter,
+        generic_result_type: GenericResultsType,
+        ordering: Sequence[str]) -> CursorPageSchema:
+    next_cursor = None
+    if len(rows) > pager_filter.page_size:
+        rows = rows[:pager_filter.page_size]
+        next_cursor = encode_cursor(rows[-1], ordering)
+    with perf.timer("serialize"):
+        return CursorPageSchema[generic_result_type](
+            page_size=pager_filter.page_size,
+            next_cursor=next_cursor,
+            details=rows,
+        )
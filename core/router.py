@@ -1,15 +1,75 @@
+import datetime
+import functools
+import hashlib
+import uuid
+from pathlib import Path
 from typing import Any, List, Optional, Type, TypeVar, Union
 
 
-from core.schemas import DictId, PageFilter, PageSchema, StandResponse, OptionalDictResponseType
-from core.service import GenericCURD
-from ninja import Body, Query, Router, Schema
-from ninja.constants import NOT_SET_TYPE
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from core import export, importer, perf
+from core.models import ImportJob
+from core.schemas import (
+    BatchSchema,
+    BulkResultSchema,
+    CursorPageSchema,
+    DictId,
+    FileFormat,
+    ImportJobSchema,
+    OptionalDictResponseType,
+    PageFilter,
+    PageSchema,
+    StandResponse,
+)
+from core.service import AsyncGenericCURDSoftDelete, GenericCURD
+from ninja import Body, File, Form, Query, Router, Schema, UploadedFile
+from ninja.constants import NOT_SET
+from ninja.errors import ConfigError, HttpError
+from ninja.utils import is_async_callable
+from pydantic import StrictInt, create_model
 
 TPageFilter = TypeVar("TPageFilter", bound=PageFilter)
 TSchema = TypeVar("TSchema", bound=Schema)
 
 
+def obj_etag(id: int, update_at: Optional[datetime.datetime]) -> Optional[str]:
+    """单个对象的弱ETag，由(id, update_at)生成"""
+    if update_at is None:
+        return None
+    return f'W/"{id}-{update_at.timestamp():.6f}"'
+
+
+def list_etag(filters: PageFilter, update_at: Optional[datetime.datetime], count: int) -> str:
+    """列表的弱ETag，由max(update_at)、总数和全部查询参数(过滤条件、分页、游标、fields)生成"""
+    last = update_at.timestamp() if update_at else 0
+    digest = hashlib.md5(f"{last}:{count}:{filters.model_dump_json()}".encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def build_response(response_type: Type[StandResponse], data: Any) -> StandResponse:
+    """用预先特化的响应类型构造响应，ORM对象转换成out_schema的时间计入序列化耗时"""
+    with perf.timer("serialize"):
+        return response_type(data=data)
+
+
+@functools.lru_cache(maxsize=None)
+def sparse_response_type(response_type: Type[StandResponse]) -> Type[StandResponse]:
+    """?fields=部分字段查询的响应类型，data不按out_schema校验
+
+    是response_type的子类，ninja对声明的响应类型的实例不再校验，直接model_dump后用NinjaAPI的renderer渲染
+    """
+    return create_model(f"Sparse{response_type.__name__}", __base__=response_type, data=(Any, None))
+
+
+def sparse_response(response_type: Type[StandResponse], result: StandResponse) -> StandResponse:
+    return sparse_response_type(response_type).model_construct(**dict(result))
+
+
 class CRUDRouter(Router):
     def __init__(
         self,
@@ -19,7 +79,9 @@ class CRUDRouter(Router):
         out_schema: Type[TSchema],
         path: str = "",
         tags: Optional[List[str]] = None,
-        auth: Any = NOT_SET_TYPE,
+        auth: Any = NOT_SET,
+        cursor_pagination: bool = False,
+        etag: bool = False,
     ):
         super().__init__(tags=tags, auth=auth)
         self.service_impl = service_impl
@@ -27,9 +89,26 @@ class CRUDRouter(Router):
         self.in_schema = in_schema
         self.out_schema = out_schema
         self.path = path
+        self.cursor_pagination = cursor_pagination
+        # 开启后GET接口返回ETag(单个对象还有Last-Modified)，请求头匹配时返回304，不渲染响应
+        self.etag = etag
         self.register_crud_routes()
 
+    def response_types(self):
+        """(单个对象, 列表, 批量获取)的响应类型
+
+        泛型特化在注册路由时只做一次，视图里直接使用，不用每个请求都去pydantic的特化缓存里查找
+        """
+        page_schema = CursorPageSchema if self.cursor_pagination else PageSchema
+        return (
+            StandResponse[Union[self.out_schema, None]],
+            StandResponse[page_schema[self.out_schema]],
+            StandResponse[Union[BatchSchema[self.out_schema], None]],
+        )
+
     def register_crud_routes(self):
+        obj_response, page_response, batch_response = self.response_types()
+
         # create an obj
         @self.post(self.path, response=StandResponse[Union[DictId, None]])
         def create_obj(request, payload: self.in_schema):
@@ -37,19 +116,93 @@ class CRUDRouter(Router):
                 payload, request.user.username
             )
 
-        # get an obj
-        @self.get(
-            f"{self.path}/{{id}}", response=StandResponse[Union[self.out_schema, None]]
+        # 批量接口要在{id}路由之前注册，否则/bulk会被当成id匹配
+        # bulk create objs
+        @self.post(
+            f"{self.path}/bulk",
+            response=StandResponse[Union[BulkResultSchema, None]],
+            description="bulk create, id in results is null on MySQL",
         )
-        def get_obj(request, id: int):
-            obj = self.service_impl.get_obj(id)
-            return StandResponse[Union[self.out_schema, None]](data=obj.data)
+        def bulk_create_obj(request, payload: List[dict] = Body(...)):
+            error = self._check_bulk_size(payload)
+            if error:
+                return error
+            return self.service_impl.bulk_create_obj(
+                payload, self.in_schema, request.user.username
+            )
+
+        # bulk partial update objs, every item must contain id
+        @self.patch(
+            f"{self.path}/bulk",
+            response=StandResponse[Union[BulkResultSchema, None]],
+            description="bulk partial update, item like {\"id\": 1, \"field\": \"value\"}",
+        )
+        def bulk_update_obj(request, payload: List[dict] = Body(...)):
+            error = self._check_bulk_size(payload)
+            if error:
+                return error
+            return self.service_impl.bulk_update_obj(
+                payload, self.in_schema, request.user.username
+            )
+
+        # bulk delete objs by ids
+        @self.delete(f"{self.path}/bulk", response=StandResponse[Union[BulkResultSchema, None]])
+        def bulk_delete_obj(request, ids: List[StrictInt] = Body(...)):
+            error = self._check_bulk_size(ids)
+            if error:
+                return error
+            return self.service_impl.bulk_delete_obj(ids)
+
+        # export all objs matching the filters, also must be registered before {id}
+        @self.get(f"{self.path}/export", description="stream all matched objs as ndjson or csv")
+        def export_obj(
+            request,
+            filters: self.filters_class = Query(...),
+            export_format: FileFormat = Query(FileFormat.ndjson, alias="format"),
+            gzip: bool = False,
+        ):
+            fields, rows = self.service_impl.export_rows(filters, self.out_schema)
+            encoder = export.StreamEncoder(export_format, fields, gzip=gzip)
+            return self._export_response(export.stream(rows, encoder), export_format, gzip)
+
+        # get objs by ids in one query, ?ids=1,2,3 or ?ids=1&ids=2
+        @self.get(f"{self.path}/batch", response=batch_response, description="get objs by ids, keep the order of ids")
+        def get_many_obj(request, ids: List[str] = Query(...), fields: Optional[str] = None):
+            return self._batch_response(batch_response, self._parse_ids(ids), fields)
+
+        # POST for id lists too long for the url
+        @self.post(f"{self.path}/batch", response=batch_response, description="get objs by ids in body")
+        def post_get_many_obj(request, ids: List[int] = Body(...), fields: Optional[str] = None):
+            return self._batch_response(batch_response, ids, fields)
+
+        # get an obj
+        @self.get(f"{self.path}/{{id}}", response=obj_response)
+        def get_obj(request, id: int, response: HttpResponse, fields: Optional[str] = None):
+            if not self.etag:
+                obj = self.service_impl.get_obj(id, self.out_schema, fields=fields)
+            else:
+                obj, update_at = self.service_impl.get_obj_with_version(id, self.out_schema, fields=fields)
+                not_modified = self._not_modified(request, response, obj_etag(id, update_at), update_at)
+                if not_modified is not None:
+                    return not_modified
+            if fields:
+                return sparse_response(obj_response, obj)
+            return build_response(obj_response, obj.data)
 
         # get a list of objs
-        @self.get(self.path, response=StandResponse[PageSchema[self.out_schema]])
-        def list_obj(request, filters: self.filters_class = Query(...)):
-            objs = self.service_impl.list_obj(filters, self.out_schema)
-            return StandResponse[PageSchema[self.out_schema]](data=objs)
+        list_kwargs = {"cursor_pagination": True} if self.cursor_pagination else {}
+
+        @self.get(self.path, response=page_response)
+        def list_obj(request, response: HttpResponse, filters: self.filters_class = Query(...)):
+            if self.etag:
+                update_at, count = self.service_impl.list_obj_version(filters)
+                not_modified = self._not_modified(request, response, list_etag(filters, update_at, count))
+                if not_modified is not None:
+                    return not_modified
+            objs = self.service_impl.list_obj(filters, self.out_schema, **list_kwargs)
+            if filters.fields:
+                return sparse_response(page_response, StandResponse(data=objs))
+            return build_response(page_response, objs)
 
         # full update obj
         @self.put(
@@ -70,10 +223,278 @@ class CRUDRouter(Router):
         )
         def partial_update_obj(request, id: int, payload: dict = Body(...)):
             return self.service_impl.partial_update(
-                id, request.user.username, **payload
+                id, request.user.username, self.in_schema, **payload
             )
 
         # delete an obj
         @self.delete(f"{self.path}/{{id}}", response=StandResponse[bool])
         def delete_obj(request, id: int):
             return self.service_impl.delete_obj(id)
+
+    @staticmethod
+    def _not_modified(
+        request, response: HttpResponse, etag: Optional[str], last_modified: Optional[datetime.datetime] = None
+    ) -> Optional[HttpResponse]:
+        """设置ETag/Last-Modified响应头，条件请求命中时返回304
+
+        列表只用ETag: 行被删除或不再满足过滤条件时，剩下的行的max(update_at)可能不变，要靠ETag里的总数区分
+        """
+        if etag is None:
+            return None
+        response["ETag"] = etag
+        timestamp = None
+        if last_modified is not None:
+            timestamp = int(last_modified.timestamp())
+            response["Last-Modified"] = http_date(timestamp)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            for header in ("ETag", "Last-Modified"):
+                if header in response:
+                    not_modified[header] = response[header]
+        return not_modified
+
+    @staticmethod
+    def _parse_ids(values: List[str]) -> List[int]:
+        try:
+            return [int(value) for item in values for value in item.split(",") if value.strip()]
+        except ValueError:
+            raise HttpError(400, "ids must be integers")
+
+    def _batch_response(self, batch_response, ids: List[int], fields: Optional[str]):
+        error = self._check_bulk_size(ids)
+        if error:
+            return error
+        result = self.service_impl.get_many(ids, self.out_schema, fields=fields)
+        if fields:
+            return sparse_response(batch_response, result)
+        return build_response(batch_response, result.data)
+
+    def _export_response(self, chunks, export_format: FileFormat, gzip: bool) -> StreamingHttpResponse:
+        response = StreamingHttpResponse(chunks, content_type=export.CONTENT_TYPES[export_format])
+        filename = f"{self.service_impl.model._meta.model_name}.{export_format.value}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        return response
+
+    @staticmethod
+    def _check_bulk_size(items: list) -> Optional[StandResponse]:
+        max_items = getattr(settings, "BULK_MAX_ITEMS", 5000)
+        if len(items) > max_items:
+            return StandResponse[None](
+                success=False, message=f"too many items, max {max_items}", data=None
+            )
+        return None
+
+
+class AsyncCRUDRouter(CRUDRouter):
+    """CRUDRouter的async版本，路由和响应结构完全一致
+
+    service_impl需要是AsyncGenericCURDSoftDelete，配合ASGI部署使用
+    auth需要是async的认证类，例如core.auth.AsyncCachedJWTAuth，同步的认证类缓存没有命中时会在线程里查库
+    """
+
+    def __init__(self, service_impl: AsyncGenericCURDSoftDelete, *args, **kwargs):
+        super().__init__(service_impl, *args, **kwargs)
+        auths = self.auth if isinstance(self.auth, (list, tuple)) else [self.auth]
+        for auth in auths:
+            if auth not in (None, NOT_SET) and not (is_async_callable(auth) or getattr(auth, "is_async", False)):
+                raise ConfigError(f"AsyncCRUDRouter requires an async auth, got {auth!r}")
+
+    async def _abatch_response(self, batch_response, ids: List[int], fields: Optional[str]):
+        error = self._check_bulk_size(ids)
+        if error:
+            return error
+        result = await self.service_impl.aget_many(ids, self.out_schema, fields=fields)
+        if fields:
+            return sparse_response(batch_response, result)
+        return build_response(batch_response, result.data)
+
+    def register_crud_routes(self):
+        obj_response, page_response, batch_response = self.response_types()
+
+        # create an obj
+        @self.post(self.path, response=StandResponse[Union[DictId, None]])
+        async def create_obj(request, payload: self.in_schema):
+            return await self.service_impl.acreate_obj(
+                payload, request.user.username
+            )
+
+        # bulk create objs
+        @self.post(f"{self.path}/bulk", response=StandResponse[Union[BulkResultSchema, None]])
+        async def bulk_create_obj(request, payload: List[dict] = Body(...)):
+            error = self._check_bulk_size(payload)
+            if error:
+                return error
+            return await self.service_impl.abulk_create_obj(
+                payload, self.in_schema, request.user.username
+            )
+
+        # bulk partial update objs, every item must contain id
+        @self.patch(
+            f"{self.path}/bulk",
+            response=StandResponse[Union[BulkResultSchema, None]],
+            description="bulk partial update, item like {\"id\": 1, \"field\": \"value\"}",
+        )
+        async def bulk_update_obj(request, payload: List[dict] = Body(...)):
+            error = self._check_bulk_size(payload)
+            if error:
+                return error
+            return await self.service_impl.abulk_update_obj(
+                payload, self.in_schema, request.user.username
+            )
+
+        # bulk delete objs by ids
+        @self.delete(f"{self.path}/bulk", response=StandResponse[Union[BulkResultSchema, None]])
+        async def bulk_delete_obj(request, ids: List[StrictInt] = Body(...)):
+            error = self._check_bulk_size(ids)
+            if error:
+                return error
+            return await self.service_impl.abulk_delete_obj(ids)
+
+        # export all objs matching the filters
+        @self.get(f"{self.path}/export", description="stream all matched objs as ndjson or csv")
+        async def export_obj(
+            request,
+            filters: self.filters_class = Query(...),
+            export_format: FileFormat = Query(FileFormat.ndjson, alias="format"),
+            gzip: bool = False,
+        ):
+            fields, rows = self.service_impl.aexport_rows(filters, self.out_schema)
+            encoder = export.StreamEncoder(export_format, fields, gzip=gzip)
+            return self._export_response(export.astream(rows, encoder), export_format, gzip)
+
+        # get objs by ids in one query
+        @self.get(f"{self.path}/batch", response=batch_response, description="get objs by ids, keep the order of ids")
+        async def get_many_obj(request, ids: List[str] = Query(...), fields: Optional[str] = None):
+            return await self._abatch_response(batch_response, self._parse_ids(ids), fields)
+
+        @self.post(f"{self.path}/batch", response=batch_response, description="get objs by ids in body")
+        async def post_get_many_obj(request, ids: List[int] = Body(...), fields: Optional[str] = None):
+            return await self._abatch_response(batch_response, ids, fields)
+
+        # get an obj
+        @self.get(f"{self.path}/{{id}}", response=obj_response)
+        async def get_obj(request, id: int, response: HttpResponse, fields: Optional[str] = None):
+            if not self.etag:
+                obj = await self.service_impl.aget_obj(id, self.out_schema, fields=fields)
+            else:
+                obj, update_at = await self.service_impl.aget_obj_with_version(id, self.out_schema, fields=fields)
+                not_modified = self._not_modified(request, response, obj_etag(id, update_at), update_at)
+                if not_modified is not None:
+                    return not_modified
+            if fields:
+                return sparse_response(obj_response, obj)
+            return build_response(obj_response, obj.data)
+
+        # get a list of objs
+        @self.get(self.path, response=page_response)
+        async def list_obj(request, response: HttpResponse, filters: self.filters_class = Query(...)):
+            if self.etag:
+                update_at, count = await self.service_impl.alist_obj_version(filters)
+                not_modified = self._not_modified(request, response, list_etag(filters, update_at, count))
+                if not_modified is not None:
+                    return not_modified
+            objs = await self.service_impl.alist_obj(
+                filters, self.out_schema, cursor_pagination=self.cursor_pagination
+            )
+            if filters.fields:
+                return sparse_response(page_response, StandResponse(data=objs))
+            return build_response(page_response, objs)
+
+        # full update obj
+        @self.put(
+            f"{self.path}/{{id}}",
+            response=OptionalDictResponseType,
+            description="full obj update",
+        )
+        async def update_obj(request, id: int, payload: self.in_schema):
+            return await self.service_impl.aupdate_obj(
+                id, payload, request.user.username
+            )
+
+        # partial update obj
+        @self.patch(
+            f"{self.path}/{{id}}",
+            response=OptionalDictResponseType,
+            description="partial obj update",
+        )
+        async def partial_update_obj(request, id: int, payload: dict = Body(...)):
+            return await self.service_impl.apartial_update(
+                id, request.user.username, self.in_schema, **payload
+            )
+
+        # delete an obj
+        @self.delete(f"{self.path}/{{id}}", response=StandResponse[bool])
+        async def delete_obj(request, id: int):
+            return await self.service_impl.adelete_obj(id)
+
+
+class ImportRouter(Router):
+    """大文件导入，上传NDJSON/CSV文件或指定IMPORT_DIR下的文件，由celery任务后台分批写入
+
+    POST {path} 创建导入任务，GET {path}/{job_id} 查询进度和失败行
+    """
+
+    def __init__(
+        self,
+        service_impl: GenericCURD,
+        in_schema: Type[TSchema],
+        path: str = "",
+        tags: Optional[List[str]] = None,
+        auth: Any = NOT_SET,
+    ):
+        super().__init__(tags=tags, auth=auth)
+        self.service_impl = service_impl
+        self.in_schema = in_schema
+        self.path = path
+        self.register_import_routes()
+
+    def register_import_routes(self):
+        @self.post(self.path, response=StandResponse[Union[ImportJobSchema, None]])
+        def create_import(
+            request,
+            file: Optional[UploadedFile] = File(None),
+            file_path: Optional[str] = Form(None, description="IMPORT_DIR下的文件，不上传文件时使用"),
+            file_format: Optional[FileFormat] = Form(None, alias="format", description="默认按扩展名判断"),
+        ):
+            if file is not None:
+                path = self._save_upload(file)
+            elif file_path:
+                path = importer.resolve_file_path(file_path)
+            else:
+                return StandResponse[None](success=False, message="file or file_path is required", data=None)
+            if file_format is None:
+                file_format = FileFormat.csv if path.suffix.lower() == ".csv" else FileFormat.ndjson
+            job = ImportJob.objects.create(
+                model_label=self.service_impl.model._meta.label,
+                in_schema=importer.schema_path(self.in_schema),
+                file_path=str(path),
+                uploaded=file is not None,
+                file_format=file_format.value,
+                creator=request.user.username,
+            )
+            transaction.on_commit(lambda: self.dispatch(job.id))
+            return StandResponse[Union[ImportJobSchema, None]](data=job)
+
+        @self.get(f"{self.path}/{{job_id}}", response=StandResponse[Union[ImportJobSchema, None]])
+        def get_import(request, job_id: int):
+            job = ImportJob.objects.filter(id=job_id, model_label=self.service_impl.model._meta.label).first()
+            return StandResponse[Union[ImportJobSchema, None]](data=job)
+
+    @staticmethod
+    def dispatch(job_id: int):
+        from apidemo.celery_config import import_rows
+
+        import_rows.delay(job_id)
+
+    @staticmethod
+    def _save_upload(file: UploadedFile):
+        """上传的文件分块写到IMPORT_DIR，不整个读进内存"""
+        directory = importer.import_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{uuid.uuid4().hex}{Path(file.name).suffix}"
+        with open(path, "wb") as f:
+            for chunk in file.chunks():
+                f.write(chunk)
+        return path
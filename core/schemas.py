@@ -1,7 +1,11 @@
-from typing import TypeVar, Generic, List, Optional, Union
+from enum import Enum
+import datetime
+from typing import Any, ClassVar, TypeVar, Generic, List, Optional, Tuple, Union
 from ninja import Schema
 from pydantic import conint, BaseModel, Field, field_validator
 
+from core import perf
+
 
 class ErrorMsg(BaseModel):
     message: Optional[str] = None
@@ -14,6 +18,11 @@ GenericResultsType = TypeVar("GenericResultsType")
 class StandResponse(ErrorMsg, Generic[GenericResultsType]):
     data: GenericResultsType
 
+    def model_dump(self, **kwargs) -> dict:
+        # ninja把视图返回的响应转换成dict时调用，计入序列化耗时
+        with perf.timer("serialize"):
+            return super().model_dump(**kwargs)
+
 
 class DictId(BaseModel):
     id: conint(ge=-1)
@@ -22,17 +31,102 @@ class DictId(BaseModel):
 OptionalDictResponseType = StandResponse[Union[Optional[DictId], dict]]
 
 
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    success: bool = True
+    message: Optional[str] = None
+
+
+class BulkResultSchema(BaseModel):
+    results: List[BulkItemResult]
+    failed_indexes: List[int]
+
+
+class BatchSchema(BaseModel, Generic[GenericResultsType]):
+    details: List[GenericResultsType] = Field(description="按请求的ids顺序，不包含不存在的id")
+    missing_ids: List[int]
+
+
+class HttpMethod(str, Enum):
+    get = "GET"
+    post = "POST"
+    put = "PUT"
+    patch = "PATCH"
+    delete = "DELETE"
+
+
+class BatchOperation(Schema):
+    method: HttpMethod
+    path: str = Field(description="完整路径，可以带查询参数，如/api/employee/employees/1?fields=id")
+    body: Any = Field(None, description="JSON请求体")
+
+
+class BatchPayload(Schema):
+    operations: List[BatchOperation]
+    atomic: bool = Field(False, description="在一个事务里执行，有一个失败时全部回滚，后面的操作不再执行")
+
+
+class BatchOperationResult(BaseModel):
+    status: int
+    body: Any = None
+
+
+class CountStrategy(str, Enum):
+    exact = "exact"
+    cached = "cached"
+    estimate = "estimate"
+    none = "none"
+
+
+class FileFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+class ImportJobSchema(Schema):
+    id: int
+    status: str
+    processed_rows: int
+    created_rows: int
+    failed_rows: int
+    errors: List[dict] = Field(description="失败行，如{\"line\": 3, \"message\": \"...\"}")
+    message: Optional[str] = None
+    create_at: datetime.datetime
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+
 class PageSchema(BaseModel, Generic[GenericResultsType]):
-    total: int
+    total: Optional[int] = None
     page_size: int
     page_index: int
     details: List[GenericResultsType]
+    has_next: Optional[bool] = None
+    is_estimate: bool = False
+
+
+class CursorPageSchema(BaseModel, Generic[GenericResultsType]):
+    page_size: int
+    next_cursor: Optional[str] = None
+    details: List[GenericResultsType]
 
 
 class PageFilter(Schema):
+    # 支持?q=全文搜索的字段，需要在migration里创建索引，见core.search
+    search_fields: ClassVar[Tuple[str, ...]] = ()
+
     page_index: int = 1
     page_size: conint(ge=1, le=100) = 10
     ordering: str = Field("", alias="ordering", description="排序字段，多个时用,分割")
+    cursor: Optional[str] = Field(None, description="游标分页时上一页返回的next_cursor，首页不传")
+    fields: Optional[str] = Field(None, description="只返回指定字段，多个时用,分割")
+    q: Optional[str] = Field(None, description="全文搜索search_fields，结果按相关度排序")
+    count_strategy: CountStrategy = Field(
+        CountStrategy.exact,
+        alias="count",
+        description="总数计算方式: exact精确, cached缓存, estimate执行计划估算, none不计算只返回has_next",
+    )
 
     @field_validator("page_index")
     def page_index_check(cls, page_index):
@@ -50,7 +144,7 @@ class PageFilter(Schema):
         exclude_defaults: bool = False,
     ) -> "DictStrAny":
         if exclude is None:
-            exclude = {"page_index", "page_size", "ordering"}
+            exclude = {"page_index", "page_size", "ordering", "cursor", "count_strategy", "fields", "q"}
         return super().dict(
             exclude_none=exclude_none,
             exclude=exclude,
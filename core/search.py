@@ -0,0 +1,81 @@
+"""全文搜索
+
+替代__contains的LIKE '%x%'，前导通配符用不上索引，数据量大时全表扫描
+
+- SQLite: FTS5外部内容表{table}_fts(trigram分词，需要SQLite 3.34+)，按子串匹配，bm25排序
+  trigram按3个字符切分，中文不需要分词；少于3个字符的词用不上索引，退回icontains
+- MySQL: FULLTEXT索引(ngram分词)，按MATCH ... AGAINST的相关度排序
+- 其他数据库和更早的SQLite退回icontains，不排序
+
+每种方式都是多个词之间AND，每个词匹配任意一个search_fields
+索引在migration里用SQL创建(参考employee/migrations/0007_employee_search_index.py)，过滤类上声明search_fields后，
+?q=会使用这个索引
+"""
+from typing import List, Sequence
+
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+RANK = "search_rank"
+# trigram分词最短能匹配的词长
+TRIGRAM = 3
+# 支持trigram分词的最低SQLite版本
+TRIGRAM_MIN_SQLITE = (3, 34)
+
+
+def _fts_table(table: str) -> str:
+    return f"{table}_fts"
+
+
+def _columns(model, fields: Sequence[str]) -> List[str]:
+    return [model._meta.get_field(field).column for field in fields]
+
+
+def fts5_query(words: List[str]) -> str:
+    """每个词加引号避免FTS5语法错误，trigram按子串匹配，多个词之间是AND"""
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def mysql_boolean_query(words: List[str]) -> str:
+    """BOOLEAN MODE下每个词都必须出现，和其他数据库一样是AND，ngram分词时每个词按短语匹配"""
+    return " ".join('+"{}"'.format(word.replace('"', " ")) for word in words)
+
+
+def _use_fts5(connection, words: List[str]) -> bool:
+    return (
+        connection.vendor == "sqlite"
+        and connection.Database.sqlite_version_info >= TRIGRAM_MIN_SQLITE
+        and min(len(word) for word in words) >= TRIGRAM
+    )
+
+
+def search(queryset: QuerySet, fields: Sequence[str], term: str) -> QuerySet:
+    """按相关度排序的搜索结果，相关度保存在search_rank"""
+    words = term.split()
+    if not words:
+        return queryset
+    model = queryset.model
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    table, pk = model._meta.db_table, model._meta.pk.column
+    if _use_fts5(connection, words):
+        fts, match = quote(_fts_table(table)), fts5_query(words)
+        # 子查询按rowid取这一行的bm25，bm25越小越相关
+        rank = RawSQL(
+            f"SELECT bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND {fts}.rowid = {quote(table)}.{quote(pk)}",
+            (match,),
+        )
+        matched = RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", (match,))
+        return queryset.filter(pk__in=matched).annotate(**{RANK: rank}).order_by(RANK, "-pk")
+    if connection.vendor == "mysql":
+        cols = ", ".join(f"{quote(table)}.{quote(c)}" for c in _columns(model, fields))
+        rank = RawSQL(f"MATCH ({cols}) AGAINST (%s IN BOOLEAN MODE)", (mysql_boolean_query(words),))
+        return queryset.annotate(**{RANK: rank}).filter(**{f"{RANK}__gt": 0}).order_by(f"-{RANK}", "-pk")
+    condition = Q()
+    for word in words:
+        word_condition = Q()
+        for field in fields:
+            word_condition |= Q(**{f"{field}__icontains": word})
+        condition &= word_condition
+    return queryset.filter(condition)
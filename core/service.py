@@ -1,16 +1,40 @@
+import logging
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Union, Optional
+from functools import lru_cache, partial
+from operator import attrgetter, itemgetter
+import datetime
+from typing import Annotated, Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple, Type, Union, Optional
 
-from core import cache, response
+from asgiref.sync import sync_to_async
+
+from core import cache, perf, response, search
 from core.model import CoreModelSoftDelete
-from core.schemas import DictId, PageFilter, PageSchema, StandResponse, OptionalDictResponseType
-from django.db.models import Model
+from core.schemas import (
+    BulkItemResult,
+    BulkResultSchema,
+    CursorPageSchema,
+    DictId,
+    OptionalDictResponseType,
+    PageFilter,
+    PageSchema,
+    StandResponse,
+)
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from django.db.models import Count, Max, Model, QuerySet
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from ninja import Schema
+from ninja.errors import HttpError
+from pydantic import TypeAdapter, ValidationError
 from utils import model_opertion
 from utils.model_opertion import GenericPayload
 
+logger = logging.getLogger(__name__)
+
 
 class BaseCURD(ABC):
     @abstractmethod
@@ -18,7 +42,9 @@ class BaseCURD(ABC):
         ...
 
     @abstractmethod
-    def get_obj(self, id: int) -> Union[Model, None]:  # pragma: no cover
+    def get_obj(
+        self, id: int, out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> Union[Model, None]:  # pragma: no cover
         ...
 
     @abstractmethod
@@ -35,10 +61,21 @@ class BaseCURD(ABC):
         ...
 
     def partial_update(
-        self, id: int, user_email: str, **fields_kv
+        self, id: int, user_email: str, in_schema: Optional[Type[Schema]] = None, /, **fields_kv
     ) -> Union[DictId, dict]:  # pragma: no cover
         ...
 
+    def select_fields(self, out_schema: Optional[Type[Schema]], fields: Optional[str]) -> Optional[List[str]]:
+        """解析fields参数，只允许out_schema中对应数据库列的字段"""
+        if not fields or out_schema is None:
+            return None
+        selected = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        columns = _model_columns(self.model)
+        invalid = [name for name in selected if name not in out_schema.model_fields or name not in columns]
+        if invalid:
+            raise HttpError(400, f"unknown fields: {', '.join(invalid)}")
+        return selected or None
+
     @staticmethod
     def query_or_cache(
         ttl: int, alias: str, key: str, func, *args, **kwargs
@@ -55,6 +92,10 @@ class BaseCURD(ABC):
     ):  # pragma: no cover
         return cache.query_or_cache_default(func, key, ttl, *args, **kwargs)
 
+    @staticmethod
+    def invalidate_cache(key: str, alias: str = "default"):  # pragma: no cover
+        return cache.invalidate(key, alias)
+
     @staticmethod
     def execute_sql(sql: str, db_conn):  # pragma: no cover
         with db_conn.cursor() as cursor:
@@ -72,7 +113,13 @@ class GenericCURD(BaseCURD):  # pragma: no cover
             model=self.model, payload=payload, creator=user_email
         )
 
-    def get_obj(self, id: int) -> StandResponse:
+    def get_obj(
+        self, id: int, out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> StandResponse:
+        """fields不为空时只返回这些字段的dict"""
+        selected = self.select_fields(out_schema, fields)
+        if selected:
+            return StandResponse(data=get_object_or_404(self.model.objects.values(*selected), id=id))
         return StandResponse(data=get_object_or_404(self.model, id=id))
 
     def list_obj(self, page_filter: PageFilter, page_schema: PageSchema) -> PageSchema:
@@ -88,7 +135,11 @@ class GenericCURD(BaseCURD):  # pragma: no cover
             updater=user_email, model=self.model, payload=payload, obj_id=id
         )
 
-    def partial_update(self, id: int, user_email: str, **fields_kv):
+    def partial_update(self, id: int, user_email: str, in_schema: Optional[Type[Schema]] = None, /, **fields_kv):
+        try:
+            fields_kv = _validate_partial(in_schema, fields_kv)
+        except (ValidationError, KeyError) as e:
+            return OptionalDictResponseType(success=False, message=validation_message(e), data=None)
         return model_opertion.partial_update(
             updater=user_email, model=self.model, obj_id=id, **fields_kv
         )
@@ -100,13 +151,25 @@ class GenericCURD(BaseCURD):  # pragma: no cover
 
 
 class GenericCURDSoftDelete(BaseCURD):
-    def __init__(self, model: CoreModelSoftDelete):
+    # 游标分页的排序键，最后一个字段必须唯一
+    cursor_ordering = ("-update_at", "-id")
+    # 批量接口每条INSERT/UPDATE语句包含的行数
+    bulk_batch_size = 500
+
+    def __init__(self, model: CoreModelSoftDelete, object_cache_ttl: int = 0):
         self.model = model
+        # 大于0时开启get_obj的对象缓存，缓存out_schema序列化后的dict，写操作会自动失效
+        # 多进程部署时CACHES需要配置成Redis等共享缓存，否则其他进程会读到旧数据
+        self.object_cache_ttl = object_cache_ttl
 
     def create_obj(self, payload, user_email) -> StandResponse[Union[DictId, dict]]:
-        return model_opertion.create(
+        result = model_opertion.create(
             model=self.model, payload=payload, creator=user_email
         )
+        if result.success:
+            # 新id可能被缓存成了不存在
+            self.invalidate_objs([result.data.id])
+        return result
 
     def create_obj_with_validate_unique(
         self,
@@ -128,32 +191,187 @@ class GenericCURDSoftDelete(BaseCURD):
             return None
         return obj
 
-    def get_obj(self, id: int) -> StandResponse:
-        return StandResponse(data=self._get_obj_by_id(id=id))
+    def get_obj(
+        self, id: int, out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> StandResponse:
+        """fields不为空时只返回这些字段的dict，不构造模型实例"""
+        return self.get_obj_with_version(id, out_schema, fields)[0]
 
-    def list_obj(self, page_filter: PageFilter, page_schema: PageSchema) -> PageSchema:
-        qs = self.model.objects.filter(**page_filter.dict(), is_deleted=0)
-        return response.get_page(
-            queryset=qs, pager_filter=page_filter, generic_result_type=page_schema
-        )
+    def get_obj_with_version(
+        self, id: int, out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> Tuple[StandResponse, Optional[datetime.datetime]]:
+        """get_obj，同时返回对象的update_at用来生成ETag，和对象一起读取，不额外查询"""
+        selected = self.select_fields(out_schema, fields)
+        if self.object_cache_ttl and out_schema is not None:
+            entry = self._get_cached_entry(id, out_schema)
+            return StandResponse(data=_pick(entry["data"], selected)), entry.get("version")
+        if selected:
+            row = self._alive().filter(id=id).values(*_version_columns(selected)).first()
+            return StandResponse(data=_pick(row, selected)), _version(row)
+        obj = self._get_obj_by_id(id=id)
+        return StandResponse(data=obj), _version(obj)
+
+    def get_many(
+        self, ids: List[int], out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> StandResponse:
+        """按ids批量获取，一次id__in查询，details按ids的顺序，不存在或已删除的id放在missing_ids
+
+        开启对象缓存时先批量读缓存，只查询未命中的id
+        """
+        ids = list(dict.fromkeys(ids))
+        selected = self.select_fields(out_schema, fields)
+        if self.object_cache_ttl and out_schema is not None:
+            found = self._get_many_cached(ids, out_schema)
+            rows = {obj_id: _pick(data, selected) for obj_id, data in found.items() if data is not None}
+        elif selected:
+            rows = _values_by_id(self._alive().filter(id__in=ids), selected)
+        else:
+            rows = self._alive().in_bulk(ids)
+        return StandResponse(data=_batch(ids, rows))
+
+    def _get_many_cached(self, ids: List[int], out_schema: Type[Schema]) -> Dict[int, Optional[dict]]:
+        keys, schema_name = {self._obj_cache_key(obj_id): obj_id for obj_id in ids}, _schema_name(out_schema)
+        found = {
+            keys[key]: cached["data"]
+            for key, cached in self.object_cache.get_many(list(keys)).items()
+            if cached["schema"] == schema_name
+        }
+        misses = [obj_id for obj_id in ids if obj_id not in found]
+        if misses:
+            objs = self._alive().in_bulk(misses)
+            loaded = {obj_id: _cache_entry(objs.get(obj_id), out_schema) for obj_id in misses}
+            for ttl, values in self._group_by_ttl(loaded).items():
+                self.object_cache.set_many(values, ttl)
+            found.update({obj_id: entry["data"] for obj_id, entry in loaded.items()})
+        return found
+
+    def _group_by_ttl(self, loaded: Dict[int, dict]) -> Dict[int, Dict[str, dict]]:
+        """按缓存时间分组的{ttl: {key: value}}，不存在的id缓存时间短一些"""
+        entries: Dict[int, Dict[str, dict]] = {}
+        for obj_id, entry in loaded.items():
+            entries.setdefault(self._obj_cache_ttl(entry["data"]), {})[self._obj_cache_key(obj_id)] = entry
+        return entries
+
+    def _alive(self) -> QuerySet:
+        return self.model.objects.alive()
+
+    @property
+    def object_cache(self):
+        return caches[getattr(settings, "OBJECT_CACHE_ALIAS", "default")]
+
+    def _obj_cache_key(self, id: int) -> str:
+        return f"core:obj:{self.model._meta.label_lower}:{id}"
+
+    def _get_cached_entry(self, id: int, out_schema: Type[Schema]) -> dict:
+        key = self._obj_cache_key(id)
+        cached = self.object_cache.get(key)
+        if cached is not None and cached["schema"] == _schema_name(out_schema):
+            return cached
+        entry = _cache_entry(self._get_obj_by_id(id=id), out_schema)
+        self.object_cache.set(key, entry, self._obj_cache_ttl(entry["data"]))
+        return entry
+
+    def _obj_cache_ttl(self, data: Optional[dict]) -> int:
+        if data is None:
+            # 不存在的id也缓存，时间短一些，防止大量404请求打到数据库
+            return min(self.object_cache_ttl, getattr(settings, "OBJECT_CACHE_NEGATIVE_TTL", 30))
+        return self.object_cache_ttl
+
+    def invalidate_objs(self, ids: List[Optional[int]]):
+        if not self.object_cache_ttl:
+            return
+        keys = [self._obj_cache_key(obj_id) for obj_id in ids if obj_id is not None]
+        if not keys:
+            return
+        self.object_cache.delete_many(keys)
+        # 事务提交前其他请求可能又缓存了旧数据，提交后再删一次
+        transaction.on_commit(lambda: self.object_cache.delete_many(keys))
+
+    def list_obj(
+        self,
+        page_filter: PageFilter,
+        page_schema: PageSchema,
+        cursor_pagination: bool = False,
+    ) -> Union[PageSchema, CursorPageSchema]:
+        qs, page_schema, selected = self._list_values(page_filter, page_schema, cursor_pagination)
+        if cursor_pagination:
+            page = response.get_cursor_page(
+                queryset=qs,
+                pager_filter=page_filter,
+                generic_result_type=page_schema,
+                ordering=self.cursor_ordering,
+            )
+        else:
+            page = response.get_page(
+                queryset=qs, pager_filter=page_filter, generic_result_type=page_schema
+            )
+        return _trim_details(page, selected)
+
+    def list_obj_version(self, page_filter: PageFilter) -> Tuple[Optional[datetime.datetime], int]:
+        """列表的最大update_at和总数，一次聚合查询，用来在查询和序列化这一页之前判断ETag"""
+        result = self._list_queryset(page_filter).aggregate(last_update_at=Max("update_at"), count=Count("id"))
+        return result["last_update_at"], result["count"]
+
+    def _list_values(
+        self, page_filter: PageFilter, page_schema: Type[Schema], cursor_pagination: bool
+    ) -> Tuple[QuerySet, Any, Optional[List[str]]]:
+        """指定了fields时用values()只查这些列，结果直接是dict，跳过out_schema校验"""
+        qs = self._list_queryset(page_filter)
+        selected = self.select_fields(page_schema, page_filter.fields)
+        if not selected:
+            return qs, page_schema, None
+        columns = list(selected)
+        if cursor_pagination:
+            # 生成游标需要排序字段的值
+            columns += [f.lstrip("-") for f in self.cursor_ordering if f.lstrip("-") not in selected]
+        return qs.values(*columns), dict, selected
+
+    def _list_queryset(self, page_filter: PageFilter) -> QuerySet:
+        qs = self._alive().filter(**page_filter.dict())
+        if page_filter.q and page_filter.search_fields:
+            qs = search.search(qs, page_filter.search_fields, page_filter.q)
+        return qs
+
+    def export_rows(self, page_filter: PageFilter, out_schema: Type[Schema]) -> Tuple[List[str], Iterator[dict]]:
+        """导出时逐块读取数据，返回(字段, 行迭代器)，字段都是数据库列时用values()不构造模型实例"""
+        fields, qs = self._export_queryset(page_filter, out_schema)
+        chunk_size = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+        if _model_columns(self.model).issuperset(fields):
+            chunks = _keyset_chunks(qs.values(*_id_columns(fields)), chunk_size, itemgetter("id"))
+            return fields, (_pick(row, fields) for chunk in chunks for row in chunk)
+        chunks = _keyset_chunks(qs, chunk_size, attrgetter("pk"))
+        return fields, (_pick(_dump_obj(obj, out_schema), fields) for chunk in chunks for obj in chunk)
+
+    def _export_queryset(self, page_filter: PageFilter, out_schema: Type[Schema]) -> Tuple[List[str], QuerySet]:
+        """导出按主键分块，搜索结果也按主键排序，不保持相关度排序"""
+        fields = self.select_fields(out_schema, page_filter.fields) or list(out_schema.model_fields)
+        return fields, self._list_queryset(page_filter).order_by("pk")
 
     def update_obj(
         self, id: int, payload: GenericPayload, user_email: str
     ) -> OptionalDictResponseType:
-        obj = self._get_obj_by_id(id=id)
-        if obj is None:
-            return OptionalDictResponseType(
-                message=f"{id=} not exist", success=False, data={}
-            )
-        return model_opertion.update_by_obj(
-            updater=user_email, obj=obj, **payload.dict()
+        result = model_opertion.update_fields(
+            updater=user_email, model=self.model, obj_id=id, filters={"is_deleted": 0}, **payload.dict()
         )
+        self.invalidate_objs([id])
+        return result
 
     def partial_update(
-        self, id: int, user_email: str, **fields_kv
+        self, id: int, user_email: str, in_schema: Optional[Type[Schema]] = None, /, **fields_kv
     ) -> OptionalDictResponseType:
-        obj = self._get_obj_by_id(id=id)
-        return model_opertion.update_by_obj(updater=user_email, obj=obj, **fields_kv)
+        """只UPDATE传入的字段，不先SELECT
+
+        传入in_schema时只允许其中的字段，并按字段类型校验；参数是仅位置参数，请求体里的id等字段会进到fields_kv被拒绝
+        """
+        try:
+            fields_kv = _validate_partial(in_schema, fields_kv)
+        except (ValidationError, KeyError) as e:
+            return OptionalDictResponseType(success=False, message=validation_message(e), data=None)
+        result = model_opertion.update_fields(
+            updater=user_email, model=self.model, obj_id=id, filters={"is_deleted": 0}, **fields_kv
+        )
+        self.invalidate_objs([id])
+        return result
 
     def delete_obj(self, id: int) -> StandResponse[bool]:
         obj = self._get_obj_by_id(id=id)
@@ -161,7 +379,503 @@ class GenericCURDSoftDelete(BaseCURD):
             return StandResponse[bool](data=False, message=f"{id=} not exist", success=False)
         obj.is_deleted = str(uuid.uuid1())
         obj.save()
+        self.invalidate_objs([id])
         return StandResponse[bool](data=True)
 
     def bulk_create(self, objs: list) -> list:  # pragma: no cover
-        return self.model.objects.bulk_create(objs)
+        return self.model.objects.bulk_create(objs, batch_size=self.bulk_batch_size)
+
+    def bulk_create_obj(
+        self, payloads: List[dict], in_schema: Type[Schema], user_email: str
+    ) -> StandResponse[BulkResultSchema]:
+        """批量创建，每一项单独校验
+
+        MySQL的INSERT不能返回多行的自增id，bulk_create之后对象没有pk，结果里的id是None
+        """
+        results: Dict[int, BulkItemResult] = {}
+        objs, indexes = [], []
+        for index, item in enumerate(payloads):
+            try:
+                payload = in_schema.model_validate(item)
+            except ValidationError as e:
+                results[index] = _failed(index, validation_message(e))
+                continue
+            objs.append(self.model(creator=user_email, **payload.dict()))
+            indexes.append(index)
+
+        with transaction.atomic():
+            self._bulk_write(objs, indexes, results, self.model.objects.bulk_create)
+        return self._bulk_response(results, len(payloads))
+
+    def insert_rows(self, rows: List[dict], user_email: str) -> int:
+        """已经校验过的dict直接executemany写入，不构造模型实例也不返回id，用于大批量导入
+
+        key是字段的attname(外键是xxx_id)，所有行的key相同，没有的字段用默认值
+        不会失效对象缓存，不存在的id在OBJECT_CACHE_NEGATIVE_TTL内可能仍返回不存在
+        """
+        if not rows:
+            return 0
+        connection = connections[router.db_for_write(self.model)]
+        now = timezone.now()
+        fixed = {"creator": user_email, "updater": None, "create_at": now, "update_at": now}
+        keys = rows[0].keys() - fixed.keys()
+        columns, getters = [], []
+        for field in self.model._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            columns.append(connection.ops.quote_name(field.column))
+            key = field.attname if field.attname in keys else field.name if field.name in keys else None
+            if key is None:
+                value = fixed[field.attname] if field.attname in fixed else field.get_default()
+                getters.append(partial(_constant, field.get_db_prep_save(value, connection)))
+            else:
+                getters.append(_row_getter(key, field, connection))
+        params = [tuple(getter(row) for getter in getters) for row in rows]
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            connection.ops.quote_name(self.model._meta.db_table),
+            ", ".join(columns),
+            ", ".join(["%s"] * len(columns)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+        return len(rows)
+
+    def bulk_update_obj(
+        self, items: List[dict], in_schema: Type[Schema], user_email: str
+    ) -> StandResponse[BulkResultSchema]:
+        """批量部分更新，每一项是{"id": 1, "字段": 值}，只校验传入的字段"""
+        results: Dict[int, BulkItemResult] = {}
+        changes = {}
+        for index, item in enumerate(items):
+            item = dict(item)
+            obj_id = item.pop("id", None)
+            # bool是int的子类，True不能当成id=1
+            if not isinstance(obj_id, int) or isinstance(obj_id, bool):
+                results[index] = _failed(index, "id is required")
+                continue
+            try:
+                changes[index] = (obj_id, _validate_fields(in_schema, item))
+            except (ValidationError, KeyError) as e:
+                results[index] = _failed(index, validation_message(e), obj_id)
+
+        objs, indexes, fields = [], [], {"updater", "update_at"}
+        now = timezone.now()
+        with transaction.atomic():
+            existing = self.model.objects.select_for_update().alive().in_bulk(
+                [obj_id for obj_id, _ in changes.values()]
+            )
+            for index, (obj_id, values) in changes.items():
+                obj = existing.get(obj_id)
+                if obj is None:
+                    results[index] = _failed(index, f"{obj_id=} not exist", obj_id)
+                    continue
+                for attr, value in values.items():
+                    setattr(obj, attr, value)
+                obj.updater = user_email
+                obj.update_at = now
+                fields.update(values)
+                objs.append(obj)
+                indexes.append(index)
+
+            self._bulk_write(
+                objs,
+                indexes,
+                results,
+                lambda chunk: self.model.objects.bulk_update(chunk, fields=list(fields)),
+            )
+        return self._bulk_response(results, len(items))
+
+    def bulk_delete_obj(self, ids: List[int]) -> StandResponse[BulkResultSchema]:
+        results: Dict[int, BulkItemResult] = {}
+        objs, indexes = [], []
+        now = timezone.now()
+        # 重复的id只删除一次，结果和第一次出现时相同
+        first_indexes: Dict[int, int] = {}
+        duplicates: Dict[int, int] = {}
+        with transaction.atomic():
+            existing = self.model.objects.alive().filter(id__in=set(ids)).only("id").in_bulk()
+            for index, obj_id in enumerate(ids):
+                if obj_id in first_indexes:
+                    duplicates[index] = first_indexes[obj_id]
+                    continue
+                first_indexes[obj_id] = index
+                obj = existing.get(obj_id)
+                if obj is None:
+                    results[index] = _failed(index, f"{obj_id=} not exist", obj_id)
+                    continue
+                # 每行使用不同的uuid，和delete_obj保持一致
+                obj.is_deleted = str(uuid.uuid1())
+                obj.update_at = now
+                objs.append(obj)
+                indexes.append(index)
+
+            self._bulk_write(
+                objs,
+                indexes,
+                results,
+                lambda chunk: self.model.objects.bulk_update(chunk, fields=["is_deleted", "update_at"]),
+            )
+        for index, first_index in duplicates.items():
+            results[index] = results[first_index].model_copy(update={"index": index})
+        return self._bulk_response(results, len(ids))
+
+    def _bulk_response(
+        self, results: Dict[int, BulkItemResult], total: int
+    ) -> StandResponse[BulkResultSchema]:
+        self.invalidate_objs([item.id for item in results.values() if item.success])
+        return _bulk_response(results, total)
+
+    def _bulk_write(
+        self,
+        objs: List[Model],
+        indexes: List[int],
+        results: Dict[int, BulkItemResult],
+        writer: Callable[[List[Model]], Any],
+    ):
+        """按bulk_batch_size分批写入，某一批失败时逐条重试，找出失败的行"""
+        for start in range(0, len(objs), self.bulk_batch_size):
+            chunk = objs[start:start + self.bulk_batch_size]
+            chunk_indexes = indexes[start:start + self.bulk_batch_size]
+            try:
+                with transaction.atomic():
+                    writer(chunk)
+            except Exception:
+                logger.warning(f"bulk write {self.model.__name__} failed, retry one by one")
+                for obj, index in zip(chunk, chunk_indexes):
+                    try:
+                        with transaction.atomic():
+                            writer([obj])
+                    except Exception as e:
+                        results[index] = _failed(index, str(e), obj.pk)
+                    else:
+                        results[index] = BulkItemResult(index=index, id=obj.pk)
+            else:
+                for obj, index in zip(chunk, chunk_indexes):
+                    results[index] = BulkItemResult(index=index, id=obj.pk)
+
+
+# 这些类型的值数据库驱动可以直接使用，不需要get_db_prep_save转换
+_PASSTHROUGH_TYPES = frozenset({
+    "AutoField", "BigAutoField", "SmallAutoField", "BooleanField", "CharField", "TextField", "FloatField",
+    "IntegerField", "BigIntegerField", "SmallIntegerField", "PositiveIntegerField",
+    "PositiveBigIntegerField", "PositiveSmallIntegerField",
+})
+
+
+def _constant(value: Any, row: dict) -> Any:
+    return value
+
+
+def _row_getter(key: str, field, connection) -> Callable[[dict], Any]:
+    target = field.target_field if field.is_relation else field
+    if target.get_internal_type() in _PASSTHROUGH_TYPES:
+        return itemgetter(key)
+
+    def getter(row: dict) -> Any:
+        value = row[key]
+        return None if value is None else field.get_db_prep_save(value, connection)
+
+    return getter
+
+
+def _schema_name(schema: Type[Schema]) -> str:
+    return f"{schema.__module__}.{schema.__qualname__}"
+
+
+def _dump_obj(obj: Optional[Model], out_schema: Type[Schema]) -> Optional[dict]:
+    if obj is None:
+        return None
+    with perf.timer("serialize"):
+        return out_schema.model_validate(obj).model_dump(mode="json")
+
+
+def _cache_entry(obj: Optional[Model], out_schema: Type[Schema]) -> dict:
+    """对象缓存的值，version是update_at，生成ETag时不用再查询"""
+    return {"schema": _schema_name(out_schema), "data": _dump_obj(obj, out_schema), "version": _version(obj)}
+
+
+def _version(obj: Union[Model, dict, None]) -> Optional[datetime.datetime]:
+    if obj is None:
+        return None
+    return obj["update_at"] if isinstance(obj, dict) else obj.update_at
+
+
+def _version_columns(fields: List[str]) -> List[str]:
+    """values()查询的列，额外查出update_at用来生成ETag，返回前去掉"""
+    return fields if "update_at" in fields else [*fields, "update_at"]
+
+
+def _pick(data: Optional[dict], fields: Optional[List[str]]) -> Optional[dict]:
+    if data is None or not fields:
+        return data
+    return {name: data[name] for name in fields}
+
+
+def _id_columns(fields: List[str]) -> List[str]:
+    """values()查询的列，没有选id时额外查出来用于对应，返回前去掉"""
+    return fields if "id" in fields else [*fields, "id"]
+
+
+def _values_by_id(queryset: QuerySet, fields: List[str]) -> Dict[int, dict]:
+    return {row["id"]: _pick(row, fields) for row in queryset.values(*_id_columns(fields))}
+
+
+async def _avalues_by_id(queryset: QuerySet, fields: List[str]) -> Dict[int, dict]:
+    return {row["id"]: _pick(row, fields) async for row in queryset.values(*_id_columns(fields))}
+
+
+def _keyset_chunks(queryset: QuerySet, chunk_size: int, get_pk: Callable[[Any], Any]) -> Iterator[list]:
+    """按主键分块读取，每块一次WHERE pk > 上一块最后的pk LIMIT chunk_size查询
+
+    不用iterator(): PyMySQL没有服务端游标，会一次读出全部结果；OFFSET分页越往后越慢
+    queryset需要按pk排序
+    """
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk = list(queryset.filter(pk__gt=get_pk(chunk[-1]))[:chunk_size])
+
+
+async def _akeyset_chunks(queryset: QuerySet, chunk_size: int, get_pk: Callable[[Any], Any]) -> AsyncIterator[list]:
+    chunk = [row async for row in queryset[:chunk_size]]
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk = [row async for row in queryset.filter(pk__gt=get_pk(chunk[-1]))[:chunk_size]]
+
+
+def _batch(ids: List[int], rows: Dict[int, Any]) -> dict:
+    return {
+        "details": [rows[obj_id] for obj_id in ids if obj_id in rows],
+        "missing_ids": [obj_id for obj_id in ids if obj_id not in rows],
+    }
+
+
+def _trim_details(
+    page: Union[PageSchema, CursorPageSchema], fields: Optional[List[str]]
+) -> Union[PageSchema, CursorPageSchema]:
+    """去掉为了游标分页额外查询的列"""
+    if fields:
+        page.details = [_pick(row, fields) for row in page.details]
+    return page
+
+
+@lru_cache(maxsize=None)
+def _model_columns(model: Type[Model]) -> frozenset:
+    names = set()
+    for field in model._meta.concrete_fields:
+        names.update((field.name, field.attname))
+    return frozenset(names)
+
+
+def _failed(index: int, message: str, obj_id: Optional[int] = None) -> BulkItemResult:
+    return BulkItemResult(index=index, id=obj_id, success=False, message=message)
+
+
+def validation_message(e: Union[ValidationError, KeyError]) -> str:
+    if isinstance(e, KeyError):
+        return f"unknown field {e.args[0]}"
+    return "; ".join(
+        f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+    )
+
+
+@lru_cache(maxsize=None)
+def _field_adapter(in_schema: Type[Schema], name: str) -> TypeAdapter:
+    field = in_schema.model_fields[name]
+    if field.metadata:
+        return TypeAdapter(Annotated[(field.annotation, *field.metadata)])
+    return TypeAdapter(field.annotation)
+
+
+def _validate_partial(in_schema: Optional[Type[Schema]], values: dict) -> dict:
+    return values if in_schema is None else _validate_fields(in_schema, values)
+
+
+def _validate_fields(in_schema: Type[Schema], values: dict) -> dict:
+    """只校验传入的字段，用于部分更新"""
+    validated = {}
+    for name, value in values.items():
+        if name not in in_schema.model_fields:
+            raise KeyError(name)
+        validated[name] = _field_adapter(in_schema, name).validate_python(value)
+    return validated
+
+
+def _bulk_response(results: Dict[int, BulkItemResult], total: int) -> StandResponse[BulkResultSchema]:
+    items = [results[index] for index in range(total)]
+    failed_indexes = [item.index for item in items if not item.success]
+    return StandResponse[BulkResultSchema](
+        success=not failed_indexes,
+        message=f"{len(failed_indexes)} of {total} items failed" if failed_indexes else None,
+        data=BulkResultSchema(results=items, failed_indexes=failed_indexes),
+    )
+
+
+class AsyncGenericCURDSoftDelete(GenericCURDSoftDelete):
+    """GenericCURDSoftDelete的async ORM版本，供AsyncCRUDRouter使用
+
+    同步方法全部保留，批量接口需要事务，通过sync_to_async执行同步版本
+    """
+
+    async def acreate_obj(self, payload, user_email) -> StandResponse[Union[DictId, dict]]:
+        result = await model_opertion.acreate(
+            model=self.model, payload=payload, creator=user_email
+        )
+        if result.success:
+            await self.ainvalidate_objs([result.data.id])
+        return result
+
+    async def _aget_obj_by_id(self, id: int, is_deleted=0) -> Union[Model, None]:
+        return await self.model.objects.filter(id=id, is_deleted=is_deleted).afirst()
+
+    async def aget_obj(
+        self, id: int, out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> StandResponse:
+        return (await self.aget_obj_with_version(id, out_schema, fields))[0]
+
+    async def aget_obj_with_version(
+        self, id: int, out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> Tuple[StandResponse, Optional[datetime.datetime]]:
+        selected = self.select_fields(out_schema, fields)
+        if self.object_cache_ttl and out_schema is not None:
+            entry = await self._aget_cached_entry(id, out_schema)
+            return StandResponse(data=_pick(entry["data"], selected)), entry.get("version")
+        if selected:
+            row = await self._alive().filter(id=id).values(*_version_columns(selected)).afirst()
+            return StandResponse(data=_pick(row, selected)), _version(row)
+        obj = await self._aget_obj_by_id(id=id)
+        return StandResponse(data=obj), _version(obj)
+
+    async def _aget_cached_entry(self, id: int, out_schema: Type[Schema]) -> dict:
+        key = self._obj_cache_key(id)
+        cached = await self.object_cache.aget(key)
+        if cached is not None and cached["schema"] == _schema_name(out_schema):
+            return cached
+        entry = _cache_entry(await self._aget_obj_by_id(id=id), out_schema)
+        await self.object_cache.aset(key, entry, self._obj_cache_ttl(entry["data"]))
+        return entry
+
+    async def aget_many(
+        self, ids: List[int], out_schema: Optional[Type[Schema]] = None, fields: Optional[str] = None
+    ) -> StandResponse:
+        ids = list(dict.fromkeys(ids))
+        selected = self.select_fields(out_schema, fields)
+        if self.object_cache_ttl and out_schema is not None:
+            found = await self._aget_many_cached(ids, out_schema)
+            rows = {obj_id: _pick(data, selected) for obj_id, data in found.items() if data is not None}
+        elif selected:
+            rows = await _avalues_by_id(self._alive().filter(id__in=ids), selected)
+        else:
+            rows = await self._alive().ain_bulk(ids)
+        return StandResponse(data=_batch(ids, rows))
+
+    async def _aget_many_cached(self, ids: List[int], out_schema: Type[Schema]) -> Dict[int, Optional[dict]]:
+        keys, schema_name = {self._obj_cache_key(obj_id): obj_id for obj_id in ids}, _schema_name(out_schema)
+        found = {
+            keys[key]: cached["data"]
+            for key, cached in (await self.object_cache.aget_many(list(keys))).items()
+            if cached["schema"] == schema_name
+        }
+        misses = [obj_id for obj_id in ids if obj_id not in found]
+        if misses:
+            objs = await self._alive().ain_bulk(misses)
+            loaded = {obj_id: _cache_entry(objs.get(obj_id), out_schema) for obj_id in misses}
+            for ttl, values in self._group_by_ttl(loaded).items():
+                await self.object_cache.aset_many(values, ttl)
+            found.update({obj_id: entry["data"] for obj_id, entry in loaded.items()})
+        return found
+
+    def aexport_rows(self, page_filter: PageFilter, out_schema: Type[Schema]) -> Tuple[List[str], AsyncIterator[dict]]:
+        fields, qs = self._export_queryset(page_filter, out_schema)
+        chunk_size = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+        to_columns = _model_columns(self.model).issuperset(fields)
+
+        async def rows():
+            if to_columns:
+                async for chunk in _akeyset_chunks(qs.values(*_id_columns(fields)), chunk_size, itemgetter("id")):
+                    for row in chunk:
+                        yield _pick(row, fields)
+                return
+            async for chunk in _akeyset_chunks(qs, chunk_size, attrgetter("pk")):
+                for obj in chunk:
+                    yield _pick(_dump_obj(obj, out_schema), fields)
+
+        return fields, rows()
+
+    async def ainvalidate_objs(self, ids: List[Optional[int]]):
+        if self.object_cache_ttl:
+            await sync_to_async(self.invalidate_objs)(ids)
+
+    async def alist_obj(
+        self,
+        page_filter: PageFilter,
+        page_schema: PageSchema,
+        cursor_pagination: bool = False,
+    ) -> Union[PageSchema, CursorPageSchema]:
+        qs, page_schema, selected = self._list_values(page_filter, page_schema, cursor_pagination)
+        if cursor_pagination:
+            page = await response.aget_cursor_page(
+                queryset=qs,
+                pager_filter=page_filter,
+                generic_result_type=page_schema,
+                ordering=self.cursor_ordering,
+            )
+        else:
+            page = await response.aget_page(
+                queryset=qs, pager_filter=page_filter, generic_result_type=page_schema
+            )
+        return _trim_details(page, selected)
+
+    async def alist_obj_version(self, page_filter: PageFilter) -> Tuple[Optional[datetime.datetime], int]:
+        result = await self._list_queryset(page_filter).aaggregate(
+            last_update_at=Max("update_at"), count=Count("id")
+        )
+        return result["last_update_at"], result["count"]
+
+    async def aupdate_obj(
+        self, id: int, payload: GenericPayload, user_email: str
+    ) -> OptionalDictResponseType:
+        result = await model_opertion.aupdate_fields(
+            updater=user_email, model=self.model, obj_id=id, filters={"is_deleted": 0}, **payload.dict()
+        )
+        await self.ainvalidate_objs([id])
+        return result
+
+    async def apartial_update(
+        self, id: int, user_email: str, in_schema: Optional[Type[Schema]] = None, /, **fields_kv
+    ) -> OptionalDictResponseType:
+        try:
+            fields_kv = _validate_partial(in_schema, fields_kv)
+        except (ValidationError, KeyError) as e:
+            return OptionalDictResponseType(success=False, message=validation_message(e), data=None)
+        result = await model_opertion.aupdate_fields(
+            updater=user_email, model=self.model, obj_id=id, filters={"is_deleted": 0}, **fields_kv
+        )
+        await self.ainvalidate_objs([id])
+        return result
+
+    async def adelete_obj(self, id: int) -> StandResponse[bool]:
+        obj = await self._aget_obj_by_id(id=id)
+        if obj is None:
+            return StandResponse[bool](data=False, message=f"{id=} not exist", success=False)
+        obj.is_deleted = str(uuid.uuid1())
+        await obj.asave()
+        await self.ainvalidate_objs([id])
+        return StandResponse[bool](data=True)
+
+    async def abulk_create_obj(
+        self, payloads: List[dict], in_schema: Type[Schema], user_email: str
+    ) -> StandResponse[BulkResultSchema]:
+        return await sync_to_async(self.bulk_create_obj)(payloads, in_schema, user_email)
+
+    async def abulk_update_obj(
+        self, items: List[dict], in_schema: Type[Schema], user_email: str
+    ) -> StandResponse[BulkResultSchema]:
+        return await sync_to_async(self.bulk_update_obj)(items, in_schema, user_email)
+
+    async def abulk_delete_obj(self, ids: List[int]) -> StandResponse[BulkResultSchema]:
+        return await sync_to_async(self.bulk_delete_obj)(ids)
@@ -1,13 +1,54 @@
-from django.test import TestCase, Client
+import datetime
+import decimal
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import ModuleType
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.urls import path
+from ninja import NinjaAPI
+from ninja.errors import ConfigError
+from ninja_jwt.exceptions import AuthenticationFailed, InvalidToken
+from django_redis import get_redis_connection
+from ninja_jwt.tokens import AccessToken
+
+from core.auth import AsyncCachedJWTAuth, CachedJWTAuth, _local_users, check_password
+from core.batch import BatchRouter
+from core import cache as core_cache, perf
+from core.db import router as db_router
+from core.db.pool import ConnectionPool, PoolTimeout
+from core.log import JsonFormatter, QueueListenerHandler
+from core.renderer import ORJSONRenderer
+from core.router import AsyncCRUDRouter
 
 from core.service import GenericCURD
+from employee.employee_service_impl import async_employee_service_impl
+from employee.models import Employee
+from employee.schemas import EmployeeFilters, EmployeeIn, EmployeeOut
 
 
-class AuthTokenTestCase(TestCase):
+class UserTestCase(TestCase):
+    """清空缓存，创建testuser，self.headers是带access token的请求头"""
+
     def setUp(self):
+        cache.clear()
+        _local_users().clear()
         self.client = Client()
         self.user = User.objects.create_user(username="testuser", password="12345")
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(self.user)}"}
+
+
+class AuthTokenTestCase(UserTestCase):
 
     def test_get_token_fresh_success(self):
         """Test obtain pair token
@@ -83,4 +124,587 @@ class AuthTokenTestCase(TestCase):
             data={"refresh": "12345"},
             content_type="application/json",
         )
-        self.assertEqual(response.status_code, 401)
\ No newline at end of file
+        self.assertEqual(response.status_code, 401)
+
+
+class TraceIdRendererTestCase(TestCase):
+    def test_trace_id_in_body_matches_header(self):
+        User.objects.create_user(username="testuser", password="12345")
+        response = Client().post(
+            "/api/token/pair",
+            {"username": "testuser", "password": "12345"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["trace_id"], response["TRACE_ID"])
+
+    def test_trace_id_in_error_body(self):
+        response = Client().post(
+            "/api/token/refresh",
+            data={"refresh": "12345"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["trace_id"], response["TRACE_ID"])
+
+    def test_orjson_renderer_types(self):
+        request = RequestFactory().get("/")
+        request.id = "abc"
+        data = {
+            "price": decimal.Decimal("1.10"),
+            "day": datetime.date(2024, 1, 2),
+            "at": datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+            "cost": datetime.timedelta(seconds=90),
+        }
+        content = ORJSONRenderer().render(request, data, response_status=200)
+        self.assertEqual(json.loads(content), {
+            "price": "1.10",
+            "day": "2024-01-02",
+            "at": "2024-01-02T03:04:05Z",
+            "cost": "P0DT00H01M30S",
+            "trace_id": "abc",
+        })
+
+
+class CachedJWTAuthTestCase(UserTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = AccessToken.for_user(self.user)
+        self.auth = CachedJWTAuth()
+
+    def test_user_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.auth.get_user(self.token).username, "testuser")
+        with self.assertNumQueries(0):
+            user = self.auth.get_user(self.token)
+        self.assertEqual((user.pk, user.username), (self.user.pk, "testuser"))
+
+        # 进程内缓存过期后从共享缓存读取
+        _local_users().clear()
+        with self.assertNumQueries(0):
+            self.auth.get_user(self.token)
+
+    def test_save_invalidates(self):
+        self.auth.get_user(self.token)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+    def test_deleted_user(self):
+        self.auth.get_user(self.token)
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+
+class AsyncCachedJWTAuthTestCase(UserTestCase):
+    async def test_authenticate(self):
+        auth = AsyncCachedJWTAuth()
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=self.headers["HTTP_AUTHORIZATION"])
+        self.assertEqual((await auth(request)).username, "testuser")
+        # 进程内缓存命中时不离开事件循环
+        with mock.patch("core.auth.sync_to_async") as sync:
+            self.assertEqual((await auth(request)).pk, self.user.pk)
+        sync.assert_not_called()
+        self.assertEqual(request.user.pk, self.user.pk)
+
+        with self.assertRaises(InvalidToken):
+            await auth(RequestFactory().get("/", HTTP_AUTHORIZATION="Bearer invalid"))
+
+    def test_async_router_rejects_sync_auth(self):
+        args = (async_employee_service_impl, EmployeeFilters, EmployeeIn, EmployeeOut)
+        with self.assertRaises(ConfigError):
+            AsyncCRUDRouter(*args, auth=CachedJWTAuth())
+        AsyncCRUDRouter(*args, auth=AsyncCachedJWTAuth())
+
+
+class LoginTestCase(UserTestCase):
+    def login(self, password: str, **extra):
+        return self.client.post(
+            "/api/token/pair",
+            {"username": "testuser", "password": password},
+            content_type="application/json",
+            **extra,
+        )
+
+    @override_settings(AUTH_LOGIN_MAX_PER_USER=3)
+    def test_rate_limit_per_username(self):
+        for _ in range(3):
+            self.assertEqual(self.login("wrong").status_code, 401)
+        response = self.login("12345")
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.json()["success"])
+
+    @override_settings(AUTH_LOGIN_MAX_PER_USER=3)
+    def test_success_resets_username_count(self):
+        for _ in range(2):
+            self.login("wrong")
+        self.assertEqual(self.login("12345").status_code, 200)
+        self.assertEqual(self.login("wrong").status_code, 401)
+
+    @override_settings(AUTH_LOGIN_MAX_PER_USER=3)
+    def test_username_limit_per_ip(self):
+        for _ in range(3):
+            self.login("wrong", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(self.login("12345", REMOTE_ADDR="10.0.0.1").status_code, 429)
+        # 其他IP上的错误密码不会把用户锁在外面
+        self.assertEqual(self.login("12345", REMOTE_ADDR="10.0.0.2").status_code, 200)
+
+    @override_settings(AUTH_LOGIN_MAX_PER_IP=2, AUTH_LOGIN_IP_HEADER="HTTP_X_FORWARDED_FOR")
+    def test_ip_from_proxy_header(self):
+        for _ in range(2):
+            self.login("wrong", HTTP_X_FORWARDED_FOR="1.1.1.1, 10.0.0.1")
+        self.assertEqual(self.login("12345", HTTP_X_FORWARDED_FOR="10.0.0.1").status_code, 429)
+        # 经过同一个代理(REMOTE_ADDR相同)的其他客户端不受影响
+        self.assertEqual(self.login("12345", HTTP_X_FORWARDED_FOR="10.0.0.2").status_code, 200)
+
+    def test_check_password_in_gevent_threadpool(self):
+        with mock.patch("core.compat.gevent_patched", return_value=True):
+            self.assertTrue(check_password(self.user, "12345"))
+            self.assertFalse(check_password(self.user, "wrong"))
+
+
+class ListHandler(logging.Handler):
+    """gate不为空时，emit开始后设置started，然后等待gate"""
+
+    def __init__(self, gate: threading.Event = None):
+        super().__init__()
+        self.records = []
+        self.threads = set()
+        self.gate = gate
+        self.started = threading.Event()
+
+    def emit(self, record):
+        self.threads.add(threading.get_ident())
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.records.append(record)
+
+
+class QueueListenerHandlerTestCase(TestCase):
+    def record(self, msg, *args, level=logging.INFO, exc_info=None):
+        return logging.LogRecord("test", level, __file__, 1, msg, args, exc_info)
+
+    def test_records_written_by_listener(self):
+        target = ListHandler()
+        handler = QueueListenerHandler([target])
+        handler.handle(self.record("hello %s", "world"))
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            handler.handle(self.record("boom", level=logging.ERROR, exc_info=sys.exc_info()))
+        handler.close()
+        self.assertEqual([r.getMessage() for r in target.records], ["hello world", "boom"])
+        self.assertIsNone(target.records[1].exc_info)
+        self.assertIn("ZeroDivisionError", target.records[1].exc_text)
+
+    def test_drop_when_queue_full(self):
+        self.check_drop_when_queue_full()
+
+    def test_native_thread_under_gevent(self):
+        with mock.patch("core.compat.gevent_patched", return_value=True):
+            self.check_drop_when_queue_full()
+            target = ListHandler()
+            handler = QueueListenerHandler([target])
+            handler.handle(self.record("hello"))
+            handler.close()
+        self.assertEqual(len(target.records), 1)
+        self.assertNotIn(threading.get_ident(), target.threads)
+
+    def check_drop_when_queue_full(self):
+        gate = threading.Event()
+        target = ListHandler(gate)
+        handler = QueueListenerHandler([target], maxsize=2, policy="drop")
+        # 第一条被后台线程取出后阻塞在target里，后两条占满队列，第四条被丢弃
+        handler.handle(self.record("1"))
+        self.assertTrue(target.started.wait(5))
+        for msg in ("2", "3", "4"):
+            handler.handle(self.record(msg))
+        self.assertEqual(handler.dropped, 1)
+        gate.set()
+        handler.queue.join()
+        handler.handle(self.record("5"))
+        handler.close()
+        messages = [r.getMessage() for r in target.records]
+        self.assertEqual(messages, ["1", "2", "3", "log queue full, dropped 1 records", "5"])
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            QueueListenerHandler([ListHandler()], policy="spill")
+
+    def test_block_level_name(self):
+        self.assertEqual(QueueListenerHandler([ListHandler()], block_level="WARNING").block_level, logging.WARNING)
+        with self.assertRaises(ValueError):
+            QueueListenerHandler([ListHandler()], block_level="LOUD")
+
+
+class JsonFormatterTestCase(TestCase):
+    def test_format(self):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            record = logging.LogRecord("employee", logging.ERROR, __file__, 10, "删除 %s", ("x",), sys.exc_info())
+        record.request_id = "abc"
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "删除 x")
+        self.assertEqual(data["level"], "ERROR")
+        self.assertEqual(data["request_id"], "abc")
+        self.assertIn("ZeroDivisionError", data["exc_info"])
+
+
+class PerformanceMiddlewareTestCase(UserTestCase):
+    @override_settings(PERF_SAMPLE_RATE=1)
+    def test_server_timing(self):
+        ratios = {"l1": 0.5, "l2": 0.25, "lookups": 4}
+        with self.assertLogs("core.perf", "INFO") as logs, mock.patch("core.middleware.hit_ratios", return_value=ratios):
+            response = Client().get("/api/employee/employees", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        metrics = {item.split(";")[0] for item in response["Server-Timing"].split(", ")}
+        self.assertTrue({"db", "auth", "serialize", "total"} <= metrics)
+
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(data["trace_id"], response["TRACE_ID"])
+        self.assertEqual(data["status"], 200)
+        self.assertGreaterEqual(data["db_count"], 1)
+        # 构造分页、构造响应、model_dump和渲染JSON都计入serialize
+        self.assertGreaterEqual(data["serialize_count"], 4)
+        self.assertEqual(data["cache_hit_ratio"], ratios)
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = Client().get("/api/employee/employees", **self.headers)
+        self.assertNotIn("Server-Timing", response)
+
+    def test_timer_outside_request(self):
+        self.assertIsNone(perf.current())
+        with perf.timer("redis"):
+            pass
+        timings, token = perf.start()
+        try:
+            with perf.timer("redis"):
+                pass
+        finally:
+            perf.stop(token)
+        self.assertEqual(timings.metrics["redis"][0], 1)
+        self.assertIsNone(perf.current())
+
+
+class LocalCacheTestCase(TestCase):
+    def test_evict_least_recently_used(self):
+        local = core_cache.LocalCache(max_size=2)
+        local.set("a", 1, 10)
+        local.set("b", 2, 10)
+        local.get("a")
+        local.set("c", 3, 10)
+        self.assertEqual(len(local), 2)
+        self.assertEqual(local.get("a"), 1)
+        self.assertIsNone(local.get("b", None))
+
+    def test_expire(self):
+        local = core_cache.LocalCache(max_size=2)
+        with mock.patch("core.cache.time.monotonic", return_value=100):
+            local.set("a", 1, 5)
+        with mock.patch("core.cache.time.monotonic", return_value=104):
+            self.assertEqual(local.get("a"), 1)
+        with mock.patch("core.cache.time.monotonic", return_value=105):
+            self.assertIsNone(local.get("a", None))
+        self.assertEqual(len(local), 0)
+
+
+class QueryOrCacheTestCase(TestCase):
+    """默认缓存在测试时是fakeredis"""
+
+    def setUp(self):
+        cache.clear()
+        core_cache.get_local_cache().clear()
+        self.redis = get_redis_connection("default")
+
+    def test_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"value": 1}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(core_cache.query_or_cache(60, "default", "k", compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"value": 1}] * 5)
+
+    def test_stale_while_revalidate(self):
+        envelope = {core_cache._ENVELOPE_KEY: time.time() - 1, "value": "old"}
+        self.redis.set("k", json.dumps(envelope))
+        # 其他进程正在重新计算
+        self.redis.set(core_cache._lock_key("k"), "other")
+        compute = mock.Mock(return_value="new")
+        self.assertEqual(core_cache.query_or_cache(60, "default", "k", compute), "old")
+        compute.assert_not_called()
+
+        self.redis.delete(core_cache._lock_key("k"))
+        self.assertEqual(core_cache.query_or_cache(60, "default", "k", compute), "new")
+        compute.assert_called_once()
+
+    def test_invalidate(self):
+        core_cache.query_or_cache(60, "default", "k", lambda: "old")
+        core_cache.invalidate("k")
+        self.assertIsNone(self.redis.get("k"))
+        self.assertEqual(core_cache.query_or_cache(60, "default", "k", lambda: "new"), "new")
+
+    def test_hit_ratios(self):
+        with mock.patch.object(core_cache, "metrics", Counter()):
+            self.assertEqual(core_cache.hit_ratios(), {})
+            for _ in range(2):
+                core_cache.query_or_cache(60, "default", "k", lambda: 1)
+            core_cache.get_local_cache().clear()
+            core_cache.query_or_cache(60, "default", "k", lambda: 1)
+            self.assertEqual(core_cache.hit_ratios(), {"l1": 0.3333, "l2": 0.3333, "lookups": 3})
+
+    def test_ignore_own_invalidate_message(self):
+        local = core_cache.get_local_cache()
+        local.set(("default", "k"), 1, 10)
+        message = {"alias": "default", "key": "k", "sender": core_cache._sender_id()}
+        core_cache._on_invalidate({"data": json.dumps(message)})
+        self.assertEqual(local.get(("default", "k")), 1)
+
+        core_cache._on_invalidate({"data": json.dumps({**message, "sender": "other"})})
+        self.assertIsNone(local.get(("default", "k"), None))
+
+    def test_sender_id_changes_after_fork(self):
+        local = core_cache.get_local_cache()
+        local.set(("default", "k"), 1, 10)
+        parent = core_cache._sender_id()
+        with mock.patch("core.cache.os.getpid", return_value=os.getpid() + 1):
+            self.assertNotEqual(core_cache._sender_id(), parent)
+            # 父进程发出的通知，子进程要删除自己的L1
+            message = {"alias": "default", "key": "k", "sender": parent}
+            core_cache._on_invalidate({"data": json.dumps(message)})
+        self.assertIsNone(local.get(("default", "k"), None))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def ping(self):
+        if not self.alive:
+            raise ConnectionError("gone")
+
+
+class ConnectionPoolTestCase(TestCase):
+    def pool(self, **kwargs):
+        self.created = []
+
+        def connect():
+            conn = FakeConnection()
+            self.created.append(conn)
+            return conn
+
+        def close(conn):
+            conn.closed = True
+
+        options = {"max_size": 2, "timeout": 0.05, "ping_interval": 0}
+        options.update(kwargs)
+        return ConnectionPool(connect=connect, check=lambda conn: conn.ping(), close=close, **options)
+
+    def test_reuse(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(pool.stats()["in_use"], 1)
+
+    def test_timeout_when_exhausted(self):
+        pool = self.pool()
+        pool.acquire(), pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.pool(max_size=1, timeout=5)
+        conn = pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+        waiter.start()
+        while pool.stats()["waiters"] == 0:
+            pass
+        pool.release(conn)
+        waiter.join(5)
+        self.assertEqual(got, [conn])
+
+    def test_health_check_on_checkout(self):
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.alive = False
+        new_conn = pool.acquire()
+        self.assertIsNot(new_conn, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["check_failed"], 1)
+        self.assertEqual(pool.stats()["size"], 1)
+
+    def test_max_lifetime(self):
+        pool = self.pool(max_lifetime=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+
+    def test_connect_error_frees_slot(self):
+        pool = ConnectionPool(
+            connect=mock.Mock(side_effect=ConnectionError), check=lambda conn: None, close=lambda conn: None, max_size=1
+        )
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                pool.acquire()
+        self.assertEqual(pool.stats()["size"], 0)
+
+
+@override_settings(DATABASE_REPLICAS=["replica"], DATABASE_STICKY_SECONDS=5)
+class ReplicaRouterTestCase(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        db_router._health.clear()
+        self.factory = RequestFactory()
+
+    def read_db(self, request=None, write=False, auth=None):
+        """在中间件里执行一次请求，返回请求里读取使用的数据库和响应"""
+        result = {}
+
+        def view(request):
+            if auth is not None:
+                request.auth = auth
+            if write:
+                User.objects.create_user(username="writer", password="12345")
+            result["db"] = User.objects.all().db
+            return HttpResponse()
+
+        response = db_router.ReplicaStickinessMiddleware(view)(request or self.factory.get("/"))
+        return result["db"], response
+
+    def test_read_from_replica(self):
+        self.assertEqual(self.read_db()[0], "replica")
+        # 请求之外走主库
+        self.assertEqual(User.objects.all().db, "default")
+
+    def test_read_your_writes_by_cookie(self):
+        db, response = self.read_db(write=True)
+        self.assertEqual(db, "default")
+        request = self.factory.get("/")
+        request.COOKIES[db_router.STICKY_COOKIE] = response.cookies[db_router.STICKY_COOKIE].value
+        self.assertEqual(self.read_db(request)[0], "default")
+
+    def test_read_your_writes_by_user(self):
+        user = User.objects.create_user(username="testuser", password="12345")
+        self.read_db(write=True, auth=user)
+        self.assertEqual(self.read_db(auth=user)[0], "default")
+        other = User.objects.create_user(username="other", password="12345")
+        self.assertEqual(self.read_db(auth=other)[0], "replica")
+
+    def test_skip_unhealthy_replica(self):
+        with mock.patch("core.db.router.check_replica", return_value=False) as check:
+            self.assertEqual(self.read_db()[0], "default")
+            self.read_db()
+        # 检查结果缓存DATABASE_REPLICA_CHECK_INTERVAL秒
+        self.assertEqual(check.call_count, 1)
+
+    def test_atomic_reads_from_primary(self):
+        def view(request):
+            with transaction.atomic():
+                return HttpResponse(User.objects.all().db)
+
+        response = db_router.ReplicaStickinessMiddleware(view)(self.factory.get("/"))
+        self.assertEqual(response.content, b"default")
+
+
+class BatchTestCase(UserTestCase):
+    def batch(self, operations, atomic=False, **headers):
+        return Client().post(
+            "/api/batch",
+            {"operations": operations, "atomic": atomic},
+            content_type="application/json",
+            **(headers or self.headers),
+        )
+
+    def test_operations_in_one_request(self):
+        create = {"first_name": "John", "last_name": "Doe", "department_id": 1}
+        with mock.patch("core.auth.CachedJWTAuth.get_user", autospec=True, side_effect=CachedJWTAuth.get_user) as get_user:
+            response = self.batch([
+                {"method": "POST", "path": "/api/employee/employees", "body": create},
+                {"method": "PATCH", "path": "/api/employee/employees/1", "body": {"last_name": "Smith"}},
+                {"method": "GET", "path": "/api/employee/employees/1?fields=id,last_name"},
+                {"method": "DELETE", "path": "/api/employee/employees/1"},
+                {"method": "GET", "path": "/api/nowhere"},
+            ])
+        self.assertEqual(get_user.call_count, 1)
+        results = response.json()["data"]
+        self.assertEqual([r["status"] for r in results], [200, 200, 200, 200, 404])
+        self.assertEqual(results[0]["body"]["data"], {"id": 1})
+        self.assertEqual(results[2]["body"]["data"], {"id": 1, "last_name": "Smith"})
+        self.assertEqual(results[2]["body"]["trace_id"], response["TRACE_ID"])
+        self.assertTrue(results[3]["body"]["data"])
+        # 创建人来自批量请求的认证用户
+        self.assertEqual(Employee.objects.get(id=1).creator, "testuser")
+
+    def test_atomic_rollback(self):
+        create = {"first_name": "John", "last_name": "Doe", "department_id": 1}
+        response = self.batch([
+            {"method": "POST", "path": "/api/employee/employees", "body": create},
+            {"method": "PATCH", "path": "/api/employee/employees/99", "body": {"last_name": "Smith"}},
+            {"method": "POST", "path": "/api/employee/employees", "body": create},
+        ], atomic=True)
+        data = response.json()
+        self.assertFalse(data["success"])
+        self.assertEqual([r["status"] for r in data["data"]], [200, 200, 424])
+        self.assertEqual(Employee.objects.count(), 0)
+
+    def test_requires_auth_and_no_nesting(self):
+        self.assertEqual(self.batch([], HTTP_X_NONE="1").status_code, 401)
+        response = self.batch([{"method": "POST", "path": "/api/batch", "body": {"operations": []}}])
+        self.assertEqual(response.json()["data"][0]["status"], 400)
+
+    def test_async_view(self):
+        api = NinjaAPI(urls_namespace="batch_async")
+        api.add_router("/batch", BatchRouter(auth=CachedJWTAuth()))
+        api.add_router("/", AsyncCRUDRouter(
+            async_employee_service_impl, EmployeeFilters, EmployeeIn, EmployeeOut, path="/employees",
+            auth=AsyncCachedJWTAuth(),
+        ))
+        Employee.objects.create(first_name="John", last_name="Doe", department_id=1)
+        urlconf = ModuleType("batch_async_urls")
+        urlconf.urlpatterns = [path("api/", api.urls)]
+        with override_settings(ROOT_URLCONF=urlconf):
+            response = self.batch([
+                {"method": "GET", "path": "/api/employees/1?fields=id,first_name"},
+                {"method": "GET", "path": "/api/employees?page_size=1"},
+            ])
+        results = response.json()["data"]
+        self.assertEqual([r["status"] for r in results], [200, 200])
+        self.assertEqual(results[0]["body"]["data"], {"id": 1, "first_name": "John"})
+        self.assertEqual(results[1]["body"]["data"]["total"], 1)
+
+    @override_settings(BATCH_MAX_OPERATIONS=1)
+    def test_max_operations(self):
+        op = {"method": "GET", "path": "/api/employee/employees"}
+        self.assertFalse(self.batch([op, op]).json()["success"])
+
+
+class GenericCURDTestCase(TestCase):
+    def test_get_obj_fields(self):
+        Employee.objects.create(first_name="John", last_name="Doe", department_id=1)
+        service = GenericCURD(Employee)
+        self.assertEqual(service.get_obj(1, EmployeeOut, fields="id,first_name").data, {"id": 1, "first_name": "John"})
+        self.assertEqual(service.get_obj(1, EmployeeOut).data.last_name, "Doe")
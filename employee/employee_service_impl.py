@@ -6,7 +6,7 @@
 # @Time : 2023/6/15 11:01
 # @Email: lihuacai168@gmail.com
 
-from core.service import GenericCURDSoftDelete
+from core.service import AsyncGenericCURDSoftDelete, GenericCURDSoftDelete
 from employee.models import Employee
 
 
@@ -20,3 +20,15 @@ class EmployeeServiceImpl(GenericCURDSoftDelete):
 
 
 employee_service_impl = EmployeeServiceImpl()
+
+
+class AsyncEmployeeServiceImpl(AsyncGenericCURDSoftDelete):
+    """
+    Employee CURD service for AsyncCRUDRouter
+    """
+
+    def __init__(self):
+        super(AsyncEmployeeServiceImpl, self).__init__(model=Employee)
+
+
+async_employee_service_impl = AsyncEmployeeServiceImpl()
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employee', '0005_alter_department_id_alter_employee_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='department',
+            index=models.Index(fields=['is_deleted', 'id'], name='employee_department_del_id'),
+        ),
+        migrations.AddIndex(
+            model_name='department',
+            index=models.Index(fields=['is_deleted', '-update_at', '-id'], name='employee_department_del_upd'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['is_deleted', 'id'], name='employee_employee_del_id'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['is_deleted', '-update_at', '-id'], name='employee_employee_del_upd'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['is_deleted', 'department'], name='employee_del_department'),
+        ),
+    ]
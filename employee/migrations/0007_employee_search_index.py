@@ -0,0 +1,68 @@
+"""Employee.first_name/last_name的全文搜索索引，core.search按这里的表名查询
+
+SQL直接写在migration里，以后修改core.search不会改变已经执行过的migration
+"""
+from django.db import migrations
+
+# SQLite: FTS5外部内容表，trigram分词(需要SQLite 3.34+)，触发器保持和employee_employee同步
+SQLITE_FORWARDS = [
+    'CREATE VIRTUAL TABLE "employee_employee_fts" USING fts5("first_name", "last_name", '
+    'content="employee_employee", content_rowid="id", tokenize=\'trigram\')',
+    'CREATE TRIGGER "employee_employee_fts_ai" AFTER INSERT ON "employee_employee" BEGIN '
+    'INSERT INTO "employee_employee_fts"(rowid, "first_name", "last_name") '
+    'VALUES (new."id", new."first_name", new."last_name"); END',
+    'CREATE TRIGGER "employee_employee_fts_ad" AFTER DELETE ON "employee_employee" BEGIN '
+    'INSERT INTO "employee_employee_fts"("employee_employee_fts", rowid, "first_name", "last_name") '
+    'VALUES (\'delete\', old."id", old."first_name", old."last_name"); END',
+    # 只有搜索字段变化时才更新索引，软删除和修改其他字段不会触发
+    'CREATE TRIGGER "employee_employee_fts_au" AFTER UPDATE OF "first_name", "last_name" ON "employee_employee" BEGIN '
+    'INSERT INTO "employee_employee_fts"("employee_employee_fts", rowid, "first_name", "last_name") '
+    'VALUES (\'delete\', old."id", old."first_name", old."last_name"); '
+    'INSERT INTO "employee_employee_fts"(rowid, "first_name", "last_name") '
+    'VALUES (new."id", new."first_name", new."last_name"); END',
+    'INSERT INTO "employee_employee_fts"("employee_employee_fts") VALUES (\'rebuild\')',
+]
+SQLITE_BACKWARDS = [
+    'DROP TRIGGER IF EXISTS "employee_employee_fts_ai"',
+    'DROP TRIGGER IF EXISTS "employee_employee_fts_ad"',
+    'DROP TRIGGER IF EXISTS "employee_employee_fts_au"',
+    'DROP TABLE IF EXISTS "employee_employee_fts"',
+]
+# MySQL: FULLTEXT索引，ngram分词
+MYSQL_FORWARDS = [
+    "ALTER TABLE `employee_employee` ADD FULLTEXT INDEX `employee_employee_ft` (`first_name`, `last_name`) "
+    "WITH PARSER ngram",
+]
+MYSQL_BACKWARDS = [
+    "ALTER TABLE `employee_employee` DROP INDEX `employee_employee_ft`",
+]
+
+
+def _run(sqlite_statements, mysql_statements):
+    def run(apps, schema_editor):
+        connection = schema_editor.connection
+        if connection.vendor == "sqlite":
+            # 更早的SQLite没有trigram分词，不创建索引，core.search退回icontains
+            statements = sqlite_statements if connection.Database.sqlite_version_info >= (3, 34) else []
+        elif connection.vendor == "mysql":
+            statements = mysql_statements
+        else:
+            statements = []
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employee", "0006_soft_delete_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run(SQLITE_FORWARDS, MYSQL_FORWARDS),
+            _run(SQLITE_BACKWARDS, MYSQL_BACKWARDS),
+        ),
+    ]
@@ -13,3 +13,9 @@ class Employee(CoreModelSoftDelete):
     last_name = models.CharField(max_length=100)
     department = models.ForeignKey(Department,  on_delete=models.DO_NOTHING, db_constraint=False)
     birthdate = models.DateField(null=True, blank=True)
+
+    class Meta(CoreModelSoftDelete.Meta):
+        indexes = [
+            *CoreModelSoftDelete.Meta.indexes,
+            models.Index(fields=["is_deleted", "department"], name="employee_del_department"),
+        ]
@@ -19,6 +19,8 @@ class EmployeeOut(EmployeeIn):
 
 
 class EmployeeFilters(PageFilter):
+    search_fields = ("first_name", "last_name")
+
     first_name__contains: str = Field(None, alias="first_name")
     last_name__contains: str = Field(None, alias="last_name")
     department_id: Optional[conint(ge=0)] = None
@@ -1,16 +1,33 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
 from json import dumps as json_dumps
+from types import SimpleNamespace
 from typing import Any, Dict, Union
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.test import TestCase
-from employee.employee_service_impl import employee_service_impl
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from core.archive import archive_soft_deleted
+from core.export import StreamEncoder, astream
+from apidemo.celery_config import app as celery_app
+from core.router import AsyncCRUDRouter, CRUDRouter, ImportRouter
+from core.schemas import FileFormat
+from core.service import GenericCURDSoftDelete
+from employee.employee_service_impl import async_employee_service_impl, employee_service_impl
 from employee.models import Employee
-from employee.schemas import EmployeeIn
+from employee.schemas import EmployeeFilters, EmployeeIn, EmployeeOut
 from employee.views import router
 from ninja import NinjaAPI, Router
 from ninja.responses import NinjaJSONEncoder
-from ninja.testing import TestClient
+from ninja.testing import TestAsyncClient, TestClient
 from ninja_jwt.routers.obtain import obtain_pair_router
 
 
@@ -35,6 +52,40 @@ class TokenTestClient(TestClient):
         return self._call(func, request, kwargs)  # type: ignore
 
 
+def employee_router(router_class=CRUDRouter, service_impl=employee_service_impl, **kwargs):
+    """测试用的/employees路由，kwargs是cursor_pagination、etag等开关"""
+    return router_class(
+        service_impl=service_impl,
+        filters_class=EmployeeFilters,
+        in_schema=EmployeeIn,
+        out_schema=EmployeeOut,
+        path="/employees",
+        **kwargs,
+    )
+
+
+def create_employees(count: int, **fields):
+    """创建count个employee，first_name依次是first0、first1..."""
+    for i in range(count):
+        employee_service_impl.create_obj(
+            payload=EmployeeIn(**{"first_name": f"first{i}", "last_name": "Doe", "department_id": 1, **fields}),
+            user_email="huacai",
+        )
+
+
+class EmployeeRouterTestCase(TestCase):
+    """每个测试用新的employee_router和测试客户端，子类通过类属性修改路由"""
+    router_class = CRUDRouter
+    service_impl = employee_service_impl
+    ninja_client_class = TestClient
+    router_kwargs: Dict[str, Any] = {}
+
+    def setUp(self):
+        cache.clear()
+        self.router = employee_router(self.router_class, self.service_impl, **self.router_kwargs)
+        self.client = self.ninja_client_class(self.router)
+
+
 class FastCrudRouterTest(TestCase):
     def setUp(self):
         self.employee_in = EmployeeIn(
@@ -105,8 +156,6 @@ class FastCrudRouterTest(TestCase):
         # no exist id
         response = self.token_client.put("/employees/2", json=update_data).json()
         self.assertEqual(response["success"], False)
-        #
-
 
     def test_partial_update_obj(self):
         partial_update_data = {"first_name": "Partially Updated"}
@@ -133,3 +182,662 @@ class FastCrudRouterTest(TestCase):
         response2 = self.token_client.delete("/employees/1").json()
         self.assertEqual(response2["success"], False)
 
+    def test_bulk_create_obj(self):
+        payload = [
+            {"first_name": "Jane", "last_name": "Smith", "department_id": 2},
+            {"first_name": "Bad"},
+            {"first_name": "Jim", "last_name": "Beam", "department_id": 2, "birthdate": "2000-01-01"},
+            # department不能为空，批量写入失败后逐条重试找出这一行
+            {"first_name": "Jack", "last_name": "Daniels"},
+        ]
+        response = self.token_client.post("/employees/bulk", json=payload).json()
+        self.assertEqual(response["success"], False)
+        self.assertEqual(response["data"]["failed_indexes"], [1, 3])
+        results = response["data"]["results"]
+        self.assertEqual([item["index"] for item in results], [0, 1, 2, 3])
+        self.assertIn("last_name", results[1]["message"])
+        self.assertEqual(Employee.objects.get(id=results[2]["id"]).creator, "string")
+        self.assertEqual(Employee.objects.count(), 3)
+
+    def test_bulk_update_obj(self):
+        employee_service_impl.create_obj(payload=self.employee_in, user_email="huacai")
+        payload = [
+            {"id": 1, "first_name": "Bulk"},
+            {"id": 2, "last_name": "Updated", "department_id": 3},
+            {"id": 99, "first_name": "Missing"},
+            {"id": 1, "birthdate": "not a date"},
+            {"first_name": "no id"},
+        ]
+        response = self.token_client.patch("/employees/bulk", json=payload).json()
+        self.assertEqual(response["data"]["failed_indexes"], [2, 3, 4])
+        first, second = Employee.objects.get(id=1), Employee.objects.get(id=2)
+        self.assertEqual(first.first_name, "Bulk")
+        self.assertEqual(first.updater, "string")
+        self.assertEqual((second.first_name, second.last_name, second.department_id), ("John", "Updated", 3))
+
+    def test_bulk_delete_obj(self):
+        employee_service_impl.create_obj(payload=self.employee_in, user_email="huacai")
+        response = self.token_client.delete("/employees/bulk", json=[1, 2, 3]).json()
+        self.assertEqual(response["data"]["failed_indexes"], [2])
+        self.assertEqual(Employee.objects.filter(is_deleted=0).count(), 0)
+        deleted_marks = set(Employee.objects.values_list("is_deleted", flat=True))
+        self.assertEqual(len(deleted_marks), 2)
+
+    def test_bulk_delete_repeated_id(self):
+        response = self.token_client.delete("/employees/bulk", json=[1, 1, 2, 2]).json()
+        self.assertEqual(response["data"]["failed_indexes"], [2, 3])
+        self.assertEqual([r["id"] for r in response["data"]["results"]], [1, 1, 2, 2])
+        self.assertEqual(Employee.objects.alive().count(), 0)
+
+    def test_bulk_create_without_returning_ids(self):
+        # MySQL的bulk_create拿不到自增id
+        with mock.patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            response = self.token_client.post("/employees/bulk", json=[
+                {"first_name": "Jane", "last_name": "Smith", "department_id": 2},
+            ]).json()
+        self.assertEqual(response["success"], True)
+        self.assertIsNone(response["data"]["results"][0]["id"])
+        self.assertEqual(Employee.objects.count(), 2)
+
+    def test_bulk_bool_id(self):
+        response = self.token_client.patch("/employees/bulk", json=[{"id": True, "first_name": "Bool"}]).json()
+        self.assertEqual(response["data"]["failed_indexes"], [0])
+        self.assertEqual(Employee.objects.get(id=1).first_name, "John")
+        response = self.token_client.delete("/employees/bulk", json=[True])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Employee.objects.alive().count(), 1)
+
+    def test_bulk_too_many_items(self):
+        with self.settings(BULK_MAX_ITEMS=1):
+            response = self.token_client.delete("/employees/bulk", json=[1, 2]).json()
+        self.assertEqual(response["success"], False)
+        self.assertIsNone(response["data"])
+
+
+class CursorPaginationTest(EmployeeRouterTestCase):
+    router_kwargs = {"cursor_pagination": True}
+
+    def setUp(self):
+        super().setUp()
+        create_employees(25)
+
+    def test_walk_all_pages(self):
+        ids, cursor, pages = [], None, 0
+        while True:
+            url = "/employees?page_size=10" + (f"&cursor={cursor}" if cursor else "")
+            data = self.client.get(url).json()["data"]
+            ids.extend(obj["id"] for obj in data["details"])
+            pages += 1
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_cursor_honors_filters(self):
+        names, cursor = [], ""
+        while cursor is not None:
+            data = self.client.get(
+                f"/employees?first_name=first1&page_size=5&cursor={cursor}"
+            ).json()["data"]
+            names.extend(obj["first_name"] for obj in data["details"])
+            cursor = data["next_cursor"]
+        self.assertEqual(names[:5], ["first19", "first18", "first17", "first16", "first15"])
+        self.assertEqual(len(names), 11)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/employees?cursor=bad")
+        self.assertEqual(response.status_code, 400)
+
+
+class PageCountStrategyTest(EmployeeRouterTestCase):
+    def setUp(self):
+        super().setUp()
+        create_employees(12)
+
+    def test_exact(self):
+        data = self.client.get("/employees?page_size=10").json()["data"]
+        self.assertEqual(data["total"], 12)
+        self.assertTrue(data["has_next"])
+        self.assertFalse(data["is_estimate"])
+
+    def test_none_skips_count(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/employees?page_size=10&count=none").json()["data"]
+        self.assertIsNone(data["total"])
+        self.assertTrue(data["has_next"])
+        self.assertEqual(len(data["details"]), 10)
+
+        data = self.client.get("/employees?page_size=10&page_index=2&count=none").json()["data"]
+        self.assertFalse(data["has_next"])
+        self.assertEqual(len(data["details"]), 2)
+
+    def test_cached(self):
+        data = self.client.get("/employees?count=cached").json()["data"]
+        self.assertEqual(data["total"], 12)
+        employee_service_impl.delete_obj(1)
+        with self.assertNumQueries(1):
+            data = self.client.get("/employees?count=cached").json()["data"]
+        self.assertEqual(data["total"], 12)
+        # 不同的过滤条件使用不同的缓存
+        data = self.client.get("/employees?count=cached&first_name=first1").json()["data"]
+        self.assertEqual(data["total"], 3)
+
+    def test_estimate_falls_back_to_exact_on_sqlite(self):
+        data = self.client.get("/employees?count=estimate").json()["data"]
+        self.assertEqual(data["total"], 12)
+        self.assertFalse(data["is_estimate"])
+
+
+class AsyncEmployeeRouterTestCase(EmployeeRouterTestCase):
+    router_class = AsyncCRUDRouter
+    service_impl = async_employee_service_impl
+    ninja_client_class = TestAsyncClient
+
+
+class AsyncCRUDRouterTest(AsyncEmployeeRouterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = SimpleNamespace(username="async_user", is_authenticated=True)
+
+    async def test_crud(self):
+        create_data = {"first_name": "Jane", "last_name": "Smith", "department_id": 2}
+        response = await self.client.post("/employees", json=create_data, user=self.user)
+        obj_id = response.json()["data"]["id"]
+
+        data = (await self.client.get(f"/employees/{obj_id}")).json()["data"]
+        self.assertEqual(data["first_name"], "Jane")
+
+        response = await self.client.patch(
+            f"/employees/{obj_id}", json={"first_name": "Async"}, user=self.user
+        )
+        self.assertEqual(response.json()["success"], True)
+        response = await self.client.put(
+            f"/employees/{obj_id}", json={**create_data, "last_name": "Doe"}, user=self.user
+        )
+        self.assertEqual(response.json()["success"], True)
+
+        page = (await self.client.get("/employees?page_index=9")).json()["data"]
+        self.assertEqual((page["total"], page["page_index"]), (1, 1))
+        self.assertEqual(page["details"][0]["last_name"], "Doe")
+        obj = await Employee.objects.aget(id=obj_id)
+        self.assertEqual(obj.updater, "async_user")
+
+        self.assertEqual((await self.client.delete(f"/employees/{obj_id}")).json()["data"], True)
+        self.assertEqual((await self.client.delete(f"/employees/{obj_id}")).json()["success"], False)
+        self.assertIsNone((await self.client.get(f"/employees/{obj_id}")).json()["data"])
+
+    async def test_bulk_create(self):
+        payload = [{"first_name": "A", "last_name": "B", "department_id": 1}, {}]
+        response = await self.client.post("/employees/bulk", json=payload, user=self.user)
+        self.assertEqual(response.json()["data"]["failed_indexes"], [1])
+        self.assertEqual(await Employee.objects.acount(), 1)
+
+
+class ObjectCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.service = GenericCURDSoftDelete(model=Employee, object_cache_ttl=60)
+        self.service.create_obj(
+            payload=EmployeeIn(first_name="John", last_name="Doe", department_id=1),
+            user_email="huacai",
+        )
+
+    def test_read_through(self):
+        data = self.service.get_obj(1, EmployeeOut).data
+        self.assertEqual(data["first_name"], "John")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.service.get_obj(1, EmployeeOut).data, data)
+
+    def test_write_invalidates(self):
+        self.service.get_obj(1, EmployeeOut)
+        self.service.partial_update(1, "huacai", first_name="Jane")
+        self.assertEqual(self.service.get_obj(1, EmployeeOut).data["first_name"], "Jane")
+
+        self.service.bulk_update_obj([{"id": 1, "last_name": "Bulk"}], EmployeeIn, "huacai")
+        self.assertEqual(self.service.get_obj(1, EmployeeOut).data["last_name"], "Bulk")
+
+        self.service.delete_obj(1)
+        self.assertIsNone(self.service.get_obj(1, EmployeeOut).data)
+
+    def test_negative_cache(self):
+        self.assertIsNone(self.service.get_obj(2, EmployeeOut).data)
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.service.get_obj(2, EmployeeOut).data)
+        # 新建的id不能继续命中不存在的缓存
+        self.service.create_obj(
+            payload=EmployeeIn(first_name="Jim", last_name="Doe", department_id=1),
+            user_email="huacai",
+        )
+        self.assertEqual(self.service.get_obj(2, EmployeeOut).data["first_name"], "Jim")
+
+
+class ETagTest(EmployeeRouterTestCase):
+    router_kwargs = {"etag": True}
+
+    def setUp(self):
+        super().setUp()
+        create_employees(1, first_name="John")
+
+    def test_get_obj_not_modified(self):
+        response = self.client.get("/employees/1")
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        response = self.client.get("/employees/1", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        employee_service_impl.partial_update(1, "huacai", first_name="Jane")
+        response = self.client.get("/employees/1", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["data"]["first_name"], "Jane")
+
+    def test_get_missing_obj_has_no_etag(self):
+        response = self.client.get("/employees/2")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_list_obj_not_modified(self):
+        etag = self.client.get("/employees?page_size=10")["ETag"]
+        response = self.client.get("/employees?page_size=10", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # 查询参数不同，ETag也不同
+        other = self.client.get("/employees?page_size=5")["ETag"]
+        self.assertNotEqual(other, etag)
+
+        employee_service_impl.create_obj(
+            payload=EmployeeIn(first_name="Jim", last_name="Doe", department_id=1),
+            user_email="huacai",
+        )
+        response = self.client.get("/employees?page_size=10", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]["details"]), 2)
+
+    def test_list_not_modified_before_loading_page(self):
+        response = self.client.get("/employees?page_size=10&count=none")
+        self.assertFalse(response.has_header("Last-Modified"))
+        # 只有一次聚合查询，不查这一页的数据
+        with self.assertNumQueries(1), mock.patch.object(employee_service_impl, "list_obj") as list_obj:
+            response = self.client.get("/employees?page_size=10&count=none", headers={"IF-NONE-MATCH": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        list_obj.assert_not_called()
+
+    def test_list_etag_changes_with_fields(self):
+        etag = self.client.get("/employees?page_size=10")["ETag"]
+        response = self.client.get("/employees?page_size=10&fields=id", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_etag_changes_after_soft_delete(self):
+        create_employees(1, first_name="Jim")
+        etag = self.client.get("/employees?page_size=10&count=none")["ETag"]
+        employee_service_impl.delete_obj(2)
+        response = self.client.get("/employees?page_size=10&count=none", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["data"]["details"]), 1)
+
+    def test_cached_obj_etag_without_query(self):
+        client = TestClient(employee_router(service_impl=GenericCURDSoftDelete(model=Employee, object_cache_ttl=60), etag=True))
+        etag = client.get("/employees/1")["ETag"]
+        with self.assertNumQueries(0):
+            response = client.get("/employees/1", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 304)
+
+
+class AsyncETagTest(AsyncEmployeeRouterTestCase):
+    router_kwargs = {"etag": True}
+
+    def setUp(self):
+        super().setUp()
+        create_employees(1)
+
+    async def test_list_obj_not_modified(self):
+        etag = (await self.client.get("/employees"))["ETag"]
+        response = await self.client.get("/employees", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 304)
+        await async_employee_service_impl.adelete_obj(1)
+        response = await self.client.get("/employees", headers={"IF-NONE-MATCH": etag})
+        self.assertEqual(response.status_code, 200)
+
+
+class SparseFieldsTest(EmployeeRouterTestCase):
+    def setUp(self):
+        super().setUp()
+        create_employees(3)
+
+    def test_get_obj_fields(self):
+        response = self.client.get("/employees/1?fields=id,first_name")
+        self.assertEqual(response.json()["data"], {"id": 1, "first_name": "first0"})
+
+    def test_list_obj_fields(self):
+        data = self.client.get("/employees?fields=first_name&page_size=2").json()["data"]
+        self.assertEqual(data["total"], 3)
+        self.assertEqual(data["details"], [{"first_name": "first0"}, {"first_name": "first1"}])
+
+    def test_cursor_list_obj_fields(self):
+        client = TestClient(employee_router(cursor_pagination=True))
+        data = client.get("/employees?fields=first_name&page_size=2").json()["data"]
+        self.assertEqual(data["details"], [{"first_name": "first2"}, {"first_name": "first1"}])
+        cursor = data["next_cursor"]
+        data = client.get(f"/employees?fields=first_name&page_size=2&cursor={cursor}").json()["data"]
+        self.assertEqual(data["details"], [{"first_name": "first0"}])
+
+    def test_unknown_fields(self):
+        # creator是模型字段，但不在out_schema里
+        response = self.client.get("/employees?fields=first_name,creator")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("creator", response.json()["detail"])
+
+
+class BatchGetTest(EmployeeRouterTestCase):
+    def setUp(self):
+        super().setUp()
+        create_employees(3)
+        employee_service_impl.delete_obj(2)
+
+    def test_keep_order_and_report_missing(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/employees/batch?ids=3,1,2,9,3").json()["data"]
+        self.assertEqual([item["id"] for item in data["details"]], [3, 1])
+        self.assertEqual(data["missing_ids"], [2, 9])
+
+        data = self.client.get("/employees/batch?ids=1&ids=3").json()["data"]
+        self.assertEqual([item["id"] for item in data["details"]], [1, 3])
+
+    def test_post_and_fields(self):
+        response = self.client.post("/employees/batch?fields=first_name", json=[3, 1])
+        self.assertEqual(response.json()["data"], {
+            "details": [{"first_name": "first2"}, {"first_name": "first0"}], "missing_ids": [],
+        })
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.client.get("/employees/batch?ids=1,a").status_code, 400)
+
+    def test_object_cache_serves_hits_first(self):
+        service = GenericCURDSoftDelete(model=Employee, object_cache_ttl=60)
+        service.get_obj(1, EmployeeOut)
+        with self.assertNumQueries(1) as queries:
+            data = service.get_many([1, 3, 9], EmployeeOut).data
+        # 缓存命中的id不再查询
+        self.assertIn('IN (3, 9)', queries.captured_queries[0]["sql"])
+        self.assertEqual([item["id"] for item in data["details"]], [1, 3])
+        self.assertEqual(data["missing_ids"], [9])
+        with self.assertNumQueries(0):
+            self.assertEqual(service.get_many([1, 3, 9], EmployeeOut).data, data)
+
+
+class AsyncBatchGetTest(AsyncEmployeeRouterTestCase):
+    async def test_get_many(self):
+        await Employee.objects.acreate(first_name="a", last_name="b", department_id=1)
+        data = (await self.client.get("/employees/batch?ids=5,1")).json()["data"]
+        self.assertEqual(([item["id"] for item in data["details"]], data["missing_ids"]), ([1], [5]))
+
+    async def test_get_many_fields(self):
+        await Employee.objects.acreate(first_name="a", last_name="b", department_id=1)
+        data = (await self.client.get("/employees/batch?ids=5,1&fields=first_name")).json()["data"]
+        self.assertEqual(data, {"details": [{"first_name": "a"}], "missing_ids": [5]})
+
+
+class SingleStatementUpdateTest(TestCase):
+    def setUp(self):
+        create_employees(1, first_name="John")
+
+    def test_partial_update_one_query(self):
+        before = Employee.objects.get(id=1).update_at
+        with self.assertNumQueries(1):
+            result = employee_service_impl.partial_update(1, "jane", first_name="Jane")
+        self.assertTrue(result.success)
+        obj = Employee.objects.get(id=1)
+        self.assertEqual((obj.first_name, obj.last_name, obj.updater), ("Jane", "Doe", "jane"))
+        self.assertGreater(obj.update_at, before)
+
+    def test_update_deleted_obj(self):
+        employee_service_impl.delete_obj(1)
+        result = employee_service_impl.partial_update(1, "huacai", first_name="Jane")
+        self.assertFalse(result.success)
+        self.assertEqual(result.message, "id=1 not exist")
+        result = employee_service_impl.update_obj(
+            1, EmployeeIn(first_name="A", last_name="B", department_id=1), "huacai"
+        )
+        self.assertFalse(result.success)
+
+    def test_partial_update_rejects_protected_fields(self):
+        client = TestClient(employee_router())
+        for payload in ({"is_deleted": "gone", "creator": "evil"}, {"id": 2}, {"birthdate": "not a date"}):
+            response = client.patch("/employees/1", json=payload).json()
+            self.assertFalse(response["success"], payload)
+        result = employee_service_impl.partial_update(1, "huacai", update_at=None)
+        self.assertEqual(result.message, "fields can not be updated: update_at")
+        obj = Employee.objects.get(id=1)
+        self.assertEqual((obj.is_deleted, obj.creator, obj.birthdate), ("0", "huacai", None))
+
+    async def test_async_partial_update_validates_fields(self):
+        result = await async_employee_service_impl.apartial_update(1, "huacai", EmployeeIn, first_name="Jane", x=1)
+        self.assertEqual(result.message, "unknown field x")
+        result = await async_employee_service_impl.apartial_update(1, "huacai", EmployeeIn, birthdate="2000-01-01")
+        self.assertTrue(result.success)
+        self.assertEqual(str((await Employee.objects.aget(id=1)).birthdate), "2000-01-01")
+
+
+class SoftDeleteQuerySetTest(TestCase):
+    def setUp(self):
+        for name in ("John", "Jane"):
+            employee_service_impl.create_obj(
+                payload=EmployeeIn(first_name=name, last_name="Doe", department_id=1),
+                user_email="huacai",
+            )
+        employee_service_impl.delete_obj(2)
+
+    def test_alive_and_dead(self):
+        self.assertEqual(list(Employee.objects.alive().values_list("id", flat=True)), [1])
+        self.assertEqual(list(Employee.objects.dead().values_list("id", flat=True)), [2])
+
+    def test_alive_uses_index(self):
+        plan = Employee.objects.alive().order_by("-update_at", "-id").explain()
+        self.assertIn("employee_employee_del_upd", plan)
+
+
+class ArchiveSoftDeletedTest(TestCase):
+    def setUp(self):
+        create_employees(5)
+        employee_service_impl.bulk_delete_obj([1, 2, 3, 4])
+        # 4号刚删除，不到归档时间
+        Employee.objects.filter(id__in=[1, 2, 3]).update(
+            update_at=timezone.now() - datetime.timedelta(days=40)
+        )
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+
+    def test_archive_in_batches(self):
+        with override_settings(ARCHIVE_DIR=self.archive_dir.name):
+            report = archive_soft_deleted(Employee, batch_size=2, sleep=0)
+            self.assertEqual(report["rows"], 3)
+            self.assertGreater(report["bytes"], 0)
+            self.assertEqual(set(Employee.objects.values_list("id", flat=True)), {4, 5})
+
+            with gzip.open(report["file"], "rt") as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual([row["id"] for row in rows], [1, 2, 3])
+
+            # 已经归档完，再执行不会重复写入
+            self.assertEqual(archive_soft_deleted(Employee, sleep=0)["rows"], 0)
+
+    def test_max_rows(self):
+        with override_settings(ARCHIVE_DIR=self.archive_dir.name):
+            report = archive_soft_deleted(Employee, batch_size=2, sleep=0, max_rows=1)
+        self.assertEqual(report["rows"], 1)
+        self.assertEqual(Employee.objects.dead().count(), 3)
+
+
+class SearchTest(EmployeeRouterTestCase):
+    def setUp(self):
+        super().setUp()
+        for first_name, last_name in [
+            ("John", "Smith"), ("Johnny", "Walker"), ("Jane", "Johnson"), ("Mary", "Jones"),
+        ]:
+            employee_service_impl.create_obj(
+                payload=EmployeeIn(first_name=first_name, last_name=last_name, department_id=1),
+                user_email="huacai",
+            )
+
+    def search(self, term: str) -> list:
+        data = self.client.get(f"/employees?q={term}&fields=first_name").json()["data"]
+        return [obj["first_name"] for obj in data["details"]]
+
+    def test_prefix_search(self):
+        self.assertEqual(set(self.search("john")), {"John", "Johnny", "Jane"})
+        self.assertEqual(self.search("john smith"), ["John"])
+        self.assertEqual(self.search("zzz"), [])
+
+    def test_index_follows_writes(self):
+        employee_service_impl.partial_update(4, "huacai", first_name="Johanna")
+        self.assertEqual(self.search("johanna"), ["Johanna"])
+        self.assertEqual(self.search("mary"), [])
+        # 软删除的数据不返回
+        employee_service_impl.delete_obj(1)
+        self.assertNotIn("John", self.search("john"))
+
+    def test_invalid_syntax_is_quoted(self):
+        self.assertEqual(self.search('"john AND'), [])
+
+    def test_substring_search(self):
+        self.assertEqual(set(self.search("ohn")), {"John", "Johnny", "Jane"})
+        # 少于3个字符时退回icontains
+        self.assertEqual(set(self.search("ar")), {"Mary"})
+
+    def test_short_words_are_and_ed(self):
+        # 有少于3个字符的词时退回icontains，和FTS一样每个词都要匹配
+        self.assertEqual(self.search("jo sm"), ["John"])
+        self.assertEqual(self.search("jo xx"), [])
+
+    def test_old_sqlite_falls_back_to_icontains(self):
+        with mock.patch("core.search.TRIGRAM_MIN_SQLITE", (99,)):
+            self.assertEqual(self.search("john smith"), ["John"])
+            self.assertEqual(set(self.search("ohn")), {"John", "Johnny", "Jane"})
+
+    def test_chinese_search(self):
+        for first_name, last_name in [("三丰", "张"), ("欧阳娜娜", "欧阳")]:
+            employee_service_impl.create_obj(
+                payload=EmployeeIn(first_name=first_name, last_name=last_name, department_id=1),
+                user_email="huacai",
+            )
+        self.assertEqual(self.search("阳娜娜"), ["欧阳娜娜"])
+        self.assertEqual(self.search("三丰"), ["三丰"])
+
+    def test_search_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.client.get("/employees?q=john&count=none").json()["data"]
+        self.assertEqual(data["details"][0]["first_name"], "John")
+
+
+class ExportTest(EmployeeRouterTestCase):
+    def setUp(self):
+        super().setUp()
+        for i in range(5):
+            employee_service_impl.create_obj(
+                payload=EmployeeIn(first_name=f"first{i}", last_name="Doe", department_id=i % 2),
+                user_email="huacai",
+            )
+
+    def test_export_ndjson(self):
+        response = self.client.get("/employees/export?department_id=1")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in response.content.decode().splitlines()]
+        self.assertEqual([row["first_name"] for row in rows], ["first1", "first3"])
+        self.assertEqual(set(rows[0]), set(EmployeeOut.model_fields))
+
+    def test_export_csv_gzip(self):
+        response = self.client.get("/employees/export?format=csv&fields=id,first_name&gzip=true")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        lines = gzip.decompress(response.content).decode().splitlines()
+        self.assertEqual(lines[0], "id,first_name")
+        self.assertEqual(lines[1:], [f"{i + 1},first{i}" for i in range(5)])
+
+    def test_export_ignores_page_size(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response = self.client.get("/employees/export?page_size=1")
+        self.assertEqual(len(response.content.decode().splitlines()), 5)
+
+    def test_export_reads_keyset_chunks(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2), self.assertNumQueries(3):
+            fields, rows = employee_service_impl.export_rows(EmployeeFilters(), EmployeeOut)
+            self.assertEqual([row["first_name"] for row in rows], [f"first{i}" for i in range(5)])
+
+    def test_export_search_results(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            fields, rows = employee_service_impl.export_rows(EmployeeFilters(q="first3"), EmployeeOut)
+            self.assertEqual([row["first_name"] for row in rows], ["first3"])
+
+    async def test_async_export_rows(self):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            fields, rows = async_employee_service_impl.aexport_rows(
+                EmployeeFilters(first_name="first"), EmployeeOut
+            )
+        encoder = StreamEncoder(FileFormat.ndjson, fields)
+        content = b"".join([chunk async for chunk in astream(rows, encoder)])
+        self.assertEqual(len(content.decode().splitlines()), 5)
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        self.import_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.import_dir.cleanup)
+        settings_override = override_settings(IMPORT_DIR=self.import_dir.name, IMPORT_BATCH_SIZE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+        self.user = SimpleNamespace(username="huacai")
+        self.client = TestClient(ImportRouter(
+            service_impl=employee_service_impl, in_schema=EmployeeIn, path="/employees/import"
+        ))
+
+    def test_import_ndjson_upload(self):
+        lines = [
+            {"first_name": "A", "last_name": "Doe", "department_id": 1},
+            {"first_name": "B"},
+            "not json",
+            {"first_name": "C", "last_name": "Doe", "department_id": 1, "birthdate": "2000-01-01"},
+        ]
+        content = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines)
+        upload = SimpleUploadedFile("employees.ndjson", content.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            job = self.client.post("/employees/import", FILES={"file": upload}, user=self.user).json()["data"]
+        self.assertEqual(job["status"], "pending")
+
+        job = self.client.get(f"/employees/import/{job['id']}").json()["data"]
+        self.assertEqual(job["status"], "success")
+        self.assertEqual((job["processed_rows"], job["created_rows"], job["failed_rows"]), (4, 2, 2))
+        self.assertEqual([error["line"] for error in job["errors"]], [2, 3])
+        self.assertEqual(
+            list(Employee.objects.values_list("first_name", "creator")), [("A", "huacai"), ("C", "huacai")]
+        )
+        # 上传的文件导入后删除
+        self.assertEqual(os.listdir(self.import_dir.name), [])
+
+    def test_uploaded_file_removed_when_job_failed(self):
+        upload = SimpleUploadedFile("employees.ndjson", b'{"first_name": "A"}')
+        with mock.patch("core.importer._import_batch", side_effect=RuntimeError("boom")):
+            with self.captureOnCommitCallbacks(execute=True):
+                job = self.client.post("/employees/import", FILES={"file": upload}, user=self.user).json()["data"]
+        job = self.client.get(f"/employees/import/{job['id']}").json()["data"]
+        self.assertEqual((job["status"], job["message"]), ("failed", "boom"))
+        self.assertEqual(os.listdir(self.import_dir.name), [])
+
+    def test_import_server_side_csv(self):
+        path = f"{self.import_dir.name}/employees.csv"
+        with open(path, "w") as f:
+            f.write("first_name,last_name,department_id,birthdate\nA,Doe,1,\nB,Doe,2,1990-05-01\n")
+        with self.captureOnCommitCallbacks(execute=True):
+            job = self.client.post("/employees/import", data={"file_path": "employees.csv"}, user=self.user).json()["data"]
+        job = self.client.get(f"/employees/import/{job['id']}").json()["data"]
+        self.assertEqual((job["status"], job["created_rows"]), ("success", 2))
+        self.assertTrue(os.path.exists(path))
+
+    def test_file_path_outside_import_dir(self):
+        response = self.client.post("/employees/import", data={"file_path": "../../etc/passwd"})
+        self.assertEqual(response.status_code, 400)
@@ -3,11 +3,11 @@ import logging
 from typing import Optional
 
 from ninja import Schema
-from ninja_jwt.authentication import JWTAuth
 from pydantic.fields import Field
 from pydantic.types import conint
 
-from core.router import CRUDRouter
+from core.auth import CachedJWTAuth
+from core.router import CRUDRouter, ImportRouter
 from employee.employee_service_impl import employee_service_impl
 from employee.schemas import EmployeeFilters, EmployeeIn, EmployeeOut
 
@@ -29,5 +29,16 @@ router = CRUDRouter(
     out_schema=EmployeeOut,
     path="/employees",
     tags=["employees"],
-    auth=JWTAuth()
+    auth=CachedJWTAuth(),
+    etag=True,
+)
+
+
+# 批量导入，要在router之前注册，否则POST /employees/import会匹配到/employees/{id}
+import_router = ImportRouter(
+    service_impl=employee_service_impl,
+    in_schema=EmployeeIn,
+    path="/employees/import",
+    tags=["employees"],
+    auth=CachedJWTAuth(),
 )
@@ -4,6 +4,7 @@ import traceback
 
 from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from pydantic import conint
 
 from core.schemas import StandResponse, DictId, OptionalDictResponseType
@@ -13,6 +14,9 @@ logger = logging.getLogger(__name__)
 
 GenericPayload = TypeVar("GenericPayload")
 
+# 审计和软删除字段由服务端维护，部分更新不能修改
+PROTECTED_FIELDS = frozenset({"id", "is_deleted", "creator", "updater", "create_at", "update_at"})
+
 
 def create(creator: str, model: CoreModel, payload: GenericPayload) -> StandResponse[Optional[DictId]]:
     """创建对象"""
@@ -69,10 +73,75 @@ def update(updater: str, model: CoreModel, payload: GenericPayload, obj_id: coni
     return _update(obj=obj, payload=payload.dict(), updater=updater)
 
 
+def _protected_error(payload: dict) -> Optional[OptionalDictResponseType]:
+    protected = sorted(PROTECTED_FIELDS.intersection(payload))
+    if protected:
+        return OptionalDictResponseType(
+            success=False, message=f"fields can not be updated: {', '.join(protected)}", data=None
+        )
+    return None
+
+
 def partial_update(updater: str, model: CoreModel, obj_id: conint(ge=1), **kwargs) -> OptionalDictResponseType:
+    error = _protected_error(kwargs)
+    if error:
+        return error
     obj = get_object_or_404(model, id=obj_id)
     return _update(obj=obj, payload=kwargs, updater=updater)
 
 
 def update_by_obj(obj: CoreModel, updater: str, **kwargs) -> OptionalDictResponseType:
     return _update(obj=obj, payload=kwargs, updater=updater)
+
+
+def _update_values(updater: str, payload: dict) -> dict:
+    # QuerySet.update不会触发auto_now，需要手动设置update_at
+    return {**payload, "updater": updater, "update_at": timezone.now()}
+
+
+def _update_result(model: CoreModel, obj_id: int, rows: int) -> OptionalDictResponseType:
+    if not rows:
+        return OptionalDictResponseType(success=False, message=f"id={obj_id} not exist", data={})
+    logger.info(f"update {model.__name__} success, id: {obj_id}")
+    return OptionalDictResponseType(data=DictId(id=obj_id))
+
+
+def update_fields(updater: str, model: CoreModel, obj_id: int, filters: Optional[dict] = None, **kwargs) -> OptionalDictResponseType:
+    """一条UPDATE语句只更新传入的字段，不先查询对象，按影响行数判断对象是否存在"""
+    logger.info(f"input: update={model.__name__}, id={obj_id}, payload={kwargs}")
+    error = _protected_error(kwargs)
+    if error:
+        return error
+    try:
+        rows = model.objects.filter(id=obj_id, **(filters or {})).update(**_update_values(updater, kwargs))
+    except Exception as e:
+        logger.warning(traceback.format_exc())
+        return OptionalDictResponseType(success=False, message=str(e), data=None)
+    return _update_result(model, obj_id, rows)
+
+
+async def aupdate_fields(updater: str, model: CoreModel, obj_id: int, filters: Optional[dict] = None, **kwargs) -> OptionalDictResponseType:
+    """update_fields的async ORM版本"""
+    logger.info(f"input: update={model.__name__}, id={obj_id}, payload={kwargs}")
+    error = _protected_error(kwargs)
+    if error:
+        return error
+    try:
+        rows = await model.objects.filter(id=obj_id, **(filters or {})).aupdate(**_update_values(updater, kwargs))
+    except Exception as e:
+        logger.warning(traceback.format_exc())
+        return OptionalDictResponseType(success=False, message=str(e), data=None)
+    return _update_result(model, obj_id, rows)
+
+
+async def acreate(creator: str, model: CoreModel, payload: GenericPayload) -> StandResponse[Optional[DictId]]:
+    """创建对象，async ORM版本"""
+    try:
+        logger.info(f"input: create={model.__name__}, payload={payload.dict()}")
+        obj = await model.objects.acreate(creator=creator, **payload.dict())
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        return StandResponse[Optional[DictId]](success=False, message=str(e), data=None)
+    logger.info(f"create {model.__name__} success, id: {obj.id}")
+    return StandResponse[Optional[DictId]](data=DictId(id=obj.id))
+